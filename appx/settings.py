@@ -262,6 +262,17 @@ CACHES = {
     }
 }
 
+# Алиас кэша для данных сайдбара каталога и поиска (index.sidebar)
+SIDEBAR_CACHE = 'default'
+
+# Бэкенд поиска товаров (index.search). FTS5 — только для SQLite;
+# на других СУБД — 'index.search.SimpleSearchBackend'
+SEARCH_BACKEND = 'index.search.FTS5SearchBackend'
+
+# Матрицы признаков блока «Похожие товары» (index.similar, rebuild_similar_index).
+# Каталог общий для всех воркеров одного сервера
+SIMILAR_INDEX_DIR = BASE_DIR / 'var' / 'similar'
+
 # Django Axes settings (защита от брутфорса)
 AXES_ENABLED = True
 AXES_FAILURE_LIMIT = 5  # Максимум 5 неудачных попыток
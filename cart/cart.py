@@ -1,7 +1,67 @@
+import hashlib
+import json
+from collections import namedtuple
 from decimal import Decimal
 from django.conf import settings
-from django.db.models import Sum
-from index.models import Product
+from django.core.cache import cache
+from django.db.models import DecimalField, F, Sum
+from index.models import Product, Stock
+from index.versions import PRICES_VERSION_KEY, bump_around_commit, get_counters
+
+# Сводка корзины вошедшего пользователя кэшируется по версии его корзины
+# и версии цен (итоговые цены, удаление товаров) — устаревшие ключи не читаются
+CART_VERSION_KEY = 'cart_version:{}'
+CART_SUMMARY_KEY = 'cart_summary:{}:{}:{}'
+CART_SUMMARY_TIMEOUT = 60 * 60 * 24
+
+CartSummary = namedtuple('CartSummary', 'count total version')
+
+_TOTAL_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+
+def get_cart(request):
+    """Корзина запроса — одна на запрос, вместе со своей сводкой."""
+    user_id = request.user.pk if request.user.is_authenticated else None
+    cart = getattr(request, '_cart', None)
+    if cart is None or cart.user_id != user_id:
+        cart = request._cart = Cart(request)
+    return cart
+
+
+def bump_cart_version(user_id):
+    """Сводка корзины устарела — для этого запроса и после коммита."""
+    bump_around_commit([CART_VERSION_KEY.format(user_id)])
+
+
+def _line(product, price, quantity):
+    try:
+        available = product.stock.quantity
+    except Stock.DoesNotExist:
+        available = 0
+    return {
+        'product': product,
+        'price': price,
+        'quantity': quantity,
+        'total_price': price * quantity,
+        'available': available,
+    }
+
+
+class CartSnapshot:
+    """
+    Позиции корзины на момент загрузки: строки, сумма, число товаров и нехватка
+    остатков считаются один раз — страница корзины, счётчик и оформление
+    заказа в одном запросе читают одно и то же.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.count = sum(line['quantity'] for line in lines)
+        self.total = sum((line['total_price'] for line in lines), Decimal('0.00'))
+        self.out_of_stock = [line for line in lines if line['available'] < line['quantity']]
+
+    def __len__(self):
+        return len(self.lines)
 
 
 class Cart:
@@ -9,12 +69,15 @@ class Cart:
         self.request = request
         self.session = request.session
         self.user = request.user if request.user.is_authenticated else None
+        self.user_id = self.user.pk if self.user else None
 
         # Сессионная корзина — для анонимов и для мержа при логине
         self.cart = self.session.get(settings.CART_SESSION_ID, {})
 
         self._db_cart_cached = None
         self._db_cart_loaded = False
+        self._summary = None
+        self._snapshot = None
 
     @property
     def db_cart(self):
@@ -27,21 +90,28 @@ class Cart:
         return self._db_cart_cached
 
     def add(self, product, quantity=1, update_quantity=False):
-        if self.db_cart is not None:
-            from .models import DBCartItem
-            item, created = DBCartItem.objects.get_or_create(
-                cart=self.db_cart,
-                product=product,
-                defaults={'quantity': quantity},
+        self.add_many({product: quantity}, update_quantity=update_quantity)
+
+    def add_many(self, quantities, update_quantity=False):
+        """
+        Добавляет несколько товаров одной записью: upsert в БД-корзину
+        или одно сохранение сессии.
+
+        Args:
+            quantities: {товар: количество}
+        """
+        if not quantities:
+            return
+        if self.user:
+            from .upsert import add_items
+            add_items(
+                self.user_id,
+                {product.id: quantity for product, quantity in quantities.items()},
+                replace=update_quantity,
             )
-            if not created:
-                if update_quantity:
-                    item.quantity = quantity
-                else:
-                    item.quantity += quantity
-                item.save()
-            self.db_cart.save()  # обновляем updated_at
-        else:
+            self._changed()
+            return
+        for product, quantity in quantities.items():
             product_id = str(product.id)
             if product_id not in self.cart:
                 self.cart[product_id] = {'quantity': 0,
@@ -51,7 +121,7 @@ class Cart:
                 self.cart[product_id]['quantity'] = quantity
             else:
                 self.cart[product_id]['quantity'] += quantity
-            self.save()
+        self.save()
 
     def remove(self, product):
         if self.user:
@@ -64,69 +134,99 @@ class Cart:
                 # Сбрасываем кэш, чтобы при следующей итерации загрузились актуальные данные
                 self._db_cart_cached = None
                 self._db_cart_loaded = False
+                self._changed()
         else:
             product_id = str(product.id)
             if product_id in self.cart:
                 del self.cart[product_id]
                 self.save()
 
+    @property
+    def snapshot(self):
+        """Позиции корзины с товарами, скидками и остатками — один запрос за запрос."""
+        if self._snapshot is None:
+            lines = self._db_lines() if self.user else self._session_lines()
+            self._snapshot = CartSnapshot(lines)
+        return self._snapshot
+
+    def _db_lines(self):
+        from .models import DBCartItem
+        items = (
+            DBCartItem.objects
+            .filter(cart__user_id=self.user_id)
+            .select_related('product', 'product__discount', 'product__stock')
+            .order_by('id')
+        )
+        return [
+            _line(item.product, item.product.get_final_price(), item.quantity)
+            for item in items
+        ]
+
+    def _session_lines(self):
+        products = Product.objects.select_related('discount', 'stock').in_bulk(
+            [int(pid) for pid in self.cart]
+        )
+        # Удаляем из сессии товары, которых больше нет в БД
+        stale_ids = [pid for pid in self.cart if int(pid) not in products]
+        if stale_ids:
+            for pid in stale_ids:
+                del self.cart[pid]
+            self.save()
+        return [
+            _line(products[int(pid)], Decimal(data['price']), data['quantity'])
+            for pid, data in self.cart.items()
+        ]
+
     def __iter__(self):
-        if self.db_cart is not None:
+        return iter(self.snapshot.lines)
+
+    @property
+    def summary(self):
+        """
+        Число товаров, сумма и версия корзины — не больше одного расчёта за запрос.
+
+        Для вошедших сводка живёт в кэше между запросами: просмотр каталога
+        не делает запросов к корзине, пока она или цены не изменились.
+        """
+        if self._summary is None:
+            self._summary = self._db_summary() if self.user else self._session_summary()
+        return self._summary
+
+    def _db_summary(self):
+        version_key = CART_VERSION_KEY.format(self.user_id)
+        found = get_counters([version_key, PRICES_VERSION_KEY])
+        version, prices = found[version_key], found[PRICES_VERSION_KEY]
+        key = CART_SUMMARY_KEY.format(self.user_id, version, prices)
+        summary = cache.get(key)
+        if summary is None and self._snapshot is not None:
+            # Позиции уже загружены в этом запросе — агрегат не нужен
+            summary = CartSummary(self._snapshot.count, self._snapshot.total, f'{version}:{prices}')
+            cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+        elif summary is None:
             from .models import DBCartItem
-            items = (
-                DBCartItem.objects
-                .filter(cart=self.db_cart)
-                .select_related('product', 'product__discount')
+            result = DBCartItem.objects.filter(cart__user_id=self.user_id).aggregate(
+                count=Sum('quantity'),
+                total=Sum(F('quantity') * F('product__final_price'), output_field=_TOTAL_FIELD),
             )
-            for item in items:
-                yield {
-                    'product': item.product,
-                    'price': item.product.get_final_price(),
-                    'quantity': item.quantity,
-                    'total_price': item.get_total_price(),
-                }
-        else:
-            product_ids = list(self.cart.keys())
-            products = Product.objects.filter(id__in=product_ids)
-            products_dict = {str(p.id): p for p in products}
-            # Удаляем из сессии товары, которых больше нет в БД
-            stale_ids = [pid for pid in product_ids if pid not in products_dict]
-            if stale_ids:
-                for pid in stale_ids:
-                    del self.cart[pid]
-                self.save()
-            for product_id, data in list(self.cart.items()):
-                product = products_dict.get(product_id)
-                if product:
-                    price = Decimal(data['price'])
-                    yield {
-                        'product': product,
-                        'price': price,
-                        'quantity': data['quantity'],
-                        'total_price': price * data['quantity'],
-                    }
+            summary = CartSummary(
+                result['count'] or 0, result['total'] or Decimal('0.00'), f'{version}:{prices}',
+            )
+            cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+        return summary
+
+    def _session_summary(self):
+        digest = hashlib.md5(json.dumps(self.cart, sort_keys=True).encode()).hexdigest()
+        return CartSummary(
+            sum(item['quantity'] for item in self.cart.values()),
+            sum((Decimal(item['price']) * item['quantity'] for item in self.cart.values()), Decimal('0.00')),
+            digest,
+        )
 
     def __len__(self):
-        if self.user:
-            from .models import DBCartItem
-            result = DBCartItem.objects.filter(
-                cart__user=self.user
-            ).aggregate(total=Sum('quantity'))
-            return result['total'] or 0
-        return sum(item['quantity'] for item in self.cart.values())
+        return self.summary.count
 
     def get_total_price(self):
-        if self.db_cart is not None:
-            return sum(
-                item.product.get_final_price() * item.quantity
-                for item in self.db_cart.items.select_related(
-                    'product', 'product__discount'
-                )
-            )
-        return sum(
-            Decimal(item['price']) * item['quantity']
-            for item in self.cart.values()
-        )
+        return self.summary.total
 
     def clear(self):
         if self.db_cart is not None:
@@ -134,39 +234,41 @@ class Cart:
             # Сбрасываем кэш
             self._db_cart_cached = None
             self._db_cart_loaded = False
+            self._changed()
         else:
             self.session.pop(settings.CART_SESSION_ID, None)
             self.cart = {}
             self.session.modified = True
+            self._summary = None
+            self._snapshot = None
+
+    def _changed(self):
+        """Запись в БД-корзину: сводка и позиции этого запроса и закэшированная сводка устарели."""
+        self._summary = None
+        self._snapshot = None
+        bump_cart_version(self.user_id)
 
     def save(self):
         self.session[settings.CART_SESSION_ID] = self.cart
         self.session.modified = True
+        self._summary = None
+        self._snapshot = None
 
     def merge_session_cart(self):
         """Переносит товары из сессионной корзины в БД-корзину при логине."""
         session_cart = self.session.get(settings.CART_SESSION_ID)
-        if not session_cart or self.db_cart is None:
+        if not session_cart or not self.user:
             return
 
-        from .models import DBCartItem
+        from .upsert import add_items
         product_ids = [int(pid) for pid in session_cart.keys()]
-        products = {p.id: p for p in Product.objects.filter(id__in=product_ids)}
-
-        for pid_str, data in session_cart.items():
-            pid = int(pid_str)
-            product = products.get(pid)
-            if not product:
-                continue
-            item, created = DBCartItem.objects.get_or_create(
-                cart=self.db_cart,
-                product=product,
-                defaults={'quantity': data['quantity']},
-            )
-            if not created:
-                item.quantity += data['quantity']
-                item.save()
+        existing = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        # Все позиции — одним upsert-ом
+        add_items(self.user_id, {
+            int(pid): data['quantity']
+            for pid, data in session_cart.items() if int(pid) in existing
+        })
 
         self.session.pop(settings.CART_SESSION_ID, None)
         self.session.modified = True
-        self.db_cart.save()
+        self._changed()
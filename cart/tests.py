@@ -2,6 +2,8 @@ from decimal import Decimal
 from django.test import TestCase, RequestFactory
 from django.contrib.sessions.backends.db import SessionStore
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import MagicMock
 
 from index.models import Product, Category, Brand
@@ -125,6 +127,114 @@ class DBCartTest(TestCase):
         self.assertEqual(len(cart), 4)
 
 
+class CartUpsertTest(TestCase):
+    """Запись в БД-корзину через INSERT … ON CONFLICT."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser', email='test@test.com', password='pass123'
+        )
+        self.product = make_product()
+
+    def quantity(self, product=None):
+        return DBCartItem.objects.get(cart__user=self.user, product=product or self.product).quantity
+
+    def test_add_increments_and_replaces(self):
+        cart = Cart(make_request(user=self.user))
+        cart.add(self.product, quantity=2)
+        cart.add(self.product, quantity=3)
+        self.assertEqual(self.quantity(), 5)
+        cart.add(self.product, quantity=1, update_quantity=True)
+        self.assertEqual(self.quantity(), 1)
+        self.assertEqual(DBCart.objects.filter(user=self.user).count(), 1)
+
+    def test_add_is_two_statements(self):
+        cart = Cart(make_request(user=self.user))
+        cart.add(self.product)
+        with self.assertNumQueries(4):  # savepoint, корзина, позиция, release
+            cart.add(self.product)
+
+    def test_updated_at_touched_only_when_stale(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from cart.upsert import TOUCH_INTERVAL
+
+        cart = Cart(make_request(user=self.user))
+        cart.add(self.product)
+        recent = timezone.now() - timedelta(minutes=5)
+        DBCart.objects.filter(user=self.user).update(updated_at=recent)
+        cart.add(self.product)
+        self.assertEqual(DBCart.objects.get(user=self.user).updated_at, recent)
+
+        stale = timezone.now() - TOUCH_INTERVAL - timedelta(minutes=1)
+        DBCart.objects.filter(user=self.user).update(updated_at=stale)
+        cart.add(self.product)
+        self.assertGreater(DBCart.objects.get(user=self.user).updated_at, stale)
+
+    def test_merge_is_one_upsert(self):
+        other = make_product('Товар 2', '500.00')
+        Cart(make_request(user=self.user)).add(self.product, quantity=1)
+        request = make_request(user=self.user)
+        request.session['cart'] = {
+            str(self.product.id): {'quantity': 2, 'price': '1000.00'},
+            str(other.id): {'quantity': 1, 'price': '500.00'},
+            '999999': {'quantity': 1, 'price': '1.00'},  # товар удалён
+        }
+        cart = Cart(request)
+        with self.assertNumQueries(5):  # товары, savepoint, корзина, позиции, release
+            cart.merge_session_cart()
+        self.assertEqual(self.quantity(), 3)
+        self.assertEqual(self.quantity(other), 1)
+        self.assertNotIn('cart', request.session)
+
+
+class CartSnapshotTest(TestCase):
+    """Снимок корзины: позиции, товары, скидки и остатки одним запросом."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        from index.models import Stock
+
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser', email='test@test.com', password='pass123'
+        )
+        self.product = make_product()
+        self.other = make_product('Товар 2', '500.00')
+        Stock.objects.create(product=self.product, quantity=1)
+
+    def fill(self, request):
+        cart = Cart(request)
+        cart.add(self.product, quantity=2)
+        cart.add(self.other, quantity=1)
+        return Cart(request)
+
+    def test_db_snapshot_single_query(self):
+        cart = self.fill(make_request(user=self.user))
+        with self.assertNumQueries(1):
+            snapshot = cart.snapshot
+            self.assertEqual(snapshot.total, Decimal('2500.00'))
+            self.assertEqual(snapshot.count, 3)
+            self.assertEqual(
+                [(line['product'].id, line['available']) for line in snapshot.out_of_stock],
+                [(self.product.id, 1), (self.other.id, 0)],
+            )
+            self.assertEqual(len(list(cart)), 2)
+            self.assertEqual(cart.get_total_price(), Decimal('2500.00'))  # сводка из снимка
+
+    def test_session_snapshot_single_query(self):
+        cart = self.fill(make_request())
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.snapshot.total, Decimal('2500.00'))
+            self.assertEqual(len(cart), 3)
+
+    def test_write_resets_snapshot(self):
+        cart = self.fill(make_request(user=self.user))
+        self.assertEqual(cart.snapshot.count, 3)
+        cart.remove(self.other)
+        self.assertEqual(cart.snapshot.count, 2)
+
+
 class CartViewTest(TestCase):
     """Тесты view корзины."""
 
@@ -153,3 +263,140 @@ class CartViewTest(TestCase):
         )
         response = self.client.post(f'/cart/remove/{self.product.id}/')
         self.assertIn(response.status_code, [200, 302])
+
+
+class CartSummaryTest(TestCase):
+    """Сводка корзины: один расчёт на запрос, кэш между запросами для вошедших."""
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser', email='test@test.com', password='pass123'
+        )
+        self.product = make_product()
+
+    def test_get_cart_is_per_request(self):
+        request = make_request(user=self.user)
+        from cart.cart import get_cart
+        self.assertIs(get_cart(request), get_cart(request))
+
+    def test_summary_cached_across_requests(self):
+        Cart(make_request(user=self.user)).add(self.product, quantity=3)
+        self.assertEqual(Cart(make_request(user=self.user)).summary.count, 3)
+
+        cart = Cart(make_request(user=self.user))
+        with self.assertNumQueries(0):
+            self.assertEqual(cart.summary.count, 3)
+            self.assertEqual(cart.get_total_price(), Decimal('3000.00'))
+
+    def test_write_invalidates_summary(self):
+        cart = Cart(make_request(user=self.user))
+        cart.add(self.product, quantity=1)
+        version = Cart(make_request(user=self.user)).summary.version
+
+        Cart(make_request(user=self.user)).add(self.product, quantity=2)
+        summary = Cart(make_request(user=self.user)).summary
+        self.assertEqual(summary.count, 3)
+        self.assertNotEqual(summary.version, version)
+
+    def test_price_change_invalidates_total(self):
+        Cart(make_request(user=self.user)).add(self.product, quantity=2)
+        self.assertEqual(Cart(make_request(user=self.user)).get_total_price(), Decimal('2000.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('1500.00')
+            self.product.save()
+        self.assertEqual(Cart(make_request(user=self.user)).get_total_price(), Decimal('3000.00'))
+
+    def test_catalog_writes_keep_summary(self):
+        from index.models import Review
+
+        Cart(make_request(user=self.user)).add(self.product, quantity=2)
+        Cart(make_request(user=self.user)).summary
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, name='Покупатель', rating=5, comment='Отлично')
+            self.product.name = 'Новое название'
+            self.product.save()
+        cart = Cart(make_request(user=self.user))
+        with self.assertNumQueries(0):
+            self.assertEqual(cart.get_total_price(), Decimal('2000.00'))
+
+    def test_counter_view_uses_cached_summary(self):
+        self.client.force_login(self.user)
+        self.client.post(f'/cart/add/{self.product.id}/', {'quantity': '2'})
+        self.client.get('/cart/counter/')
+        with self.assertNumQueries(2):  # сессия и пользователь
+            response = self.client.get('/cart/counter/')
+        self.assertContains(response, '>2</div>')
+
+
+class CartBulkAddTest(TestCase):
+    """Добавление набора товаров одним запросом."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        from index.models import Stock
+
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser', email='test@test.com', password='pass123'
+        )
+        self.phone = make_product('Телефон', '1000.00')
+        self.case = make_product('Чехол', '100.00')
+        self.sold_out = make_product('Наушники', '500.00')
+        Stock.objects.create(product=self.phone, quantity=5)
+        Stock.objects.create(product=self.case, quantity=5)
+        Stock.objects.create(product=self.sold_out, quantity=0)
+
+    def post(self, pairs, **headers):
+        return self.client.post('/cart/add-many/', {
+            'product_id': [pid for pid, _ in pairs],
+            'quantity': [quantity for _, quantity in pairs],
+        }, **headers)
+
+    def test_db_cart_single_upsert(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(
+                [(self.phone.id, 2), (self.case.id, 1), (self.phone.id, 1)], HTTP_HX_REQUEST='true',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['HX-Trigger'], 'cartUpdated')
+        self.assertContains(response, 'Чехол')
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "cart_dbcartitem"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            dict(DBCartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')),
+            {self.phone.id: 3, self.case.id: 1},
+        )
+
+    def test_session_cart_skips_out_of_stock(self):
+        response = self.post([(self.phone.id, 1), (self.sold_out.id, 1)])
+        self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        cart = self.client.session['cart']
+        self.assertEqual(set(cart), {str(self.phone.id)})
+        response = self.client.get('/cart/')
+        self.assertContains(response, 'Нет в наличии: Наушники')
+
+    def test_invalid_input_rejected(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post([('abc', 1)]).status_code, 400)
+        self.assertNotIn('cart', self.client.session)
+
+    def test_missing_products_skipped(self):
+        response = self.post([(999999, 1), (self.case.id, 2)])
+        self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        self.assertEqual(set(self.client.session['cart']), {str(self.case.id)})
+        self.assertContains(self.client.get('/cart/'), 'Больше не продаются товаров: 1')
+
+    def test_limit_applies_to_available_products(self):
+        from cart.views import MAX_BULK_ITEMS
+        from index.models import Stock
+
+        extra = [make_product(f'Кабель {i}', '10.00') for i in range(MAX_BULK_ITEMS)]
+        Stock.objects.bulk_create([Stock(product=product, quantity=1) for product in extra])
+        pairs = [(self.sold_out.id, 1), (999999, 1)] + [(product.id, 1) for product in extra] + [(self.case.id, 1)]
+        self.post(pairs)
+        self.assertEqual(set(self.client.session['cart']), {str(product.id) for product in extra})
+        self.assertContains(self.client.get('/cart/'), 'не добавлены: Чехол')
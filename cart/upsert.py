@@ -0,0 +1,60 @@
+"""
+Запись в БД-корзину через INSERT … ON CONFLICT DO UPDATE.
+
+Добавление товара — два запроса в одной транзакции при любом числе позиций:
+
+1. корзина пользователя создаётся, если её нет; updated_at сдвигается,
+   только если он старше TOUCH_INTERVAL — иначе строка корзины не пишется
+2. позиции вставляются одним INSERT; существующие увеличивают quantity
+   на месте (quantity = quantity + excluded.quantity), без чтения в Python
+
+id корзины подставляется подзапросом по user_id, так что параллельные
+клики не теряют друг друга и не падают на unique_together. ON CONFLICT
+поддерживают SQLite 3.24+ и PostgreSQL.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import DBCart, DBCartItem
+
+# clear_old_carts считает неактивность в днях — точнее часа updated_at не нужен
+TOUCH_INTERVAL = timedelta(hours=1)
+
+
+def add_items(user_id, quantities, replace=False):
+    """
+    Добавляет товары в БД-корзину пользователя.
+
+    Args:
+        quantities: {product_id: количество}; товары должны существовать
+        replace: True — задать количество, False — прибавить к имеющемуся
+    """
+    if not quantities:
+        return
+    quote = connection.ops.quote_name
+    cart_table = quote(DBCart._meta.db_table)
+    item_table = quote(DBCartItem._meta.db_table)
+    now = timezone.now()
+    stamp = connection.ops.adapt_datetimefield_value(now)
+    stale = connection.ops.adapt_datetimefield_value(now - TOUCH_INTERVAL)
+    quantity = 'excluded.quantity' if replace else f'{item_table}.quantity + excluded.quantity'
+
+    rows = ', '.join([f'((SELECT id FROM {cart_table} WHERE user_id = %s), %s, %s, %s)'] * len(quantities))
+    params = []
+    for product_id, count in quantities.items():
+        params.extend([user_id, product_id, count, stamp])
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {cart_table} (user_id, created_at, updated_at) VALUES (%s, %s, %s) '
+            f'ON CONFLICT (user_id) DO UPDATE SET updated_at = excluded.updated_at '
+            f'WHERE {cart_table}.updated_at < %s',
+            [user_id, stamp, stamp, stale],
+        )
+        cursor.execute(
+            f'INSERT INTO {item_table} (cart_id, product_id, quantity, added_at) VALUES {rows} '
+            f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {quantity}',
+            params,
+        )
@@ -6,6 +6,7 @@ app_name = 'cart'
 urlpatterns = [
     path('', views.cart_detail, name='cart_detail'),
     path('add/<int:product_id>/', views.cart_add, name='cart_add'),
+    path('add-many/', views.cart_add_many, name='cart_add_many'),
     path('remove/<int:product_id>/', views.cart_remove, name='cart_remove'),
     path('counter/', views.cart_counter, name='cart_counter'),
     path('clear/', views.cart_clear, name='cart_clear'),
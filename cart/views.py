@@ -1,19 +1,20 @@
+from django.contrib import messages
+from django.http import HttpResponseBadRequest
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.http import require_POST
 from django_ratelimit.decorators import ratelimit
-from index.models import Product
-from .cart import Cart
+from index.models import Product, Stock
+from .cart import get_cart
+
+MAX_QUANTITY = 100
+MAX_BULK_ITEMS = 50  # позиций в одном cart_add_many
 
 
 def _cart_body_context(cart):
-    items = []
-    total_price = 0
-    for item in cart:
-        total_price += item['total_price']
-        items.append(item)
+    snapshot = cart.snapshot
     return {
-        'cart_items': items,
-        'cart_total_price': total_price,
+        'cart_items': snapshot.lines,
+        'cart_total_price': snapshot.total,
         'quantity_range': range(1, 21),
     }
 
@@ -27,13 +28,13 @@ def _htmx_cart_response(request, ctx):
 @require_POST
 @ratelimit(key='ip', rate='30/m', block=True)
 def cart_add(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     try:
         quantity = int(request.POST.get('quantity', 1))
     except (ValueError, TypeError):
         quantity = 1
-    quantity = max(1, min(quantity, 100))
+    quantity = max(1, min(quantity, MAX_QUANTITY))
     update = request.POST.get('update') in ('true', 'True', '1')
     cart.add(product=product, quantity=quantity, update_quantity=update)
 
@@ -48,10 +49,84 @@ def cart_add(request, product_id):
     return redirect('cart:cart_detail')
 
 
+def _parse_bulk_items(request):
+    """
+    Пары product_id/quantity из формы (quantity можно не передавать — по 1).
+
+    Returns:
+        dict: product_id -> количество (повторы суммируются) или None, если ввод некорректен
+    """
+    # Длину списка ограничивает DATA_UPLOAD_MAX_NUMBER_FIELDS; MAX_BULK_ITEMS
+    # действует уже на найденные товары — повтор длинного заказа не отклоняется
+    product_ids = request.POST.getlist('product_id')
+    quantities = request.POST.getlist('quantity') or ['1'] * len(product_ids)
+    if not product_ids or len(quantities) != len(product_ids):
+        return None
+    items = {}
+    for raw_id, raw_quantity in zip(product_ids, quantities):
+        try:
+            product_id, quantity = int(raw_id), int(raw_quantity)
+        except (ValueError, TypeError):
+            return None
+        items[product_id] = min(items.get(product_id, 0) + max(1, quantity), MAX_QUANTITY)
+    return items
+
+
+def _in_stock(product):
+    try:
+        return product.stock.is_available and product.stock.quantity > 0
+    except Stock.DoesNotExist:
+        return False
+
+
+@require_POST
+@ratelimit(key='ip', rate='10/m', block=True)
+def cart_add_many(request):
+    """
+    Добавляет в корзину набор товаров: повтор заказа, набор из сравнения,
+    быстрый заказ списком. Товары и остатки — одним запросом, запись — одним
+    upsert-ом или одним сохранением сессии. Снятые с продажи и отсутствующие
+    на складе товары пропускаются с сообщением; добавляются первые
+    MAX_BULK_ITEMS позиций.
+    """
+    items = _parse_bulk_items(request)
+    if items is None:
+        return HttpResponseBadRequest('Передайте пары product_id и quantity')
+    products = Product.objects.select_related('discount', 'stock').in_bulk(items)
+
+    available, sold_out, over_limit = {}, [], []
+    for product_id, quantity in items.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        if not _in_stock(product):
+            sold_out.append(product.name)
+        elif len(available) < MAX_BULK_ITEMS:
+            available[product] = quantity
+        else:
+            over_limit.append(product.name)
+
+    cart = get_cart(request)
+    cart.add_many(available)
+    missing = len(items) - len(products)
+    if missing:
+        messages.warning(request, f'Больше не продаются товаров: {missing}')
+    if sold_out:
+        messages.warning(request, 'Нет в наличии: ' + ', '.join(sold_out))
+    if over_limit:
+        messages.warning(
+            request, f'За раз добавляется не больше {MAX_BULK_ITEMS} позиций, не добавлены: ' + ', '.join(over_limit)
+        )
+
+    if request.headers.get('HX-Request'):
+        return _htmx_cart_response(request, _cart_body_context(cart))
+    return redirect('cart:cart_detail')
+
+
 @require_POST
 @ratelimit(key='ip', rate='30/m', block=True)
 def cart_remove(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     cart.remove(product)
 
@@ -64,7 +139,7 @@ def cart_remove(request, product_id):
 @require_POST
 @ratelimit(key='ip', rate='10/m', block=True)
 def cart_clear(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     cart.clear()
     if request.headers.get('HX-Request'):
         return _htmx_cart_response(request, _cart_body_context(cart))
@@ -72,11 +147,11 @@ def cart_clear(request):
 
 
 def cart_counter(request):
-    cart = Cart(request)
-    return render(request, 'cart/partials/cart_counter.html', {'cart_count': len(cart)})
+    cart = get_cart(request)
+    return render(request, 'cart/partials/cart_counter.html', {'cart_count': cart.summary.count})
 
 
 def cart_detail(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     ctx = _cart_body_context(cart)
     return render(request, 'cart/detail.html', ctx)
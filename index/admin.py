@@ -50,7 +50,7 @@ class ProductSpecificationInline(admin.TabularInline):
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('name', 'category', 'brand', 'price',
-                    'get_final_price', 'discount', 'stock_quantity')
+                    'final_price', 'discount', 'stock_quantity', 'rating_avg', 'rating_count')
     list_editable = ('price',)
     list_filter = ('category', 'brand', 'discount')
     list_select_related = ('category', 'brand', 'discount', 'stock')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class IndexConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'index'
+
+    def ready(self):
+        import index.signals  # noqa: F401
@@ -0,0 +1,94 @@
+"""
+Условные GET-запросы: ETag и 304 Not Modified.
+
+ETag собирается из дешёвых версий — счётчиков в кэше и одного индексного
+запроса — до того, как view выполнит свои запросы и отрисует шаблон. Если
+клиент или CDN прислал совпадающий If-None-Match, отдаётся 304 без тела.
+
+В HTML-страницах есть части конкретного посетителя: CSRF-токен, счётчик
+корзины в меню, форма отзыва для вошедших. Они входят в ETag (viewer_state),
+ответ помечается `Vary: Cookie` и `Cache-Control: private`. HTMX-запросы
+получают другой шаблон, поэтому `Vary: HX-Request` и заголовок в ETag.
+
+ETag слабый (W/): маска CSRF-токена меняется от ответа к ответу, так что
+побайтно совпадающих ответов нет, но по смыслу они равнозначны.
+
+Last-Modified не выставляется: у страницы товара нет одной отметки времени —
+отзывы, остаток и корзина меняются без Product.updated_at.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from . import sidebar
+from .facets import VERSION_CACHE_KEY as CATALOG_VERSION_KEY
+from .versions import get_counter
+
+
+def make_etag(parts):
+    return 'W/"{}"'.format(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def viewer_state(request):
+    """Части страницы, зависящие от посетителя: пользователь, CSRF-cookie, счётчик корзины."""
+    from cart.cart import get_cart
+
+    return (
+        request.user.pk,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        get_cart(request).summary.count,
+    )
+
+
+def catalog_version():
+    """Версия каталога — версия индекса фасетов."""
+    return get_counter(CATALOG_VERSION_KEY)
+
+
+class ConditionalGetMixin:
+    """
+    ETag/304 для GET и HEAD.
+
+    View возвращает из get_etag_parts() кортеж версий, от которых зависит
+    ответ, или None, если валидатор построить нельзя (тогда ответ обычный).
+    """
+
+    conditional_vary = ('Cookie', 'HX-Request')
+    conditional_private = True
+
+    def get_etag_parts(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        etag = None
+        # Непоказанные flash-сообщения выводятся только при отрисовке
+        if request.method in ('GET', 'HEAD') and not len(get_messages(request)):
+            parts = self.get_etag_parts(request, *args, **kwargs)
+            if parts is not None:
+                etag = make_etag((request.get_full_path(), request.headers.get('HX-Request'), parts))
+                response = get_conditional_response(request, etag=etag)
+                if response is not None:
+                    response.headers['ETag'] = etag
+                    return self._patch_conditional_headers(response)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if etag is not None and response.status_code == 200:
+            response.headers['ETag'] = etag
+            self._patch_conditional_headers(response)
+        return response
+
+    def _patch_conditional_headers(self, response):
+        patch_vary_headers(response, self.conditional_vary)
+        # no-cache: хранить можно, но перед использованием — перепроверить по ETag
+        if self.conditional_private:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
+def listing_etag_parts(request):
+    """Каталог и поиск: версия каталога, версия сайдбара и посетитель."""
+    return (catalog_version(), sidebar.get_version(), viewer_state(request))
@@ -0,0 +1,544 @@
+"""
+Битмап-индекс фасетов каталога.
+
+Для каждой категории, бренда, тега и пары (характеристика, значение) хранится
+битовая маска товаров (Python int, один бит — один товар). Фильтрация каталога
+сводится к OR внутри группы фильтров и AND между группами, после чего в БД
+уходит один запрос `id__in` за страницей товаров.
+
+Каждый воркер держит собственную копию индекса. Сигналы пишут изменённые id
+товаров в журнал в кэше; при обращении воркер догоняет журнал инкрементально,
+а если отстал слишком сильно (или журнал вытеснен) — перестраивает индекс целиком.
+"""
+import hashlib
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from django.core.cache import cache
+
+from .versions import bump_counter, get_counter
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'facet_index:version'
+JOURNAL_CACHE_KEY = 'facet_index:journal:{}'
+JOURNAL_TTL = 60 * 60  # 1 час
+MAX_REPLAY = 100  # при большем отставании дешевле перестроить индекс целиком
+FULL_REBUILD = 'full'  # запись журнала: изменилось что-то кроме отдельных товаров
+
+DISCOUNT_KEY = ('discount',)
+RELEVANCE = 'relevance'  # порядок ProductIdList по внешнему ранжированию (поиск)
+
+
+def category_key(slug):
+    return ('category', slug)
+
+
+def brand_key(slug):
+    return ('brand', slug)
+
+
+def tag_key(slug):
+    return ('tag', slug)
+
+
+def spec_key(spec_slug, value):
+    return ('spec', spec_slug, value)
+
+
+def facet_group(key):
+    """Группа фильтров ключа: 'category', 'brand', 'tag', 'discount' или 'spec:<slug>'."""
+    if key[0] == 'spec':
+        return f'spec:{key[1]}'
+    return key[0]
+
+
+def facet_name(key):
+    """Строковое имя фасета для шаблонов и JSON: 'brand:apple', 'spec:ram:8 ГБ'."""
+    return ':'.join(key)
+
+
+def _bound(value):
+    return str(value.normalize()) if value is not None else ''
+
+
+def filter_signature(groups, price_from=None, price_to=None, ranges=None):
+    """
+    Нормализованная подпись фильтров: порядок параметров и дубли не важны.
+
+    ranges: dict slug характеристики -> (от, до) — диапазоны числовых значений
+    """
+    normalized = (
+        tuple(sorted((group, tuple(sorted(set(keys)))) for group, keys in groups.items())),
+        _bound(price_from),
+        _bound(price_to),
+    )
+    if ranges:
+        # Без диапазонов подпись прежняя — закэшированные ключи не меняются
+        normalized += (tuple(sorted(
+            (slug, _bound(low), _bound(high)) for slug, (low, high) in ranges.items()
+        )),)
+    return hashlib.md5(repr(normalized).encode()).hexdigest()
+
+
+def _iter_slots_desc(mask):
+    """Номера установленных битов маски от старшего к младшему."""
+    bits = bin(mask)[2:]
+    top = len(bits) - 1
+    pos = bits.find('1')
+    while pos != -1:
+        yield top - pos
+        pos = bits.find('1', pos + 1)
+
+
+def _bitmap_from_slots(slots, size):
+    buf = bytearray((size + 7) // 8)
+    for slot in slots:
+        buf[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buf, 'little')
+
+
+class FacetIndex:
+    """
+    Индекс фасетов одного процесса.
+
+    Слоты товаров выдаются по возрастанию id, поэтому обход битов маски
+    от старшего к младшему сразу даёт порядок `-id` без сортировки.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self.universe = 0    # маска всех товаров
+        self.bitmaps = {}    # ключ фасета -> маска
+        self._slots = {}     # product_id -> слот
+        self._ids = []       # слот -> product_id, по возрастанию (слот удалённого товара пустует до перестройки)
+        self._prices = []    # слот -> итоговая цена (с учётом скидки)
+        self._ratings = []   # слот -> средняя оценка
+        self._scores = []    # слот -> оценка характеристик в категории
+        self._keys = []      # слот -> ключи фасетов товара
+        self._last_id = 0    # id товара в последнем выданном слоте
+
+    # === Загрузка данных ===
+
+    @staticmethod
+    def _load(product_ids=None):
+        """
+        Загружает цены, рейтинги, оценки и ключи фасетов товаров — 3 запроса без JOIN-ов по фильтрам.
+
+        Returns:
+            dict: product_id -> (цена, рейтинг, оценка характеристик, set ключей)
+        """
+        from index.models import Product, ProductSpecification
+
+        products = Product.objects.values_list(
+            'id', 'final_price', 'rating_avg', 'spec_score', 'category__slug', 'brand__slug', 'discount_id'
+        )
+        tags = Product.tags.through.objects.values_list('product_id', 'tag__slug')
+        specs = ProductSpecification.objects.values_list(
+            'product_id', 'spec_type__slug', 'value'
+        )
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+            tags = tags.filter(product_id__in=product_ids)
+            specs = specs.filter(product_id__in=product_ids)
+
+        rows = {}
+        for pid, price, rating, score, category_slug, brand_slug, discount_id in products:
+            keys = {category_key(category_slug)}
+            if brand_slug:
+                keys.add(brand_key(brand_slug))
+            if discount_id is not None:
+                keys.add(DISCOUNT_KEY)
+            rows[pid] = (price, rating, score, keys)
+        for pid, slug in tags:
+            if pid in rows:
+                rows[pid][3].add(tag_key(slug))
+        for pid, spec_slug, value in specs:
+            if pid in rows:
+                rows[pid][3].add(spec_key(spec_slug, value))
+        return rows
+
+    def rebuild(self, version=None):
+        """Полная перестройка индекса. Новое состояние подменяется целиком."""
+        started = time.monotonic()
+        rows = self._load()
+        ids = sorted(rows)
+        slots = {pid: slot for slot, pid in enumerate(ids)}
+
+        members = {}
+        for pid, (_, _, _, keys) in rows.items():
+            for key in keys:
+                members.setdefault(key, []).append(slots[pid])
+
+        size = len(ids)
+        bitmaps = {key: _bitmap_from_slots(s, size) for key, s in members.items()}
+
+        with self._lock:
+            self.bitmaps = bitmaps
+            self.universe = (1 << size) - 1
+            self._slots = slots
+            self._ids = ids
+            self._prices = [rows[pid][0] for pid in ids]
+            self._ratings = [rows[pid][1] for pid in ids]
+            self._scores = [rows[pid][2] for pid in ids]
+            self._keys = [frozenset(rows[pid][3]) for pid in ids]
+            self._last_id = ids[-1] if ids else 0
+            self.version = version
+
+        logger.info(
+            'Facet index rebuilt: %d products, %d keys, %.1f ms',
+            size, len(bitmaps), (time.monotonic() - started) * 1000,
+        )
+
+    def apply(self, product_ids):
+        """
+        Инкрементально обновляет товары в индексе.
+
+        Returns:
+            bool: False, если изменение нельзя применить на месте
+                  (новый товар с id меньше существующих) — нужна перестройка.
+        """
+        rows = self._load(product_ids)
+        with self._lock:
+            for pid in sorted(set(product_ids)):
+                slot = self._slots.get(pid)
+                if slot is not None:
+                    self._clear_slot(slot)
+                data = rows.get(pid)
+                if data is None:
+                    self._slots.pop(pid, None)
+                    continue
+                if slot is None:
+                    if pid < self._last_id:
+                        return False
+                    slot = len(self._ids)
+                    self._last_id = pid
+                    self._slots[pid] = slot
+                    self._ids.append(pid)
+                    self._prices.append(None)
+                    self._ratings.append(None)
+                    self._scores.append(None)
+                    self._keys.append(frozenset())
+                self._set_slot(slot, *data)
+        return True
+
+    def _clear_slot(self, slot):
+        bit = 1 << slot
+        for key in self._keys[slot]:
+            mask = self.bitmaps.get(key, 0) & ~bit
+            if mask:
+                self.bitmaps[key] = mask
+            else:
+                self.bitmaps.pop(key, None)
+        self.universe &= ~bit
+        self._keys[slot] = frozenset()
+
+    def _set_slot(self, slot, price, rating, score, keys):
+        bit = 1 << slot
+        for key in keys:
+            self.bitmaps[key] = self.bitmaps.get(key, 0) | bit
+        self.universe |= bit
+        self._prices[slot] = price
+        self._ratings[slot] = rating
+        self._scores[slot] = score
+        self._keys[slot] = frozenset(keys)
+
+    # === Синхронизация между воркерами ===
+
+    def sync(self):
+        """Догоняет журнал изменений из кэша или перестраивает индекс."""
+        # После очистки кэша счётчик стартует с текущего времени и
+        # не совпадёт со старыми локальными версиями
+        shared = get_counter(VERSION_CACHE_KEY)
+        if shared == self.version:
+            return
+
+        with self._lock:
+            if shared == self.version:
+                return
+            if self.version is None or not 0 < shared - self.version <= MAX_REPLAY:
+                self.rebuild(shared)
+                return
+
+            keys = [JOURNAL_CACHE_KEY.format(v) for v in range(self.version + 1, shared + 1)]
+            entries = cache.get_many(keys)
+            if len(entries) != len(keys) or FULL_REBUILD in entries.values():
+                self.rebuild(shared)
+                return
+
+            product_ids = set()
+            for ids in entries.values():
+                product_ids.update(ids)
+            if self.apply(product_ids):
+                self.version = shared
+            else:
+                self.rebuild(shared)
+
+    # === Запросы ===
+
+    @property
+    def spec_slugs(self):
+        return {key[1] for key in self.bitmaps if key[0] == 'spec'}
+
+    def select(self, groups):
+        """
+        Маска товаров по фильтрам: OR внутри группы, AND между группами.
+
+        Args:
+            groups: dict группа -> список ключей фасетов
+        """
+        mask = self.universe
+        for keys in groups.values():
+            group_mask = 0
+            for key in keys:
+                group_mask |= self.bitmaps.get(key, 0)
+            mask &= group_mask
+        return mask
+
+    def price_mask(self, price_from=None, price_to=None):
+        """Маска товаров с ценой в диапазоне [price_from, price_to]."""
+        if price_from is None and price_to is None:
+            return self.universe
+        slots = [
+            slot for slot, price in enumerate(self._prices)
+            if price is not None
+            and (price_from is None or price >= price_from)
+            and (price_to is None or price <= price_to)
+        ]
+        return _bitmap_from_slots(slots, len(self._prices)) & self.universe
+
+    def mask_of(self, product_ids):
+        """Маска товаров из списка id (отсутствующие в индексе пропускаются)."""
+        slots = self._slots
+        return _bitmap_from_slots(
+            (slots[pid] for pid in product_ids if pid in slots), len(self._ids)
+        ) & self.universe
+
+    def filter_ids(self, product_ids, mask):
+        """id из списка, попадающие в маску, с сохранением порядка списка."""
+        slots = self._slots
+        return [pid for pid in product_ids if pid in slots and mask >> slots[pid] & 1]
+
+    def ordered_ids(self, mask, order='-id', limit=None):
+        """
+        Упорядоченный список id товаров маски.
+
+        Args:
+            order: '-id' или 'final_price'/'rating_avg'/'spec_score' с '-' или без
+                   (при равном значении — новые первыми)
+            limit: для '-id' обход битов останавливается на первых limit товарах
+        """
+        if order == '-id':
+            return [self._ids[s] for s in islice(_iter_slots_desc(mask), limit)]
+        slots = list(_iter_slots_desc(mask))
+        # Сортировка устойчивая, а слоты уже идут по убыванию id
+        slots.sort(key=self._sort_values(order).__getitem__, reverse=order.startswith('-'))
+        return [self._ids[s] for s in slots[:limit]]
+
+    def _sort_values(self, order):
+        """Значения поля сортировки по слотам."""
+        field = order.lstrip('-')
+        if field == 'final_price':
+            return self._prices
+        if field == 'rating_avg':
+            return self._ratings
+        if field == 'spec_score':
+            return self._scores
+        raise ValueError(f'Неизвестная сортировка: {order}')
+
+    def seek(self, mask, order, cursor, limit):
+        """
+        Keyset-страница: до limit id товаров, идущих в порядке order после cursor.
+
+        Args:
+            cursor: (значение поля сортировки, id) последнего показанного товара;
+                    значение None для '-id'
+        """
+        value, last_id = cursor
+        if order == '-id':
+            # Слоты упорядочены по id — отсекаем всё, что не меньше курсора
+            mask &= (1 << bisect_left(self._ids, last_id)) - 1
+            return self.ordered_ids(mask, order, limit)
+
+        ids = self.ordered_ids(mask, order)
+        values, slots = self._sort_values(order), self._slots
+        if order.startswith('-'):
+            key, bound = (lambda pid: (-values[slots[pid]], -pid)), (-value, -last_id)
+        else:
+            key, bound = (lambda pid: (values[slots[pid]], -pid)), (value, -last_id)
+        start = bisect_right(ids, bound, key=key)
+        return ids[start:start + limit]
+
+    def facet_counts(self, groups, base=None):
+        """
+        Дизъюнктивные счётчики всех фасетов за один проход по индексу.
+
+        Значения выбранной группы считаются без учёта выбора в этой же группе
+        (чтобы можно было добавить ещё один бренд), но с учётом остальных групп.
+
+        Args:
+            groups: dict группа -> список ключей, как для select()
+            base: маска, ограничивающая все счётчики (например, по цене)
+
+        Returns:
+            dict: имя фасета ('brand:apple', 'spec:ram:8 ГБ', ...) -> количество
+        """
+        base = self.universe if base is None else base
+        group_masks = {}
+        for group, keys in groups.items():
+            group_mask = 0
+            for key in keys:
+                group_mask |= self.bitmaps.get(key, 0)
+            group_masks[group] = group_mask
+
+        full = base
+        for group_mask in group_masks.values():
+            full &= group_mask
+        without = {}
+        for group in group_masks:
+            mask = base
+            for other, group_mask in group_masks.items():
+                if other != group:
+                    mask &= group_mask
+            without[group] = mask
+
+        return {
+            facet_name(key): (bitmap & without.get(facet_group(key), full)).bit_count()
+            for key, bitmap in self.bitmaps.items()
+        }
+
+    def stats(self):
+        return {
+            'products': len(self._slots),
+            'keys': len(self.bitmaps),
+            'bytes': sum(sys.getsizeof(mask) for mask in self.bitmaps.values()),
+            'version': self.version,
+        }
+
+
+class IdList:
+    """
+    Готовый упорядоченный список id товаров для Paginator и keyset-пагинации.
+
+    Срез загружает только товары страницы одним запросом `id__in` с сохранением
+    порядка списка. С order=RELEVANCE загруженным товарам проставляется атрибут
+    `relevance` — позиция в выдаче (по нему строится keyset-курсор).
+    """
+
+    def __init__(self, queryset, ids, order='-id'):
+        self.queryset = queryset
+        self.order = order
+        self._ids = ids
+        self._positions = None
+
+    @property
+    def ids(self):
+        return self._ids
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            self._positions = {pid: i for i, pid in enumerate(self.ids)}
+        return self._positions
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        return self._fetch(self.ids[index])
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def seek(self, cursor, limit):
+        """Товары после курсора (или с начала, если курсора нет)."""
+        if cursor is None:
+            return self[:limit]
+        # Курсор — (ключ, id); если товара уже нет в списке, продолжаем с позиции ключа
+        value, last_id = cursor
+        if last_id in self.positions:
+            start = self.positions[last_id] + 1
+        elif self.order == RELEVANCE:
+            start = int(value) + 1
+        else:
+            return []
+        return self[start:start + limit]
+
+    def _fetch(self, page_ids):
+        products = self.queryset.in_bulk(list(page_ids))
+        page = [products[pid] for pid in page_ids if pid in products]
+        if self.order == RELEVANCE:
+            for product in page:
+                product.relevance = self.positions[product.id]
+        return page
+
+
+class ProductIdList(IdList):
+    """
+    Результат выборки из индекса фасетов.
+
+    Длина — popcount маски, без сортировки и без COUNT в БД; список id
+    строится лениво. С order=RELEVANCE порядок задаёт ranking (id по
+    убыванию релевантности).
+    """
+
+    def __init__(self, queryset, index, mask, order='-id', ranking=None):
+        super().__init__(queryset, None, order)
+        self.index = index
+        self.mask = mask
+        self.ranking = ranking
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            if self.order == RELEVANCE:
+                self._ids = self.index.filter_ids(self.ranking, self.mask)
+            else:
+                self._ids = self.index.ordered_ids(self.mask, self.order)
+        return self._ids
+
+    def __len__(self):
+        return self.mask.bit_count()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice) and self._ids is None and self.order == '-id' \
+                and index.step is None and index.stop is not None and index.stop >= 0:
+            # Ранние страницы по умолчанию — без построения полного списка
+            return self._fetch(self.index.ordered_ids(self.mask, self.order, index.stop)[index])
+        return super().__getitem__(index)
+
+    def seek(self, cursor, limit):
+        if cursor is None or self.order == RELEVANCE:
+            return super().seek(cursor, limit)
+        return self._fetch(self.index.seek(self.mask, self.order, cursor, limit))
+
+
+def log_change(product_ids=FULL_REBUILD):
+    """
+    Записывает изменение в журнал и поднимает общую версию индекса.
+
+    Args:
+        product_ids: id изменённых товаров или FULL_REBUILD
+    """
+    version = bump_counter(VERSION_CACHE_KEY)
+    if version is None:
+        return  # счётчика нет — воркеры и так перестроят индекс при следующем обращении
+    if product_ids != FULL_REBUILD:
+        product_ids = list(product_ids)
+    cache.set(JOURNAL_CACHE_KEY.format(version), product_ids, JOURNAL_TTL)
+
+
+facet_index = FacetIndex()
+
+
+def get_facet_index():
+    """Индекс текущего процесса, синхронизированный с журналом изменений."""
+    facet_index.sync()
+    return facet_index
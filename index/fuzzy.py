@@ -0,0 +1,226 @@
+"""
+Нечёткий поиск по триграммам — запасной вариант, когда основной поиск
+ничего не нашёл («samsng», «ифон», «ышфщьш» вместо «xiaomi»).
+
+Словарь — слова из названий товаров и брендов. Каждое слово приводится к
+латинской «фонетической» форме (кириллица транслитерируется, ph → f),
+поэтому «ифон» и «iPhone» сравниваются как «ifon» и «ifone». Запрос
+дополнительно пробуется в другой раскладке клавиатуры.
+
+Индекс компактный — он есть в каждом воркере: слова хранятся один раз,
+списки вхождений — array('I'). Обновляется инкрементально по тому же
+журналу изменений товаров, что и индекс фасетов.
+"""
+import logging
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from heapq import nlargest
+
+from django.core.cache import cache
+
+from .facets import FULL_REBUILD, JOURNAL_CACHE_KEY, MAX_REPLAY, VERSION_CACHE_KEY
+from .stemmer import WORD_RE
+from .versions import get_counter
+
+logger = logging.getLogger(__name__)
+
+MIN_SIMILARITY = 0.3  # доля общих триграмм (Жаккар), ниже — уже не опечатка
+MAX_WORD_CANDIDATES = 20
+MAX_RESULTS = 200
+MAX_QUERY_WORDS = 6
+
+_EN_KEYS = "`qwertyuiop[]asdfghjkl;'zxcvbnm,."
+_RU_KEYS = 'ёйцукенгшщзхъфывапролджэячсмитьбю'
+EN_TO_RU = str.maketrans(_EN_KEYS, _RU_KEYS)
+RU_TO_EN = str.maketrans(_RU_KEYS, _EN_KEYS)
+
+_TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
+
+
+def switch_layout(text):
+    """Текст, набранный не в той раскладке: «ышфщьш» → «xiaomi», «yjen,er» → «ноутбук»."""
+    text = text.lower()
+    cyrillic = sum('а' <= ch <= 'я' or ch == 'ё' for ch in text)
+    latin = sum('a' <= ch <= 'z' for ch in text)
+    return text.translate(RU_TO_EN if cyrillic > latin else EN_TO_RU)
+
+
+def canonical(word):
+    """Фонетическая латинская форма слова для сравнения триграмм."""
+    return word.lower().translate(_TRANSLIT).replace('ph', 'f')
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _words(text):
+    return {word for word in WORD_RE.findall((text or '').lower()) if len(word) > 1}
+
+
+class FuzzyIndex:
+    """Триграммный индекс слов названий одного процесса."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.version = None
+        self._reset()
+
+    def _reset(self):
+        self.words = []               # id слова -> слово как в названии
+        self._word_ids = {}           # фонетическая форма -> id слова
+        self._trigram_counts = array('B')  # id слова -> число его триграмм
+        self._postings = {}           # триграмма -> array id слов
+        self._products = []           # id слова -> array id товаров
+        self._product_words = {}      # id товара -> id слов (для инкрементального обновления)
+
+    @staticmethod
+    def _load(product_ids=None):
+        """
+        Returns:
+            dict: product_id -> set слов названия товара и его бренда
+        """
+        from .models import Product
+
+        products = Product.objects.values_list('id', 'name', 'brand__name')
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+        return {pid: _words(name) | _words(brand) for pid, name, brand in products}
+
+    def _word_id(self, word):
+        key = canonical(word)
+        word_id = self._word_ids.get(key)
+        if word_id is None:
+            word_id = len(self.words)
+            self._word_ids[key] = word_id
+            self.words.append(word)
+            grams = trigrams(key)
+            self._trigram_counts.append(min(len(grams), 255))
+            self._products.append(array('I'))
+            for gram in grams:
+                self._postings.setdefault(gram, array('I')).append(word_id)
+        return word_id
+
+    def _add_product(self, pid, words):
+        word_ids = tuple(self._word_id(word) for word in words)
+        for word_id in word_ids:
+            self._products[word_id].append(pid)
+        self._product_words[pid] = word_ids
+
+    def _remove_product(self, pid):
+        for word_id in self._product_words.pop(pid, ()):
+            self._products[word_id] = array('I', (p for p in self._products[word_id] if p != pid))
+
+    def rebuild(self, version=None):
+        started = time.monotonic()
+        rows = self._load()
+        with self._lock:
+            self._reset()
+            for pid, words in rows.items():
+                self._add_product(pid, words)
+            self.version = version
+        logger.info(
+            'Fuzzy index rebuilt: %d products, %d words, %.1f ms',
+            len(rows), len(self.words), (time.monotonic() - started) * 1000,
+        )
+
+    def apply(self, product_ids):
+        """Переиндексирует изменённые товары (слова, пропавшие из названий, остаются до перестройки)."""
+        rows = self._load(product_ids)
+        with self._lock:
+            for pid in product_ids:
+                self._remove_product(pid)
+                if pid in rows:
+                    self._add_product(pid, rows[pid])
+
+    def sync(self):
+        """Догоняет журнал изменений товаров индекса фасетов или перестраивается."""
+        # Счётчик заводится здесь же, как в FacetIndex.sync: без него каждый
+        # запрос на холодном кэше перестраивал бы индекс заново
+        shared = get_counter(VERSION_CACHE_KEY)
+        if shared == self.version:
+            return
+        with self._lock:
+            if shared == self.version:
+                return
+            if self.version is None or not 0 < shared - self.version <= MAX_REPLAY:
+                self.rebuild(shared)
+                return
+            keys = [JOURNAL_CACHE_KEY.format(v) for v in range(self.version + 1, shared + 1)]
+            entries = cache.get_many(keys)
+            if len(entries) != len(keys) or FULL_REBUILD in entries.values():
+                self.rebuild(shared)
+                return
+            self.apply({pid for ids in entries.values() for pid in ids})
+            self.version = shared
+
+    def _similar_words(self, word):
+        """[(сходство, id слова)] лучших кандидатов для слова запроса."""
+        key = canonical(word)
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        candidates = []
+        for word_id, common in shared.items():
+            similarity = common / (len(grams) + self._trigram_counts[word_id] - common)
+            if similarity >= MIN_SIMILARITY:
+                candidates.append((similarity, word_id))
+        return nlargest(MAX_WORD_CANDIDATES, candidates)
+
+    def _score(self, query_words):
+        """id товара -> средняя по словам запроса лучшая похожесть."""
+        scores = defaultdict(float)
+        for word in query_words:
+            best = {}
+            for similarity, word_id in self._similar_words(word):
+                for pid in self._products[word_id]:
+                    if similarity > best.get(pid, 0):
+                        best[pid] = similarity
+            for pid, similarity in best.items():
+                scores[pid] += similarity
+        return {pid: score / len(query_words) for pid, score in scores.items()}
+
+    def search(self, query, limit=MAX_RESULTS):
+        """
+        Товары, похожие на запрос, в исходной раскладке или в другой.
+
+        Returns:
+            list: id товаров по убыванию сходства
+        """
+        best = {}
+        for variant in (query, switch_layout(query)):
+            words = list(_words(variant))[:MAX_QUERY_WORDS]
+            if not words:
+                continue
+            with self._lock:
+                scores = self._score(words)
+            if scores and max(scores.values()) > max(best.values(), default=0):
+                best = scores
+        ranked = sorted(best.items(), key=lambda item: (-item[1], -item[0]))
+        return [pid for pid, score in ranked[:limit] if score >= MIN_SIMILARITY]
+
+    def stats(self):
+        return {
+            'words': len(self.words),
+            'trigrams': len(self._postings),
+            'products': len(self._product_words),
+            'version': self.version,
+        }
+
+
+fuzzy_index = FuzzyIndex()
+
+
+def get_fuzzy_index():
+    fuzzy_index.sync()
+    return fuzzy_index
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from index.spec_values import backfill
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет разобранные значения характеристик (numeric_value, bool_value, '
+        'token) по value. Существующие строки заполнила миграция 0020; команда — '
+        'после правок характеристик в обход ORM (импорт, SQL).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Строк в одной пачке')
+
+    def handle(self, *args, **options):
+        updated, product_ids = backfill(batch_size=max(1, options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено характеристик: {updated} у {len(product_ids)} товаров'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from index.facets import FacetIndex, log_change
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает битмап-индекс фасетов каталога во всех воркерах'
+
+    def handle(self, *args, **options):
+        index = FacetIndex()
+        index.rebuild()
+        # Сам индекс живёт в памяти воркеров — сообщаем им о перестройке через журнал
+        log_change()
+
+        stats = index.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс перестроен: товаров {stats["products"]}, '
+            f'ключей {stats["keys"]}, {stats["bytes"] / 1024:.1f} КБ'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from index.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Полностью переиндексирует товары в поисковом бэкенде (SEARCH_BACKEND)'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковый индекс перестроен ({type(backend).__name__}): товаров {count}'
+        ))
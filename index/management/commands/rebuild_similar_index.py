@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from index.models import Category
+from index.similar import build_category, index_dir, stale_categories
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает матрицы признаков для блока «Похожие товары» — по категории '
+        'за раз. Запускать после деплоя и после изменения типов характеристик; '
+        'с --stale — по расписанию (cron) для категорий, помеченных при сохранении товаров.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, help='Только категория с этим id')
+        parser.add_argument(
+            '--stale', action='store_true',
+            help='Только категории, которым нужна пересборка (новый товар, новая характеристика)',
+        )
+
+    def handle(self, *args, **options):
+        categories = Category.objects.order_by('id').values_list('id', flat=True)
+        if options['category']:
+            categories = categories.filter(id=options['category'])
+        if options['stale']:
+            categories = categories.filter(id__in=stale_categories())
+        total = 0
+        for category_id in categories:
+            total += build_category(category_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Индекс похожих товаров собран: категорий {len(categories)}, товаров {total} ({index_dir()})'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from index.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рейтинг и гистограмму оценок товаров по отзывам. '
+        'Нужна после изменений отзывов в обход ORM (импорт, SQL).'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            changed = recompute_ratings()
+        self.stdout.write(
+            self.style.SUCCESS(f'Исправлен рейтинг товаров: {len(changed)}')
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from index.spec_scores import recompute_scores, recompute_stale
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает оценку характеристик товаров в категориях. Запустить '
+        'после backfill_spec_values и после изменений в обход ORM (импорт, SQL, '
+        'перенос товаров между категориями через update()); с --stale — по '
+        'расписанию (cron) для категорий, помеченных при добавлении, удалении '
+        'и переносе товаров.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', type=int, action='append', help='Только категория с этим id')
+        parser.add_argument(
+            '--stale', action='store_true',
+            help='Только категории, помеченные к пересчёту (новый, удалённый или перенесённый товар)',
+        )
+
+    def handle(self, *args, **options):
+        if options['stale']:
+            category_ids, changed = recompute_stale()
+            self.stdout.write(self.style.SUCCESS(
+                f'Обновлена оценка товаров: {len(changed)} (категорий {len(category_ids)})'
+            ))
+            return
+        with transaction.atomic():
+            changed = recompute_scores(options['category'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Обновлена оценка товаров: {len(changed)}')
+        )
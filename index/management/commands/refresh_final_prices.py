@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from index.models import Product
+from index.pricing import refresh_final_prices, stale_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает итоговые цены товаров, у которых открылось или закрылось '
+        'окно скидки. Запускать по расписанию (например, cron раз в минуту).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересчитать все товары, а не только кандидатов (восстановление)',
+        )
+
+    def handle(self, *args, **options):
+        queryset = Product.objects.all() if options['all'] else stale_products()
+        changed = refresh_final_prices(queryset)
+        self.stdout.write(
+            self.style.SUCCESS(f'Обновлено итоговых цен: {len(changed)}')
+        )
@@ -0,0 +1,96 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from index.models import Review
+from index import versions
+from index.review_tags import rebuild_tag_counts
+from index.tagging import NO_KEYWORDS, get_tag_vocabulary, tag_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново выделяет теги всех отзывов — после импорта отзывов или '
+        'переименования типов характеристик. Отзывы читаются пачками по id, '
+        'размечаются в пуле процессов, изменившиеся теги пишутся bulk_update.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Отзывов в одной пачке из БД')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Процессов разметки (1 — без пула)',
+        )
+        parser.add_argument('--product', type=int, help='Только отзывы товара с этим id')
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        workers = max(1, options['workers'])
+        reviews = Review.objects.order_by('id')
+        if options['product']:
+            reviews = reviews.filter(product_id=options['product'])
+        total = reviews.count()
+        # Снимок на весь прогон: ключевые слова пачки — из словаря, без кэша и БД
+        product_keywords = get_tag_vocabulary().load_all()
+
+        started = time.monotonic()
+        processed = changed = 0
+        touched_products = set()
+        pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        try:
+            last_id = 0
+            while True:
+                # Keyset по id: пачка не зависит от номера, транзакция не держится весь прогон
+                chunk = list(
+                    reviews.filter(id__gt=last_id)
+                    .values_list('id', 'product_id', 'comment', 'tags')[:chunk_size]
+                )
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+                current = {review_id: (product_id, tags) for review_id, product_id, _, tags in chunk}
+                rows = [
+                    (review_id, comment, product_keywords.get(product_id, NO_KEYWORDS))
+                    for review_id, product_id, comment, _ in chunk
+                ]
+                updates = [
+                    Review(id=review_id, tags=tags)
+                    for review_id, tags in self._tag(pool, workers, rows)
+                    if tags != current[review_id][1]
+                ]
+                touched_products.update(current[review.id][0] for review in updates)
+                # bulk_update не шлёт сигналов — рейтинг и updated_at не трогаются
+                Review.objects.bulk_update(updates, ['tags'], batch_size=500)
+
+                processed += len(chunk)
+                changed += len(updates)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{processed}/{total} отзывов, изменено {changed}, '
+                    f'{processed / elapsed if elapsed else 0:.0f} отз/с'
+                )
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        # bulk_update обошёл сигналы — счётчики тегов пересобираются по затронутым товарам
+        if touched_products:
+            rebuild_tag_counts(touched_products)
+            versions.bump_products(touched_products)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {processed} отзывов, теги изменены у {changed}, '
+            f'{elapsed:.1f} с ({processed / elapsed if elapsed else 0:.0f} отз/с)'
+        ))
+
+    @staticmethod
+    def _tag(pool, workers, rows):
+        if pool is None:
+            return tag_rows(rows)
+        # Пачка делится на части по числу процессов — одна пересылка на процесс
+        size = -(-len(rows) // workers)
+        parts = [rows[i:i + size] for i in range(0, len(rows), size)]
+        return [result for part in pool.map(tag_rows, parts) for result in part]
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from index import search_cache
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша результатов поиска'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счётчики после вывода')
+
+    def handle(self, *args, **options):
+        stats = search_cache.stats()
+        self.stdout.write(
+            f'Попаданий: {stats["hits"]}, промахов: {stats["misses"]}, '
+            f'доля попаданий: {stats["hit_ratio"]:.1%}'
+        )
+        if options['reset']:
+            search_cache.reset_stats()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from index import sidebar
+
+
+class Command(BaseCommand):
+    help = 'Собирает кэш сайдбара каталога заранее (например, после деплоя)'
+
+    def handle(self, *args, **options):
+        data = sidebar.warm_up()
+        self.stdout.write(self.style.SUCCESS(
+            f'Сайдбар прогрет: категорий {len(data["categories"])}, '
+            f'брендов {len(data["brands"])}, характеристик {len(data["spec_filters"])}'
+        ))
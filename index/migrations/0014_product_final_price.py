@@ -0,0 +1,35 @@
+# Generated by Django 4.2.20 on 2026-10-16 22:52
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_final_price(apps, schema_editor):
+    """Заполняет final_price по текущему состоянию скидок."""
+    Product = apps.get_model('index', 'Product')
+    now = timezone.now()
+    products = list(Product.objects.select_related('discount'))
+    for product in products:
+        discount = product.discount
+        if discount and (discount.start_date is None or discount.start_date <= now) \
+                and (discount.end_date is None or discount.end_date >= now):
+            product.final_price = max(0, round(product.price - (product.price * discount.percent / 100), 2))
+        else:
+            product.final_price = product.price
+    Product.objects.bulk_update(products, ['final_price'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0013_alter_discount_percent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='final_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, help_text='Цена с учётом активной скидки, пересчитывается автоматически', max_digits=10, verbose_name='Итоговая цена'),
+        ),
+        migrations.RunPython(populate_final_price, migrations.RunPython.noop),
+    ]
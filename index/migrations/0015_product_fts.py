@@ -0,0 +1,53 @@
+from django.db import migrations
+
+FTS_TABLE = 'index_product_fts'
+BATCH_SIZE = 500
+
+
+def _insert(cursor, rows):
+    if rows:
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)', rows
+        )
+
+
+def create_fts_table(apps, schema_editor):
+    """Виртуальная таблица FTS5 для поиска — только на SQLite."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Текст пишется так же, как в FTS5SearchBackend: основы слов из stem_text()
+    from index.stemmer import stem_text
+
+    Product = apps.get_model('index', 'Product')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+            "USING fts5(name, description, tokenize='porter unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        products = Product.objects.values_list('id', 'name', 'description').iterator(chunk_size=BATCH_SIZE)
+        batch = []
+        for pk, name, description in products:
+            batch.append((pk, stem_text(name), stem_text(description)))
+            if len(batch) >= BATCH_SIZE:
+                _insert(cursor, batch)
+                batch = []
+        _insert(cursor, batch)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0014_product_final_price'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
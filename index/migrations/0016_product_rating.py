@@ -0,0 +1,77 @@
+# Generated by Django 4.2.20 on 2026-10-16 23:09
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_ratings(apps, schema_editor):
+    """Заполняет рейтинг товаров по существующим отзывам."""
+    Product = apps.get_model('index', 'Product')
+    Review = apps.get_model('index', 'Review')
+    histograms = {}
+    rows = Review.objects.values_list('product_id', 'rating').annotate(n=Count('id')).order_by()
+    for product_id, rating, n in rows:
+        histograms.setdefault(product_id, {})[rating] = n
+
+    products = list(Product.objects.filter(id__in=histograms))
+    for product in products:
+        histogram = histograms[product.id]
+        count = sum(histogram.values())
+        total = sum(star * n for star, n in histogram.items())
+        product.rating_count = count
+        product.rating_avg = (Decimal(total) / count).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        for star in range(1, 6):
+            setattr(product, f'rating_{star}', histogram.get(star, 0))
+    Product.objects.bulk_update(
+        products,
+        ['rating_avg', 'rating_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0015_product_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «1»'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «2»'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «3»'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «4»'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «5»'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=3, verbose_name='Средняя оценка'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
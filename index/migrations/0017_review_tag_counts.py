@@ -0,0 +1,48 @@
+# Generated by Django 4.2.20 on 2026-10-16 23:14
+
+from collections import Counter
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_tag_counts(apps, schema_editor):
+    """Считает теги существующих отзывов."""
+    Review = apps.get_model('index', 'Review')
+    ReviewTagCount = apps.get_model('index', 'ReviewTagCount')
+    counts = Counter()
+    for product_id, tags in Review.objects.values_list('product_id', 'tags').iterator(chunk_size=500):
+        counts.update((product_id, tag) for tag in set(tags))
+    ReviewTagCount.objects.bulk_create(
+        [ReviewTagCount(product_id=pid, tag=tag, count=n) for (pid, tag), n in counts.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0016_product_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewTagCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=255, verbose_name='Тег')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Отзывов с тегом')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_tag_counts', to='index.product')),
+            ],
+            options={
+                'verbose_name': 'Тег отзывов',
+                'verbose_name_plural': 'Теги отзывов',
+                'indexes': [models.Index(fields=['product', '-count'], name='index_revie_product_abd44a_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reviewtagcount',
+            constraint=models.UniqueConstraint(fields=('product', 'tag'), name='unique_review_tag_per_product'),
+        ),
+        migrations.RunPython(populate_tag_counts, migrations.RunPython.noop),
+    ]
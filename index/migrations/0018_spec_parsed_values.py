@@ -0,0 +1,32 @@
+# Generated by Django 4.2.20 on 2026-10-16 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0017_review_tag_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productspecification',
+            name='bool_value',
+            field=models.BooleanField(blank=True, editable=False, null=True, verbose_name='Булево значение'),
+        ),
+        migrations.AddField(
+            model_name='productspecification',
+            name='numeric_value',
+            field=models.DecimalField(blank=True, decimal_places=4, editable=False, max_digits=14, null=True, verbose_name='Числовое значение'),
+        ),
+        migrations.AddField(
+            model_name='productspecification',
+            name='token',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Нормализованное значение'),
+        ),
+        migrations.AddIndex(
+            model_name='productspecification',
+            index=models.Index(fields=['spec_type', 'numeric_value'], name='index_produ_spec_ty_f59706_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.20 on 2026-10-16 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0018_spec_parsed_values'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='spec_score',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='0–100 относительно товаров категории, пересчитывается автоматически', max_digits=5, verbose_name='Оценка характеристик'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-spec_score'], name='index_produ_categor_a43177_idx'),
+        ),
+    ]
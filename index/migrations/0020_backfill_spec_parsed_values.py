@@ -0,0 +1,31 @@
+# Generated by Django 4.2.20 on 2026-10-17 10:12
+
+from django.db import migrations
+
+from index.spec_values import parse_bool, parse_number, normalize_token
+
+
+def backfill_parsed_values(apps, schema_editor):
+    """Заполняет numeric_value, bool_value и token существующих характеристик по value."""
+    ProductSpecification = apps.get_model('index', 'ProductSpecification')
+    batch = []
+    for spec in ProductSpecification.objects.only('id', 'value').iterator(chunk_size=500):
+        spec.numeric_value = parse_number(spec.value)
+        spec.bool_value = parse_bool(spec.value)
+        spec.token = normalize_token(spec.value)
+        batch.append(spec)
+        if len(batch) >= 500:
+            ProductSpecification.objects.bulk_update(batch, ['numeric_value', 'bool_value', 'token'])
+            batch = []
+    ProductSpecification.objects.bulk_update(batch, ['numeric_value', 'bool_value', 'token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0019_product_spec_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_parsed_values, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-17 00:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('index', '0020_backfill_spec_parsed_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleSpecScores',
+            fields=[
+                ('category_id', models.PositiveIntegerField(primary_key=True, serialize=False, verbose_name='id категории')),
+            ],
+            options={
+                'verbose_name': 'Категория к пересчёту оценок',
+                'verbose_name_plural': 'Категории к пересчёту оценок',
+            },
+        ),
+    ]
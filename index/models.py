@@ -1,10 +1,16 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.utils.text import slugify
 from django.conf import settings
 from django.core.validators import MinLengthValidator, MaxLengthValidator, MaxValueValidator
 from appx.validators import product_image_validator, banner_image_validator
-import re
+
+from .spec_values import PARSED_FIELDS, parsed_fields
+
+# Денормализованный рейтинг товара — пишется только из index.ratings
+RATING_FIELDS = (
+    'rating_avg', 'rating_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+)
 
 
 class Category(models.Model):
@@ -81,11 +87,15 @@ class Discount(models.Model):
         verbose_name = "Скидка"
         verbose_name_plural = "Скидки"
 
-    def is_active(self):
-        now = timezone.now()
+    def is_active(self, now=None):
+        now = now or timezone.now()
         return (self.start_date is None or self.start_date <= now) and \
                (self.end_date is None or self.end_date >= now)
 
+    def apply_price(self, price):
+        """Цена после скидки — без проверки окна действия."""
+        return max(0, round(price - (price * self.percent / 100), 2))
+
     def __str__(self):
         return f"{self.name} ({self.percent}%)"
 
@@ -102,6 +112,32 @@ class Product(models.Model):
     tags = models.ManyToManyField(Tag, related_name='products', blank=True)
     discount = models.ForeignKey(
         Discount, on_delete=models.SET_NULL, null=True, blank=True)
+    final_price = models.DecimalField(
+        "Итоговая цена",
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        db_index=True,
+        help_text="Цена с учётом активной скидки, пересчитывается автоматически",
+    )
+    rating_avg = models.DecimalField(
+        "Средняя оценка", max_digits=3, decimal_places=2, default=0, editable=False, db_index=True,
+    )
+    rating_count = models.PositiveIntegerField("Количество оценок", default=0, editable=False)
+    rating_1 = models.PositiveIntegerField("Оценок «1»", default=0, editable=False)
+    rating_2 = models.PositiveIntegerField("Оценок «2»", default=0, editable=False)
+    rating_3 = models.PositiveIntegerField("Оценок «3»", default=0, editable=False)
+    rating_4 = models.PositiveIntegerField("Оценок «4»", default=0, editable=False)
+    rating_5 = models.PositiveIntegerField("Оценок «5»", default=0, editable=False)
+    spec_score = models.DecimalField(
+        "Оценка характеристик",
+        max_digits=5,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        help_text="0–100 относительно товаров категории, пересчитывается автоматически",
+    )
     main_image = models.ImageField(
         "Главное изображение",
         upload_to='products/',
@@ -115,16 +151,45 @@ class Product(models.Model):
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering = ['-id']
+        indexes = [
+            # Топ категории и сортировка «по характеристикам»
+            models.Index(fields=['category', '-spec_score']),
+        ]
 
-    def get_final_price(self):
-        if self.discount and self.discount.is_active():
-            return max(0, round(self.price - (self.price * self.discount.percent / 100), 2))
+    def compute_final_price(self, now=None):
+        """Пересчёт итоговой цены; сохраняется в final_price при save()."""
+        if self.discount and self.discount.is_active(now):
+            return self.discount.apply_price(self.price)
         return self.price
 
+    def get_final_price(self):
+        return self.final_price
+
     def has_discount(self):
-        return self.discount and self.discount.is_active()
+        return self.final_price < self.price
+
+    @property
+    def rating_histogram(self):
+        """[(звёзды, количество, доля в %)] от 5 к 1 — для гистограммы на странице товара."""
+        total = self.rating_count
+        rows = []
+        for star in range(5, 0, -1):
+            count = getattr(self, f'rating_{star}')
+            rows.append((star, count, round(count * 100 / total) if total else 0))
+        return rows
 
     def save(self, *args, **kwargs):
+        self.final_price = self.compute_final_price()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'price', 'discount', 'discount_id'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'final_price'}
+        elif update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # Рейтинг и оценка характеристик пишутся мимо save() — устаревшая
+            # копия в памяти (форма админки) не должна их затирать
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in (*RATING_FIELDS, 'spec_score')
+            ]
         if not self.slug:
             base_slug = slugify(self.name)
             slug = base_slug
@@ -134,6 +199,19 @@ class Product(models.Model):
                 counter += 1
             self.slug = slug
         super().save(*args, **kwargs)
+        self._loaded_category_id = self.category_id
+        self._loaded_final_price = self.final_price
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # Категория и цена из БД — оценки характеристик зависят от состава
+        # категории, суммы корзин — от итоговой цены; прочие правки их не трогают
+        if 'category_id' in field_names:
+            product._loaded_category_id = product.category_id
+        if 'final_price' in field_names:
+            product._loaded_final_price = product.final_price
+        return product
 
     def __str__(self):
         return self.name
@@ -192,6 +270,15 @@ class Review(models.Model):
     def __str__(self):
         return f"Review for {self.product.name} by {self.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        review = super().from_db(db, field_names, values)
+        # Состояние из БД — чтобы при правке/удалении поправить рейтинг
+        # и счётчики тегов товара на разницу
+        if {'product_id', 'rating', 'tags'} <= set(field_names):
+            review._loaded = (review.product_id, review.rating, tuple(review.tags))
+        return review
+
     def save(self, *args, **kwargs):
         # Автоматическая проверка верифицированной покупки, если есть пользователь
         if self.user and not self.is_verified_purchase:
@@ -205,75 +292,50 @@ class Review(models.Model):
         # Генерация тегов перед сохранением
         if self.comment:
             self.tags = self.extract_tags()
-            
-        super().save(*args, **kwargs)
+
+        # post_save пересчитывает рейтинг товара — в той же транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded = (self.product_id, self.rating, tuple(self.tags))
 
     def extract_tags(self):
         """
-        Улучшенный алгоритм выделения тегов согласно ТЗ:
-        - Учитывает частицу 'не' (не понравился экран)
-        - Частичное совпадение слов из характеристик (память -> оперативная память)
+        Теги из комментария по ключевым словам характеристик товара
+        (алгоритм — index.tagging.extract_tags, словарь кэшируется по версии).
         """
-        text = self.comment.lower()
-        # Список стоп-слов (базовый)
-        stop_words = {'и', 'а', 'но', 'же', 'бы', 'ли', 'в', 'на', 'с', 'к', 'по', 'о', 'об', 'из', 'за', 'под', 'над', 'через', 'для', 'от', 'до', 'у', 'при', 'очень', 'особенно'}
-        
-        # Получение ключевых слов из характеристик (слова длиннее 2 букв)
-        spec_types = list(self.product.specifications.values_list('spec_type__name', flat=True))
-        keywords = set()
-        for spec in spec_types:
-            words = re.findall(r'\w+', spec.lower())
-            keywords.update([w for w in words if len(w) > 2])
-
-        found_tags = []
-        # Разбиваем на фразы по знакам препинания
-        phrases = re.split(r'[,;:.!?\n]+', text)
-        
-        for phrase in phrases:
-            words = re.findall(r'\w+', phrase)
-            for i, word in enumerate(words):
-                # Если текущее слово - это ключевое слово (или часть характеристики)
-                if word in keywords:
-                    tag_parts = []
-                    
-                    # Проверяем 2 слова ДО ключевого во фразе
-                    look_back = 2
-                    start_idx = max(0, i - look_back)
-                    context_before = words[start_idx:i]
-                    
-                    # Ищем "не" в контексте
-                    has_negation = 'не' in context_before
-                    
-                    # Собираем части тега (игнорируя стоп-слова и ДРУГИЕ ключевые слова)
-                    for w in context_before:
-                        if w == 'не' or (w not in stop_words and w not in keywords):
-                            tag_parts.append(w)
-                    
-                    tag_parts.append(word)
-                    
-                    # Проверяем 1 слово ПОСЛЕ ключевого во фразе
-                    if i + 1 < len(words):
-                        next_word = words[i+1]
-                        # Не берем стоп-слова, частицу "не" или другие ключевые слова
-                        if next_word not in stop_words and next_word != 'не' and next_word not in keywords:
-                            tag_parts.append(next_word)
-                    
-                    # Если получилось больше одного слова (т.е. описание + характеристика)
-                    if len(tag_parts) > 1:
-                        # Если есть "не", оно должно быть в начале для ясности
-                        if has_negation and 'не' in tag_parts:
-                            tag_parts.remove('не')
-                            tag_parts.insert(0, 'не')
-                        
-                        found_tags.append("_".join(tag_parts))
-
-        # Убираем дубликаты и берем первые 5
-        unique_tags = []
-        for tag in found_tags:
-            if tag not in unique_tags:
-                unique_tags.append(tag)
-        
-        return unique_tags[:5]
+        from .tagging import extract_tags, get_tag_vocabulary
+        return extract_tags(self.comment, get_tag_vocabulary().keywords_for(self.product_id))
+
+
+class ReviewTagCount(models.Model):
+    """Сколько отзывов товара содержат тег — облако «что говорят покупатели»."""
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='review_tag_counts')
+    tag = models.CharField("Тег", max_length=255)
+    count = models.PositiveIntegerField("Отзывов с тегом", default=0)
+
+    class Meta:
+        verbose_name = "Тег отзывов"
+        verbose_name_plural = "Теги отзывов"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'tag'], name='unique_review_tag_per_product'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-count']),
+        ]
+
+    def __str__(self):
+        return f"{self.tag} ×{self.count}"
+
+
+class StaleSpecScores(models.Model):
+    """Категория, оценки характеристик которой ждут команды recompute_spec_scores --stale."""
+    # Без внешнего ключа: пометку ставит и удаление товаров при удалении самой категории
+    category_id = models.PositiveIntegerField("id категории", primary_key=True)
+
+    class Meta:
+        verbose_name = "Категория к пересчёту оценок"
+        verbose_name_plural = "Категории к пересчёту оценок"
 
 
 class Stock(models.Model):
@@ -340,6 +402,14 @@ class SpecificationType(models.Model):
             models.Index(fields=['is_comparable', '-priority']),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        spec_type = super().from_db(db, field_names, values)
+        # Название из БД — ключевые слова тегов отзывов меняются только с ним
+        if 'name' in field_names:
+            spec_type._loaded_name = spec_type.name
+        return spec_type
+
     def save(self, *args, **kwargs):
         if not self.slug:
             base_slug = slugify(self.name)
@@ -363,11 +433,41 @@ class ProductSpecification(models.Model):
         SpecificationType, on_delete=models.CASCADE, verbose_name="Характеристика")
     value = models.CharField("Значение", max_length=255)
 
+    # Разобранное value — заполняется в save() (см. spec_values)
+    numeric_value = models.DecimalField(
+        "Числовое значение", max_digits=14, decimal_places=4, null=True, blank=True, editable=False)
+    bool_value = models.BooleanField("Булево значение", null=True, blank=True, editable=False)
+    token = models.CharField("Нормализованное значение", max_length=255, blank=True, editable=False)
+
     class Meta:
         verbose_name = "элемент характеристик"
         verbose_name_plural = "Характеристики товаров"
         ordering = ['spec_type__name']
         unique_together = ['product', 'spec_type']
+        indexes = [
+            # Фильтр диапазона в каталоге: spec_type = ? AND numeric_value BETWEEN ? AND ?
+            models.Index(fields=['spec_type', 'numeric_value']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        spec = super().from_db(db, field_names, values)
+        # Товар и тип из БД — словарь тегов меняется, только если меняются они, а не value
+        if {'product_id', 'spec_type_id'} <= set(field_names):
+            spec._loaded = (spec.product_id, spec.spec_type_id)
+        return spec
+
+    def save(self, *args, **kwargs):
+        self.parse_value()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'value' in update_fields:
+            kwargs['update_fields'] = {*update_fields, *PARSED_FIELDS}
+        super().save(*args, **kwargs)
+
+    def parse_value(self):
+        """Заполняет numeric_value, bool_value и token из value."""
+        for field, parsed in parsed_fields(self.value).items():
+            setattr(self, field, parsed)
 
     def __str__(self):
         return f"{self.spec_type.name}: {self.value} ({self.product.name})"
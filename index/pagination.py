@@ -0,0 +1,139 @@
+"""
+Keyset (seek) пагинация каталога и поиска.
+
+Вместо OFFSET и COUNT(*) на каждой странице клиент получает непрозрачный
+курсор с ключом сортировки и id последнего показанного товара. Следующая
+страница — это «всё, что строго после курсора» в порядке сортировки.
+"""
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+
+
+def encode_cursor(price, product_id):
+    """Курсор (цена, id) → непрозрачная строка для URL."""
+    payload = json.dumps([None if price is None else str(price), product_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Разбирает курсор из URL.
+
+    Returns:
+        tuple|None: (Decimal|None, int) или None для пустого/повреждённого курсора
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        price, product_id = json.loads(raw)
+        if price is not None:
+            price = Decimal(price)
+            if not price.is_finite():
+                return None
+        if not isinstance(product_id, int):
+            return None
+    except (ValueError, TypeError, InvalidOperation):
+        return None
+    return price, product_id
+
+
+def encode_review_cursor(created_at, review_id):
+    """Курсор отзывов (created_at, id) → непрозрачная строка для URL."""
+    payload = json.dumps([created_at.isoformat(), review_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_review_cursor(token):
+    """
+    Returns:
+        tuple|None: (datetime, int) или None для пустого/повреждённого курсора
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, review_id = json.loads(raw)
+        created_at = datetime.fromisoformat(created_at)
+        if not isinstance(review_id, int):
+            return None
+    except (ValueError, TypeError):
+        return None
+    return created_at, review_id
+
+
+class KeysetPage:
+    """Страница keyset-пагинации с интерфейсом, похожим на django Page."""
+
+    def __init__(self, object_list, next_cursor, has_previous, count):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.has_previous = has_previous
+        self.count = count
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginate_keyset(object_list, order, cursor, per_page):
+    """
+    Одна keyset-страница из IdList / ProductIdList индекса фасетов.
+
+    Запрашивается per_page + 1 строк: лишняя означает, что есть следующая страница.
+
+    Returns:
+        tuple: (список товаров, курсор следующей страницы или None)
+    """
+    if cursor is not None and (cursor[0] is None) != (order == '-id'):
+        cursor = None  # курсор от другой сортировки — начинаем сначала
+    rows = object_list.seek(cursor, per_page + 1)
+
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    last = rows[-1]
+    value = None if order == '-id' else getattr(last, order.lstrip('-'))
+    return rows, encode_cursor(value, last.id)
+
+
+class KeysetPaginationMixin:
+    """
+    Опциональный keyset-режим для ListView.
+
+    Включается настройкой CATALOG_KEYSET_PAGINATION или параметром `cursor`
+    в запросе (пустой `?cursor=` — первая страница). Порядок сортировки view
+    выставляет в `keyset_order` в get_queryset().
+    """
+
+    keyset_order = '-id'
+
+    def use_keyset(self):
+        return 'cursor' in self.request.GET or getattr(settings, 'CATALOG_KEYSET_PAGINATION', False)
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.use_keyset():
+            return super().paginate_queryset(queryset, page_size)
+        cursor = decode_cursor(self.request.GET.get('cursor'))
+        rows, next_cursor = paginate_keyset(queryset, self.keyset_order, cursor, page_size)
+        # popcount маски индекса — точный и бесплатный счётчик
+        page = KeysetPage(rows, next_cursor, cursor is not None, len(queryset))
+        return None, page, rows, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['keyset'] = self.use_keyset()
+        return context
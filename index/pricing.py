@@ -0,0 +1,73 @@
+"""
+Пересчёт денормализованной итоговой цены товаров (Product.final_price).
+
+final_price пересчитывается при сохранении товара, при изменении скидки
+и командой refresh_final_prices, которую запускают по расписанию, чтобы
+цены переключались в момент открытия и закрытия окна скидки.
+"""
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import facets, similar, versions
+from .models import Product
+
+BULK_BATCH_SIZE = 500
+MAX_JOURNAL_IDS = 500  # больше изменённых товаров — индекс фасетов проще перестроить
+
+
+def active_discount_q(now):
+    """Условие «у товара есть скидка и её окно сейчас открыто»."""
+    return (
+        Q(discount__isnull=False)
+        & (Q(discount__start_date__isnull=True) | Q(discount__start_date__lte=now))
+        & (Q(discount__end_date__isnull=True) | Q(discount__end_date__gte=now))
+    )
+
+
+def stale_products(now=None):
+    """
+    Кандидаты на пересчёт после смены окна скидок.
+
+    Сейчас со скидкой — все товары с final_price < price (их немного);
+    скидка должна начать действовать — активная скидка, но final_price == price.
+    """
+    now = now or timezone.now()
+    return Product.objects.filter(
+        Q(final_price__lt=F('price'))
+        | (active_discount_q(now) & Q(final_price=F('price'), discount__percent__gt=0))
+    )
+
+
+def refresh_final_prices(queryset, now=None):
+    """
+    Пересчитывает final_price товаров queryset и пишет только изменившиеся.
+
+    Returns:
+        list: id товаров, у которых изменилась итоговая цена
+    """
+    now = now or timezone.now()
+    changed = []
+    products = (
+        queryset.select_related('discount')
+        .only('id', 'price', 'final_price', 'discount')
+        .iterator(chunk_size=BULK_BATCH_SIZE)
+    )
+    for product in products:
+        final_price = product.compute_final_price(now)
+        if final_price != product.final_price:
+            product.final_price = final_price
+            changed.append(product)
+
+    if not changed:
+        return []
+    Product.objects.bulk_update(changed, ['final_price'], batch_size=BULK_BATCH_SIZE)
+
+    # bulk_update не шлёт post_save — сообщаем индексу фасетов сами
+    ids = [product.id for product in changed]
+    journal = ids if len(ids) <= MAX_JOURNAL_IDS else facets.FULL_REBUILD
+    transaction.on_commit(lambda: facets.log_change(journal))
+    transaction.on_commit(lambda: versions.bump_products(ids))
+    transaction.on_commit(versions.bump_prices)
+    transaction.on_commit(lambda: similar.refresh_products(ids))
+    return ids
@@ -0,0 +1,143 @@
+"""
+Денормализованный рейтинг товаров.
+
+На товаре хранятся средняя оценка (rating_avg), число оценок (rating_count)
+и гистограмма по звёздам (rating_1 … rating_5). Они меняются одним UPDATE
+с F-выражениями в той же транзакции, что и сохранение или удаление отзыва,
+так что параллельные отзывы не теряют друг друга. Если счётчики разошлись
+с отзывами (правки в обход ORM, массовый импорт), их пересчитывает команда
+recompute_ratings.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, FloatField, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+
+from . import facets, versions
+from .models import RATING_FIELDS, Product, Review
+
+STARS = range(1, 6)
+BULK_BATCH_SIZE = 500
+MAX_JOURNAL_IDS = 500
+
+_AVG_FIELD = DecimalField(max_digits=3, decimal_places=2)
+
+
+def average(histogram):
+    """Средняя оценка по гистограмме {звёзды: количество}, округлённая до сотых."""
+    count = sum(histogram.values())
+    if not count:
+        return Decimal('0.00')
+    total = sum(star * n for star, n in histogram.items())
+    # Как ROUND() в SQL — половина округляется вверх
+    return (Decimal(total) / count).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def apply_review_change(product_id, added=None, removed=None):
+    """
+    Учитывает в рейтинге товара новую оценку added и/или снятую removed.
+
+    Все правые части UPDATE видят старые значения строки, поэтому среднее
+    считается из новых счётчиков прямо в том же запросе.
+    """
+    deltas = {star: 0 for star in STARS}
+    if added is not None:
+        deltas[added] += 1
+    if removed is not None:
+        deltas[removed] -= 1
+    if not any(deltas.values()):
+        return
+
+    stars = {star: F(f'rating_{star}') + deltas[star] for star in STARS}
+    count = F('rating_count') + sum(deltas.values())
+    total = Cast(sum(star * expression for star, expression in stars.items()), FloatField())
+    # Округление до сотых через целое: round(double, n) есть не во всех СУБД
+    avg = Coalesce(
+        Cast(Round(total * 100 / NullIf(count, 0)) / 100, _AVG_FIELD),
+        Value(Decimal('0.00')),
+        output_field=_AVG_FIELD,
+    )
+    updated = Product.objects.filter(pk=product_id).update(
+        rating_avg=avg, rating_count=count,
+        **{f'rating_{star}': expression for star, expression in stars.items() if deltas[star]},
+    )
+    if updated:
+        # update() не шлёт post_save — сортировка по рейтингу живёт в индексе фасетов
+        transaction.on_commit(lambda: facets.log_change([product_id]))
+
+
+def review_saved(review, created):
+    previous = getattr(review, '_loaded', None)
+    if created or previous is None:
+        apply_review_change(review.product_id, added=review.rating)
+        return
+    old_product_id, old_rating, _ = previous
+    if old_product_id != review.product_id:
+        apply_review_change(old_product_id, removed=old_rating)
+        apply_review_change(review.product_id, added=review.rating)
+    elif old_rating != review.rating:
+        apply_review_change(review.product_id, added=review.rating, removed=old_rating)
+
+
+def review_deleted(review):
+    product_id, rating, _ = getattr(review, '_loaded', (review.product_id, review.rating, ()))
+    apply_review_change(product_id, removed=rating)
+
+
+def recompute_ratings(queryset=None):
+    """
+    Пересчитывает рейтинг товаров queryset по отзывам и пишет только расхождения.
+
+    Returns:
+        list: id товаров, у которых рейтинг был неверным
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    changed = []
+    products = queryset.only('id', *RATING_FIELDS).iterator(chunk_size=BULK_BATCH_SIZE)
+    batch = []
+    for product in products:
+        batch.append(product)
+        if len(batch) >= BULK_BATCH_SIZE:
+            changed.extend(_recompute_batch(batch))
+            batch = []
+    changed.extend(_recompute_batch(batch))
+
+    if not changed:
+        return []
+    Product.objects.bulk_update(changed, RATING_FIELDS, batch_size=BULK_BATCH_SIZE)
+
+    ids = [product.id for product in changed]
+    journal = ids if len(ids) <= MAX_JOURNAL_IDS else facets.FULL_REBUILD
+    transaction.on_commit(lambda: facets.log_change(journal))
+    transaction.on_commit(lambda: versions.bump_products(ids))
+    return ids
+
+
+def _recompute_batch(products):
+    if not products:
+        return []
+    histograms = {product.id: dict.fromkeys(STARS, 0) for product in products}
+    rows = (
+        Review.objects.filter(product_id__in=histograms)
+        .values_list('product_id', 'rating')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    for product_id, rating, n in rows:
+        histograms[product_id][rating] = n
+
+    changed = []
+    for product in products:
+        histogram = histograms[product.id]
+        values = {
+            'rating_avg': average(histogram),
+            'rating_count': sum(histogram.values()),
+            **{f'rating_{star}': histogram[star] for star in STARS},
+        }
+        if any(getattr(product, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(product, field, value)
+            changed.append(product)
+    return changed
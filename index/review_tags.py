@@ -0,0 +1,114 @@
+"""
+Материализованные счётчики тегов отзывов по товарам (ReviewTagCount).
+
+Строка (товар, тег, count) меняется в той же транзакции, что и отзыв:
+новый тег сначала вставляется с count=0 (INSERT с игнорированием конфликта),
+затем все добавленные теги увеличиваются одним UPDATE с F-выражением —
+так параллельные отзывы с одним новым тегом не теряют счёт. Обнулившиеся
+строки удаляются. Облако тегов товара — один запрос по индексу (product, -count).
+
+bulk_update отзывов (retag_reviews) сигналов не шлёт — после него счётчики
+пересобираются rebuild_tag_counts() под блокировкой товаров и их отзывов,
+чтобы параллельный отзыв не потерял инкремент.
+"""
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import Product, Review, ReviewTagCount
+
+TAG_CLOUD_SIZE = 15
+REBUILD_BATCH_SIZE = 500
+
+
+def apply_tag_change(product_id, added=(), removed=()):
+    added, removed = set(added) - set(removed), set(removed) - set(added)
+    if added:
+        ReviewTagCount.objects.bulk_create(
+            [ReviewTagCount(product_id=product_id, tag=tag) for tag in added],
+            ignore_conflicts=True,
+        )
+        ReviewTagCount.objects.filter(product_id=product_id, tag__in=added).update(count=F('count') + 1)
+    if removed:
+        rows = ReviewTagCount.objects.filter(product_id=product_id, tag__in=removed)
+        rows.update(count=F('count') - 1)
+        rows.filter(count__lte=0).delete()
+
+
+def review_saved(review, created):
+    previous = getattr(review, '_loaded', None)
+    if created or previous is None:
+        apply_tag_change(review.product_id, added=review.tags)
+        return
+    old_product_id, _, old_tags = previous
+    if old_product_id != review.product_id:
+        apply_tag_change(old_product_id, removed=old_tags)
+        apply_tag_change(review.product_id, added=review.tags)
+    else:
+        apply_tag_change(review.product_id, added=review.tags, removed=old_tags)
+
+
+def review_deleted(review):
+    product_id, _, tags = getattr(review, '_loaded', (review.product_id, None, review.tags))
+    apply_tag_change(product_id, removed=tags)
+
+
+def tag_cloud(product, limit=TAG_CLOUD_SIZE):
+    """
+    Returns:
+        list: [(тег, число отзывов)] по убыванию частоты
+    """
+    return list(
+        ReviewTagCount.objects.filter(product=product)
+        .order_by('-count', 'tag')
+        .values_list('tag', 'count')[:limit]
+    )
+
+
+def tag_count(product, tag):
+    return (
+        ReviewTagCount.objects.filter(product=product, tag=tag)
+        .values_list('count', flat=True).first()
+    ) or 0
+
+
+def rebuild_tag_counts(product_ids=None):
+    """
+    Пересобирает счётчики тегов по отзывам.
+
+    Args:
+        product_ids: только эти товары (по умолчанию все)
+
+    Returns:
+        int: число записанных строк
+    """
+    reviews = Review.objects.values_list('product_id', 'tags').order_by()
+    products = Product.objects.order_by('id')
+    stale = ReviewTagCount.objects.all()
+    if product_ids is not None:
+        reviews = reviews.filter(product_id__in=product_ids)
+        products = products.filter(id__in=product_ids)
+        stale = stale.filter(product_id__in=product_ids)
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update:
+            # Товары и их отзывы блокируются до подсчёта: новый отзыв ждёт на
+            # проверке внешнего ключа, правка и удаление — на строке отзыва,
+            # пока пересобранные счётчики не закоммичены
+            list(products.select_for_update().values_list('id', flat=True))
+            reviews = reviews.select_for_update()
+        else:
+            # SQLite: запись до чтения — транзакция сразу держит блокировку
+            # записи, и параллельные отзывы ждут её коммита
+            stale.delete()
+        counts = Counter()
+        for product_id, tags in reviews.iterator(chunk_size=REBUILD_BATCH_SIZE):
+            counts.update((product_id, tag) for tag in set(tags))
+        if connection.features.has_select_for_update:
+            stale.delete()
+        ReviewTagCount.objects.bulk_create(
+            [ReviewTagCount(product_id=pid, tag=tag, count=n) for (pid, tag), n in counts.items()],
+            batch_size=REBUILD_BATCH_SIZE,
+        )
+    return len(counts)
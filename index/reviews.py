@@ -0,0 +1,67 @@
+"""
+Постраничная выдача отзывов товара.
+
+Отзывы идут от новых к старым в порядке (created_at, id) — его покрывает
+индекс Review ['product', '-created_at']. Следующая страница запрашивается
+по keyset-курсору «всё строго после последнего показанного отзыва», без
+OFFSET, поэтому стоимость страницы не растёт с её номером.
+
+Фильтры по оценке и тегу уходят в SQL. Тег, которого нет в счётчиках
+ReviewTagCount, отсекается без обращения к отзывам.
+"""
+from django.db import connection
+from django.db.models import Q
+
+from .pagination import encode_review_cursor
+from .review_tags import tag_count
+
+REVIEWS_PER_PAGE = 10
+
+
+def _after(queryset, cursor):
+    if cursor is None:
+        return queryset
+    created_at, review_id = cursor
+    return queryset.filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=review_id)
+    )
+
+
+def with_tag(queryset, tag):
+    """Отзывы, в JSON-списке тегов которых есть tag."""
+    if connection.features.supports_json_field_contains:
+        return queryset.filter(tags__contains=[tag])
+    # SQLite: contains по JSON не поддерживается — разворачиваем список json_each
+    table = queryset.model._meta.db_table
+    return queryset.extra(
+        where=[f'EXISTS (SELECT 1 FROM json_each("{table}"."tags") WHERE json_each.value = %s)'],
+        params=[tag],
+    )
+
+
+def review_page(product, cursor=None, rating=None, tag=None, per_page=REVIEWS_PER_PAGE):
+    """
+    Одна страница отзывов товара.
+
+    Args:
+        cursor: (created_at, id) последнего показанного отзыва или None
+        rating: только отзывы с этой оценкой
+        tag: только отзывы с этим тегом
+
+    Returns:
+        tuple: (список отзывов, курсор следующей страницы или None)
+    """
+    if tag and not tag_count(product, tag):
+        return [], None
+    queryset = product.reviews.order_by('-created_at', '-id')
+    if rating is not None:
+        queryset = queryset.filter(rating=rating)
+    if tag:
+        queryset = with_tag(queryset, tag)
+
+    rows = list(_after(queryset, cursor)[:per_page + 1])
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    last = rows[-1]
+    return rows, encode_review_cursor(last.created_at, last.id)
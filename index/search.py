@@ -0,0 +1,214 @@
+"""
+Полнотекстовый поиск товаров.
+
+Бэкенд подключается настройкой SEARCH_BACKEND (путь к классу). По умолчанию —
+FTS5SearchBackend: виртуальная таблица SQLite FTS5 с BM25-ранжированием,
+синхронизируемая сигналами Product. Для других СУБД есть SimpleSearchBackend
+на icontains без ранжирования.
+
+Бэкенд возвращает только id найденных товаров по убыванию релевантности;
+фильтры сайдбара накладываются на этот набор через индекс фасетов.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+
+from .stemmer import CYRILLIC_RE, light_stem_en, normalize_word, stem_text, tokenize
+
+MAX_RESULTS = 1000  # дальше релевантность уже ничего не значит
+MAX_QUERY_TERMS = 10
+SNIPPET_WORDS = 24
+REBUILD_BATCH_SIZE = 500
+
+
+def query_terms(query):
+    """Нормализованные слова запроса без повторов (не больше MAX_QUERY_TERMS)."""
+    terms = []
+    for word in tokenize(query):
+        term = normalize_word(word)
+        if term and term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def _highlight_key(word):
+    word = word.lower().replace('ё', 'е')
+    if CYRILLIC_RE.search(word):
+        return normalize_word(word)
+    return light_stem_en(word)
+
+
+def highlight(text, query, words=SNIPPET_WORDS):
+    """
+    Сниппет текста вокруг первого совпадения с подсвеченными словами запроса.
+
+    Совпадение — префиксное по основам, как и в самом поиске.
+    Returns: безопасный HTML или '' для пустого текста.
+    """
+    if not text:
+        return ''
+    keys = [
+        term if CYRILLIC_RE.search(term) else light_stem_en(term)
+        for term in query_terms(query)
+    ]
+    tokens = re.split(r'(\w+)', text)  # слова на нечётных позициях
+    word_positions = list(range(1, len(tokens), 2))
+    matched = {
+        i for i in word_positions
+        if any(_highlight_key(tokens[i]).startswith(key) for key in keys)
+    }
+    first = min(matched, default=1)
+    # Окно в words слов, первое совпадение — ближе к началу окна
+    start_word = max(0, word_positions.index(first) - 3) if word_positions else 0
+    window = word_positions[start_word:start_word + words]
+    if not window:
+        return escape(text)
+    begin, end = window[0], window[-1] + 1
+
+    parts = ['…' if start_word > 0 else '']
+    for i in range(begin, end):
+        piece = escape(tokens[i])
+        parts.append(f'<mark>{piece}</mark>' if i in matched else piece)
+    if end < len(tokens) - 1:
+        parts.append('…')
+    return mark_safe(''.join(parts))
+
+
+class BaseSearchBackend:
+    """Интерфейс бэкенда поиска."""
+
+    def search(self, query, limit=MAX_RESULTS):
+        """
+        Returns:
+            list: id товаров по убыванию релевантности
+        """
+        raise NotImplementedError
+
+    def update(self, products):
+        """Переиндексирует товары после сохранения."""
+
+    def remove(self, product_ids):
+        """Удаляет товары из индекса."""
+
+    def rebuild(self):
+        """
+        Полная переиндексация.
+
+        Returns:
+            int: количество проиндексированных товаров
+        """
+        return 0
+
+    def highlight(self, text, query):
+        return highlight(text, query)
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """Поиск подстрокой по названию и описанию — без индекса и ранжирования."""
+
+    def search(self, query, limit=MAX_RESULTS):
+        from .models import Product
+
+        query = query.strip()
+        if not query:
+            return []
+        return list(
+            Product.objects
+            .filter(Q(name__icontains=query) | Q(description__icontains=query))
+            .order_by('-id')
+            .values_list('id', flat=True)[:limit]
+        )
+
+
+class FTS5SearchBackend(BaseSearchBackend):
+    """
+    SQLite FTS5: таблица index_product_fts(rowid = id товара, name, description).
+
+    В таблицу пишется текст после stem_text() — русские основы; английские
+    слова стеммит токенизатор porter. Каждое слово запроса ищется как префикс,
+    поэтому работает поиск по мере ввода. Таблицу создаёт миграция 0015.
+    """
+
+    table = 'index_product_fts'
+    name_weight = 10.0  # совпадение в названии важнее совпадения в описании
+    description_weight = 1.0
+
+    @staticmethod
+    def match_expression(query):
+        """Выражение MATCH: все слова запроса как префиксы ("ноутбук"* "apple"*)."""
+        return ' '.join(f'"{term}"*' for term in query_terms(query))
+
+    def search(self, query, limit=MAX_RESULTS):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                f'ORDER BY bm25({self.table}, %s, %s), rowid DESC LIMIT %s',
+                [expression, self.name_weight, self.description_weight, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def _row(product):
+        return product.pk, stem_text(product.name), stem_text(product.description)
+
+    def update(self, products):
+        rows = [self._row(product) for product in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows]
+            )
+            self._insert(cursor, rows)
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [(pid,) for pid in product_ids]
+            )
+
+    def rebuild(self):
+        from .models import Product
+
+        count = 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            batch = []
+            for product in Product.objects.only('id', 'name', 'description').iterator(
+                    chunk_size=REBUILD_BATCH_SIZE):
+                batch.append(self._row(product))
+                if len(batch) >= REBUILD_BATCH_SIZE:
+                    self._insert(cursor, batch)
+                    count += len(batch)
+                    batch = []
+            self._insert(cursor, batch)
+            count += len(batch)
+            # Слияние сегментов FTS5 после массовой вставки
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+        return count
+
+    def _insert(self, cursor, rows):
+        if rows:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)', rows
+            )
+
+
+_backend = None
+
+
+def get_search_backend():
+    """Бэкенд из настройки SEARCH_BACKEND (создаётся один раз на процесс)."""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'SEARCH_BACKEND', 'index.search.FTS5SearchBackend')
+        _backend = import_string(path)()
+    return _backend
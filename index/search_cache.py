@@ -0,0 +1,70 @@
+"""
+Кэш результатов поиска.
+
+Ключ — каноническая форма запроса: строка в нижнем регистре со схлопнутыми
+пробелами, нормализованная подпись фильтров сайдбара и порядок сортировки.
+Хранится только упорядоченный список id (array), признак нечёткой выдачи
+и счётчики фасетов; страница гидрируется одним запросом `id__in`.
+
+В ключ входит версия индекса фасетов — она растёт при любой записи в каталог,
+так что устаревшие результаты просто перестают запрашиваться.
+"""
+import hashlib
+from array import array
+
+from django.core.cache import cache
+
+from .versions import increment_counter
+
+RESULT_CACHE_KEY = 'search_results:{}:{}'
+RESULT_CACHE_TTL = 60 * 10
+HITS_CACHE_KEY = 'search_results:hits'
+MISSES_CACHE_KEY = 'search_results:misses'
+
+
+def normalize_query(query):
+    """'  iPhone   15 ' → 'iphone 15'."""
+    return ' '.join(query.lower().split())
+
+
+def cache_key(version, query, signature, order):
+    """
+    Args:
+        signature: facets.filter_signature() фильтров сайдбара
+        order: нормализованный порядок сортировки ('-id', 'final_price', RELEVANCE, ...)
+    """
+    digest = hashlib.md5(repr((normalize_query(query), signature, order)).encode()).hexdigest()
+    return RESULT_CACHE_KEY.format(version, digest)
+
+
+def get_results(key):
+    """
+    Returns:
+        tuple|None: (список id, нечёткая ли выдача, счётчики фасетов)
+    """
+    entry = cache.get(key)
+    increment_counter(MISSES_CACHE_KEY if entry is None else HITS_CACHE_KEY)
+    if entry is None:
+        return None
+    ids, fuzzy, facet_counts = entry
+    return ids.tolist(), fuzzy, facet_counts
+
+
+def store_results(key, ids, fuzzy, facet_counts):
+    cache.set(key, (array('I', ids), fuzzy, facet_counts), RESULT_CACHE_TTL)
+
+
+def stats():
+    """Общие для всех воркеров счётчики попаданий и промахов."""
+    hits = cache.get(HITS_CACHE_KEY, 0)
+    misses = cache.get(MISSES_CACHE_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_CACHE_KEY, MISSES_CACHE_KEY])
@@ -2,17 +2,27 @@
 Сервис сравнения товаров.
 Логика сравнения характеристик товаров в рамках одной категории.
 """
-import re
-from decimal import Decimal
-from django.db.models import Prefetch
+from collections import defaultdict
+
 from django.core.cache import cache
+from index import spec_values, versions
 from index.models import Product, SpecificationType, ProductSpecification
 
 
 class ComparisonService:
     """Сервис для сравнения товаров."""
     
-    CACHE_TIMEOUT = 300  # 5 минут
+    # Ключ собран из версий — устаревшие данные не читаются, TTL только вытесняет
+    CACHE_TIMEOUT = 60 * 60 * 24
+    MIN_PRODUCTS = 2
+    MAX_PRODUCTS = 6
+    MAX_BATCH = 50  # наборов в одном пакетном запросе
+    COUNT_ERROR = f"Для сравнения выберите от {MIN_PRODUCTS} до {MAX_PRODUCTS} товаров"
+
+    @staticmethod
+    def normalize_ids(product_ids):
+        """Убирает повторы, сохраняя порядок выбора."""
+        return list(dict.fromkeys(product_ids))
 
     @staticmethod
     def validate_products(product_ids):
@@ -20,20 +30,29 @@ class ComparisonService:
         Проверяет, что можно сравнивать товары.
         
         Args:
-            product_ids: Список ID товаров
+            product_ids: Список ID товаров (от MIN_PRODUCTS до MAX_PRODUCTS)
             
         Returns:
-            tuple: (success: bool, error: str|None, products: QuerySet|None)
+            tuple: (success: bool, error: str|None, products: list|None) —
+            товары в порядке product_ids
         """
-        if len(product_ids) != 2:
-            return False, "Для сравнения нужно выбрать ровно 2 товара", None
-        
-        products = Product.objects.filter(id__in=product_ids).select_related(
-            'category', 'brand'
-        )
+        product_ids = ComparisonService.normalize_ids(product_ids)
+        if not ComparisonService._count_ok(product_ids):
+            return False, ComparisonService.COUNT_ERROR, None
         
-        if products.count() != 2:
-            return False, "Один или оба товара не найдены", None
+        by_id = Product.objects.select_related('category', 'brand').in_bulk(product_ids)
+        return ComparisonService._check_loaded(product_ids, by_id)
+
+    @staticmethod
+    def _count_ok(product_ids):
+        return ComparisonService.MIN_PRODUCTS <= len(product_ids) <= ComparisonService.MAX_PRODUCTS
+
+    @staticmethod
+    def _check_loaded(product_ids, by_id):
+        """validate_products по уже загруженным товарам (by_id: id -> Product)."""
+        if any(pid not in by_id for pid in product_ids):
+            return False, "Некоторые товары не найдены", None
+        products = [by_id[pid] for pid in product_ids]
         
         # Проверяем, что товары из одной категории
         categories = set(p.category_id for p in products)
@@ -47,6 +66,9 @@ class ComparisonService:
         """
         Извлекает значение из текстового поля в зависимости от типа сравнения.
         
+        При сохранении характеристики то же самое кладётся в numeric_value,
+        bool_value и token — сравнение читает готовые колонки (stored_value).
+        
         Args:
             raw_value: Текстовое значение (например, "8 ГБ", "AMOLED")
             comparison_type: Тип сравнения
@@ -61,22 +83,40 @@ class ComparisonService:
             return raw_value.strip()
         
         if comparison_type == 'boolean':
-            raw_lower = raw_value.lower()
-            return any(x in raw_lower for x in ['да', 'yes', 'есть', '1', 'true', '+'])
+            return spec_values.parse_bool(raw_value)
         
-        # Числовые типы: извлекаем число
-        # Примеры: "8 ГБ", "256GB", "150г", "6.7 дюймов"
-        raw_clean = raw_value.replace(',', '.').strip()
-        
-        # Извлекаем первое число (целое или дробное)
-        match = re.search(r'([\d.]+)', raw_clean)
-        if match:
-            try:
-                return Decimal(match.group(1))
-            except (ValueError, ArithmeticError):
-                pass
+        # Числовые типы: "8 ГБ", "256GB", "150г", "6.7 дюймов"
+        return spec_values.parse_number(raw_value)
+
+    @staticmethod
+    def stored_value(spec, comparison_type):
+        """Значение характеристики для сравнения из разобранных при записи колонок."""
+        if spec is None:
+            return None
+        if comparison_type == 'categorical':
+            return spec.token or None
+        if comparison_type == 'boolean':
+            return spec.bool_value
+        return spec.numeric_value
+
+    @staticmethod
+    def _cache_keys(groups):
+        """
+        Ключи кэша из версий товаров и версии типов характеристик.
         
-        return None
+        Запись характеристики, цены или скидки товара поднимает его версию —
+        и все сравнения с ним перестают находиться в кэше без перебора ключей.
+        Версии всех наборов читаются одним get_many.
+        """
+        product_versions = versions.product_versions({pid for ids in groups for pid in ids})
+        spec_types_version = versions.spec_types_version()
+        return [
+            'comparison:{}:{}'.format(
+                spec_types_version,
+                ':'.join(f'{pid}.{product_versions[pid]}' for pid in sorted(set(ids))),
+            )
+            for ids in groups
+        ]
 
     @staticmethod
     def get_comparison_data(product_ids):
@@ -85,113 +125,122 @@ class ComparisonService:
         Использует кэширование для производительности.
         
         Args:
-            product_ids: Список ID товаров (ровно 2)
+            product_ids: Список ID товаров (от 2 до 6)
             
         Returns:
             dict: Данные для сравнения или error
         """
-        # Проверяем кэш
-        cache_key = f'comparison:{":".join(map(str, sorted(product_ids)))}'
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return cached_data
-        
-        # Валидация
-        success, error, products = ComparisonService.validate_products(product_ids)
-        if not success:
-            return {'error': error}
+        return ComparisonService.get_batch_comparison_data([product_ids])[0]
+
+    @staticmethod
+    def get_batch_comparison_data(groups):
+        """
+        Сравнения нескольких наборов товаров: «этот телефон против каждой из 10 альтернатив».
         
-        category = products[0].category
+        Кэш читается и пишется одним get_many/set_many. Товары, типы
+        характеристик и характеристики всех наборов-промахов загружаются
+        вместе — 3 запроса независимо от числа наборов; значение
+        характеристики товара, входящего в несколько наборов, готовится один раз.
         
-        # Получаем активные типы характеристик для сравнения
-        spec_types = SpecificationType.objects.filter(
-            is_comparable=True
-        ).order_by('-priority', 'name')
+        Args:
+            groups: Список списков ID товаров
+            
+        Returns:
+            list: для каждого набора — данные сравнения или {'error': ...}
+        """
+        groups = [ComparisonService.normalize_ids(ids) for ids in groups]
+        results = [
+            None if ComparisonService._count_ok(ids) else {'error': ComparisonService.COUNT_ERROR}
+            for ids in groups
+        ]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
         
-        # Получаем характеристики для всех товаров с prefetch
-        specs = ProductSpecification.objects.filter(
-            product__in=products,
-            spec_type__in=spec_types
-        ).select_related('spec_type', 'product')
+        # Проверяем кэш
+        keys = ComparisonService._cache_keys([groups[i] for i in pending])
+        cached = cache.get_many(set(keys))
+        missing = []
+        for i, key in zip(pending, keys):
+            if key in cached:
+                results[i] = ComparisonService._in_order(cached[key], groups[i])
+            else:
+                missing.append((i, key))
+        if not missing:
+            return results
         
-        # Группируем характеристики по товарам
-        product_specs = {}
-        for spec in specs:
-            if spec.product_id not in product_specs:
-                product_specs[spec.product_id] = {}
-            product_specs[spec.product_id][spec.spec_type_id] = spec
+        by_id = Product.objects.select_related('category', 'brand').in_bulk(
+            {pid for i, _ in missing for pid in groups[i]}
+        )
+        valid = []
+        for i, key in missing:
+            # Валидация
+            success, error, products = ComparisonService._check_loaded(groups[i], by_id)
+            if success:
+                valid.append((i, key, products))
+            else:
+                results[i] = {'error': error}
+        if not valid:
+            return results
         
-        # Формируем результат
-        result_spec_types = []
-        for spec_type in spec_types:
-            spec_type_data = {
-                'id': spec_type.id,
-                'name': spec_type.name,
-                'comparison_type': spec_type.comparison_type,
-                'unit': spec_type.unit,
-                'priority': spec_type.priority,
-                'category_map': spec_type.category_map,
-                'products': []
-            }
-            
-            # Получаем значения для каждого товара
-            values = []
-            for product in products:
-                spec = product_specs.get(product.id, {}).get(spec_type.id)
-                
-                if spec:
-                    raw_value = spec.value
-                    normalized = ComparisonService.parse_value(
-                        raw_value, 
-                        spec_type.comparison_type
-                    )
-                else:
-                    raw_value = '—'
-                    normalized = None
-                
-                values.append({
-                    'product_id': product.id,
-                    'product_name': product.name,
-                    'product_image': product.main_image.url if product.main_image else None,
-                    'raw_value': raw_value,
-                    'normalized_value': normalized,
-                })
-            
-            # Определяем победителя
-            values = ComparisonService._determine_winner(values, spec_type)
-            spec_type_data['products'] = values
-            
-            result_spec_types.append(spec_type_data)
+        builder = _ComparisonBuilder([p for _, _, products in valid for p in products])
+        fresh = {}
+        for i, key, products in valid:
+            if key in fresh:
+                # Тот же набор в другом порядке
+                results[i] = ComparisonService._in_order(fresh[key], groups[i])
+            else:
+                results[i] = fresh[key] = builder.build(products)
         
-        result = {
-            'category': {
-                'id': category.id,
-                'name': category.name,
-                'slug': category.slug,
-            },
-            'products': [
-                {
-                    'id': p.id,
-                    'name': p.name,
-                    'slug': p.slug,
-                    'image': p.main_image.url if p.main_image else None,
-                    'price': str(p.price),
-                    'final_price': str(p.get_final_price()),
-                }
-                for p in products
+        # Сохраняем в кэш
+        cache.set_many(fresh, ComparisonService.CACHE_TIMEOUT)
+        return results
+
+    @staticmethod
+    def _in_order(data, product_ids):
+        """
+        Данные из кэша — в порядке выбора товаров: ключ кэша от порядка не зависит.
+        """
+        if [p['id'] for p in data['products']] == product_ids:
+            return data
+        position = {pid: i for i, pid in enumerate(product_ids)}
+        return {
+            **data,
+            'products': sorted(data['products'], key=lambda p: position[p['id']]),
+            'metrics': [
+                {**metric, 'products': sorted(metric['products'], key=lambda p: position[p['product_id']])}
+                for metric in data['metrics']
             ],
-            'metrics': result_spec_types,
         }
+
+    @staticmethod
+    def _score(value, spec_type, category_scores):
+        """
+        Оценка значения, которую можно сравнивать: больше — лучше.
         
-        # Сохраняем в кэш
-        cache.set(cache_key, result, ComparisonService.CACHE_TIMEOUT)
-        
-        return result
+        Returns:
+            Decimal|int|None: None — значения нет (хуже любого)
+        """
+        if value is None:
+            return None
+        comparison_type = spec_type.comparison_type
+        if comparison_type == 'lower_better':
+            return -value
+        if comparison_type == 'categorical':
+            # value — token, ключи карты нормализованы так же: «amoled» = «AMOLED»
+            return category_scores.get(value, 0)
+        if comparison_type == 'boolean':
+            return int(value)
+        return value
 
     @staticmethod
-    def _determine_winner(values, spec_type):
+    def _rank_values(values, spec_type):
         """
-        Определяет победителя по характеристике.
+        Отмечает лучшие и худшие значения характеристики среди всех товаров.
+        
+        Один проход: каждое значение сводится к оценке (_score), затем
+        max/min по оценкам. Лучших и худших может быть несколько; если все
+        оценки равны — у всех is_tie. Товар без значения — худший.
         
         Args:
             values: Список значений для товаров
@@ -200,85 +249,132 @@ class ComparisonService:
         Returns:
             list: Values с добавленными is_best, is_worst, is_tie
         """
-        if len(values) != 2:
-            return values
-        
-        val_a = values[0]['normalized_value']
-        val_b = values[1]['normalized_value']
-        
-        # Если нет значений — ничья
-        if val_a is None and val_b is None:
-            for v in values:
-                v['is_best'] = False
-                v['is_worst'] = False
-                v['is_tie'] = True
-            return values
-        
-        # Если одно значение отсутствует
-        if val_a is None:
-            values[1]['is_best'] = True
-            values[1]['is_worst'] = False
-            values[1]['is_tie'] = False
-            values[0]['is_best'] = False
-            values[0]['is_worst'] = True
-            values[0]['is_tie'] = False
-            return values
-        
-        if val_b is None:
-            values[0]['is_best'] = True
-            values[0]['is_worst'] = False
-            values[0]['is_tie'] = False
-            values[1]['is_best'] = False
-            values[1]['is_worst'] = True
-            values[1]['is_tie'] = False
-            return values
-        
-        # Сравниваем значения
-        if val_a == val_b:
-            # Ничья
-            for v in values:
-                v['is_best'] = False
-                v['is_worst'] = False
-                v['is_tie'] = True
-        else:
-            # Определяем победителя по типу сравнения
-            if spec_type.comparison_type == 'higher_better':
-                winner_idx = 0 if val_a > val_b else 1
-            elif spec_type.comparison_type == 'lower_better':
-                winner_idx = 0 if val_a < val_b else 1
-            elif spec_type.comparison_type == 'categorical':
-                # Используем category_map для сравнения
-                score_a = spec_type.category_map.get(str(val_a), 0)
-                score_b = spec_type.category_map.get(str(val_b), 0)
-                winner_idx = 0 if score_a > score_b else (1 if score_b > score_a else -1)
-            elif spec_type.comparison_type == 'boolean':
-                winner_idx = 0 if val_a and not val_b else (1 if val_b and not val_a else -1)
-            else:
-                winner_idx = 0 if val_a > val_b else 1
-            
-            if winner_idx == -1:
-                # Ничья в categorical/boolean
-                for v in values:
-                    v['is_best'] = False
-                    v['is_worst'] = False
-                    v['is_tie'] = True
-            else:
-                values[winner_idx]['is_best'] = True
-                values[winner_idx]['is_worst'] = False
-                values[winner_idx]['is_tie'] = False
-                
-                loser_idx = 1 - winner_idx
-                values[loser_idx]['is_best'] = False
-                values[loser_idx]['is_worst'] = True
-                values[loser_idx]['is_tie'] = False
+        category_scores = {
+            spec_values.normalize_token(key): score
+            for key, score in (spec_type.category_map or {}).items()
+        }
+        scores = [
+            ComparisonService._score(v['normalized_value'], spec_type, category_scores)
+            for v in values
+        ]
+        present = [score for score in scores if score is not None]
+        best = max(present, default=None)
+        worst = None if len(present) < len(scores) else min(present, default=None)
+        tie = best == worst
         
+        for value, score in zip(values, scores):
+            value['is_tie'] = tie
+            value['is_best'] = not tie and score is not None and score == best
+            value['is_worst'] = not tie and score == worst
         return values
 
     @staticmethod
     def invalidate_cache(product_ids):
         """
-        Очищает кэш для указанных товаров.
-        Вызывать после обновления характеристик.
+        Сбрасывает все сравнения с этими товарами (поднимает их версии).
+        Сигналы делают это сами; вызывать после правок в обход ORM.
         """
-        cache_key = f'comparison:{":".join(map(str, sorted(product_ids)))}'
-        cache.delete(cache_key)
+        versions.bump_products(product_ids)
+
+
+class _ComparisonBuilder:
+    """
+    Сборка результатов сравнения для набора товаров из нескольких категорий.
+    
+    Все данные грузятся в конструкторе — 2 запроса; build() к БД не обращается.
+    """
+
+    def __init__(self, products):
+        product_ids = {p.id for p in products}
+
+        # Характеристики всех товаров одним запросом
+        self.product_specs = defaultdict(dict)
+        specs = ProductSpecification.objects.filter(
+            product_id__in=product_ids,
+            spec_type__is_comparable=True,
+        ).only('product_id', 'spec_type_id', 'value', *spec_values.PARSED_FIELDS)
+        for spec in specs:
+            self.product_specs[spec.product_id][spec.spec_type_id] = spec
+
+        # Только типы, которые есть у сравниваемых товаров категории, —
+        # по id из уже загруженных характеристик, без прохода по категории
+        category_type_ids = defaultdict(set)
+        for product in products:
+            category_type_ids[product.category_id].update(self.product_specs[product.id])
+        spec_types = SpecificationType.objects.in_bulk(set().union(*category_type_ids.values()))
+        self.category_spec_types = {
+            category_id: sorted(
+                (spec_types[type_id] for type_id in type_ids),
+                key=lambda spec_type: (-spec_type.priority, spec_type.name),
+            )
+            for category_id, type_ids in category_type_ids.items()
+        }
+
+        self._cells = {}
+        self._products = {}
+
+    def cell(self, product, spec_type):
+        """Значение характеристики товара — одно на все наборы, где он участвует."""
+        key = (product.id, spec_type.id)
+        if key not in self._cells:
+            spec = self.product_specs[product.id].get(spec_type.id)
+            self._cells[key] = (
+                spec is not None,
+                spec.value if spec is not None else '—',
+                ComparisonService.stored_value(spec, spec_type.comparison_type),
+            )
+        return self._cells[key]
+
+    def product_data(self, product):
+        if product.id not in self._products:
+            self._products[product.id] = {
+                'id': product.id,
+                'name': product.name,
+                'slug': product.slug,
+                'image': product.main_image.url if product.main_image else None,
+                'price': str(product.price),
+                'final_price': str(product.get_final_price()),
+            }
+        return self._products[product.id]
+
+    def build(self, products):
+        category = products[0].category
+        
+        # Формируем результат
+        metrics = []
+        for spec_type in self.category_spec_types.get(category.id, ()):
+            cells = [self.cell(product, spec_type) for product in products]
+            # Ни у одного из товаров нет значения — строка ничего не сравнивает.
+            # Так результат зависит только от сравниваемых товаров и типов
+            # характеристик — от того, что входит в ключ кэша
+            if not any(present for present, _, _ in cells):
+                continue
+            values = [
+                {
+                    'product_id': product.id,
+                    'product_name': product.name,
+                    'product_image': self.product_data(product)['image'],
+                    'raw_value': raw_value,
+                    'normalized_value': normalized,
+                }
+                for product, (_, raw_value, normalized) in zip(products, cells)
+            ]
+            metrics.append({
+                'id': spec_type.id,
+                'name': spec_type.name,
+                'comparison_type': spec_type.comparison_type,
+                'unit': spec_type.unit,
+                'priority': spec_type.priority,
+                'category_map': spec_type.category_map,
+                'products': ComparisonService._rank_values(values, spec_type),
+            })
+        
+        return {
+            'category': {
+                'id': category.id,
+                'name': category.name,
+                'slug': category.slug,
+            },
+            'products': [dict(self.product_data(product)) for product in products],
+            'metrics': metrics,
+        }
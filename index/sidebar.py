@@ -0,0 +1,218 @@
+"""
+Кэш данных сайдбара каталога: категории, бренды, теги, баннеры и значения
+характеристик для фильтров.
+
+Данные лежат в кэше под ключом с номером поколения. Сигналы на изменение
+этих моделей поднимают поколение (bump_version), и следующий запрос
+пересобирает сайдбар — TTL не нужен, правки из админки видны сразу.
+
+Пересборка single-flight: её выполняет один воркер под блокировкой,
+остальные в это время отдают последнюю собранную версию.
+
+В кэше хранятся кортежи, а не ORM-объекты — они в разы компактнее
+в pickle и быстрее распаковываются.
+
+Сайдбар общий для каталога и поиска (SidebarMixin). Алиас кэша задаётся
+настройкой SIDEBAR_CACHE; прогрев после деплоя — команда warm_sidebar_cache.
+"""
+import logging
+import pickle
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .versions import bump_counter, get_counter
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'sidebar:version'
+DATA_CACHE_KEY = 'sidebar:data:{}'
+LATEST_CACHE_KEY = 'sidebar:data:latest'  # последняя собранная версия для отдачи «устаревшего»
+LOCK_CACHE_KEY = 'sidebar:lock'
+DATA_TTL = 60 * 60 * 24  # вытеснение забытых поколений; актуальность держат сигналы
+LOCK_TTL = 30
+
+SidebarItem = namedtuple('SidebarItem', 'name slug')
+SidebarBanner = namedtuple('SidebarBanner', 'image_url alt_text')
+# numeric_range — (min, max) числовых значений для полей «от — до»; по умолчанию
+# None, чтобы сайдбар прошлых версий из кэша распаковывался
+SpecFilter = namedtuple('SpecFilter', 'slug name values numeric_range', defaults=(None,))
+
+# Счётчики процесса: hit — актуальное поколение, stale — отдана прошлая
+# версия во время чужой пересборки, miss — пересборка этим воркером
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def stats():
+    """Счётчики обращений к кэшу сайдбара в текущем процессе."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_cache():
+    return caches[getattr(settings, 'SIDEBAR_CACHE', 'default')]
+
+
+def get_version():
+    # После очистки кэша счётчик стартует с текущего времени — ключи
+    # старого поколения не попадутся
+    return get_counter(VERSION_CACHE_KEY, get_cache())
+
+
+def bump_version():
+    """Помечает сайдбар устаревшим; пересборка — при следующем запросе."""
+    bump_counter(VERSION_CACHE_KEY, get_cache())
+
+
+def build_sidebar_data():
+    """Собирает данные сайдбара из БД — 6 запросов."""
+    from .models import Banner, Brand, Category, Tag
+
+    def items(model):
+        return tuple(SidebarItem(*row) for row in model.objects.values_list('name', 'slug'))
+
+    banners = tuple(
+        SidebarBanner(banner.image.url, banner.alt_text)
+        for banner in Banner.objects.filter(is_active=True).only('image', 'alt_text')
+    )
+    return {
+        'categories': items(Category),
+        'brands': items(Brand),
+        'tags': items(Tag),
+        'banners': banners,
+        'spec_filters': _build_spec_filters(),
+    }
+
+
+def _build_spec_filters():
+    """Уникальные значения каждого типа характеристик и границы числовых — 2 запроса."""
+    from django.db.models import Max, Min
+
+    from .models import ProductSpecification
+    from .spec_values import NUMERIC_TYPES
+
+    rows = (
+        ProductSpecification.objects
+        .values_list('spec_type__slug', 'spec_type__name', 'value')
+        .distinct()
+        .order_by('spec_type__name', 'value')
+    )
+    names = {}
+    values = defaultdict(list)
+    for slug, name, value in rows:
+        names[slug] = name
+        values[slug].append(value)
+
+    ranges = {
+        slug: (f'{low.normalize():f}', f'{high.normalize():f}')
+        for slug, low, high in (
+            ProductSpecification.objects
+            .filter(spec_type__comparison_type__in=NUMERIC_TYPES, numeric_value__isnull=False)
+            .values('spec_type__slug')
+            .annotate(low=Min('numeric_value'), high=Max('numeric_value'))
+            .values_list('spec_type__slug', 'low', 'high')
+            .order_by()
+        )
+        if low < high
+    }
+    return tuple(
+        SpecFilter(slug, name, tuple(values[slug]), ranges.get(slug))
+        for slug, name in names.items()
+    )
+
+
+def _store(version):
+    """Собирает сайдбар и кладёт его под поколение version."""
+    started = time.monotonic()
+    data = build_sidebar_data()
+    get_cache().set_many({
+        DATA_CACHE_KEY.format(version): data,
+        LATEST_CACHE_KEY: data,
+    }, DATA_TTL)
+    logger.info(
+        'Sidebar rebuilt: generation %s, %d bytes, %.1f ms',
+        version, len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)),
+        (time.monotonic() - started) * 1000,
+    )
+    return data
+
+
+def get_sidebar_data():
+    """Данные сайдбара текущего поколения (или предыдущего, пока идёт пересборка)."""
+    cache = get_cache()
+    version = get_version()
+    data = cache.get(DATA_CACHE_KEY.format(version))
+    if data is not None:
+        _count('hit')
+        return data
+
+    if not cache.add(LOCK_CACHE_KEY, version, LOCK_TTL):
+        latest = cache.get(LATEST_CACHE_KEY)
+        if latest is not None:
+            _count('stale')
+            return latest
+        # Холодный старт: отдать нечего, собираем сами без записи в кэш
+        _count('miss')
+        return build_sidebar_data()
+
+    _count('miss')
+    try:
+        return _store(version)
+    finally:
+        cache.delete(LOCK_CACHE_KEY)
+
+
+def warm_up():
+    """Собирает сайдбар текущего поколения заранее, не дожидаясь первого запроса."""
+    return _store(get_version())
+
+
+class SidebarMixin:
+    """
+    Контекст сайдбара фильтров для ListView каталога и поиска.
+
+    HTMX-партиалы сайдбар не перерисовывают, поэтому для них данные
+    из кэша не достаются — в контекст попадают только выбранные фильтры.
+    """
+
+    def get_sidebar_data(self):
+        if not hasattr(self, '_sidebar_data'):
+            self._sidebar_data = get_sidebar_data()
+        return self._sidebar_data
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        get = self.request.GET
+        if not self.request.headers.get('HX-Request'):
+            sidebar = self.get_sidebar_data()
+            context.update(sidebar)
+            # selected_values зависят от GET — собираем словари на каждый запрос
+            context['spec_filters'] = [
+                {
+                    'slug': sf.slug,
+                    'name': sf.name,
+                    'values': sf.values,
+                    'selected_values': get.getlist(f'spec_{sf.slug}'),
+                    'numeric_range': sf.numeric_range,
+                    'range_from': get.get(f'spec_{sf.slug}_from', ''),
+                    'range_to': get.get(f'spec_{sf.slug}_to', ''),
+                }
+                for sf in sidebar['spec_filters']
+            ]
+        context['selected_categories'] = get.getlist('category')
+        context['selected_brands'] = get.getlist('brand')
+        context['selected_tags'] = get.getlist('tag')
+        context['discount_only'] = get.get('discount') == '1'
+        context['price_from'] = get.get('price_from')
+        context['price_to'] = get.get('price_to')
+        context['current_sort'] = get.get('sort', '')
+        return context
@@ -0,0 +1,215 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import facets, ratings, review_tags, sidebar, similar, spec_scores, suggest, tagging, versions
+from .pricing import refresh_final_prices
+from .search import get_search_backend
+from .models import (
+    Product, ProductSpecification, Category, Brand, Tag, Discount, SpecificationType, Banner, Review,
+    ProductImage, Stock,
+)
+
+
+def _log_facet_change(product_ids=facets.FULL_REBUILD):
+    # Журнал пишем только после коммита: откат транзакции не должен попасть в индекс
+    transaction.on_commit(lambda: facets.log_change(product_ids))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    _log_facet_change([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def product_price_changed(sender, instance, created, **kwargs):
+    # Новый товар ещё ни в одной корзине
+    if not created and getattr(instance, '_loaded_final_price', None) != instance.final_price:
+        transaction.on_commit(versions.bump_prices)
+
+
+@receiver(post_delete, sender=Product)
+def product_price_removed(sender, instance, **kwargs):
+    transaction.on_commit(versions.bump_prices)
+
+
+@receiver(post_save, sender=Product)
+def product_saved_for_search(sender, instance, **kwargs):
+    # Поисковый индекс в той же БД — пишем сразу, откат транзакции откатит и его
+    get_search_backend().update([instance])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted_for_search(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=ProductSpecification)
+@receiver(post_delete, sender=ProductSpecification)
+def specification_changed(sender, instance, **kwargs):
+    _log_facet_change([instance.product_id])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def product_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        _log_facet_change([instance.pk])
+    elif pk_set:
+        _log_facet_change(pk_set)
+    else:
+        # tag.products.clear() — затронутые товары уже неизвестны
+        _log_facet_change()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Discount)
+@receiver(post_save, sender=SpecificationType)
+@receiver(post_delete, sender=SpecificationType)
+def catalog_structure_changed(sender, instance, **kwargs):
+    """Смена slug или SET_NULL без сигналов по товарам — перестраиваем индекс целиком."""
+    _log_facet_change()
+
+
+@receiver(post_save, sender=Discount)
+def discount_saved(sender, instance, **kwargs):
+    """Процент или окно скидки изменились — пересчитываем итоговые цены её товаров."""
+    refresh_final_prices(Product.objects.filter(discount=instance))
+
+
+@receiver(post_delete, sender=Discount)
+def discount_deleted(sender, instance, **kwargs):
+    # SET_NULL уже снял скидку без сигналов — возвращаем полную цену
+    refresh_final_prices(
+        Product.objects.filter(discount__isnull=True, final_price__lt=F('price'))
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+@receiver(post_save, sender=SpecificationType)
+@receiver(post_delete, sender=SpecificationType)
+@receiver(post_save, sender=ProductSpecification)
+@receiver(post_delete, sender=ProductSpecification)
+def sidebar_changed(sender, instance, **kwargs):
+    transaction.on_commit(sidebar.bump_version)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def suggestions_changed(sender, instance, **kwargs):
+    transaction.on_commit(suggest.bump_version)
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    ratings.review_saved(instance, created)
+    review_tags.review_saved(instance, created)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    ratings.review_deleted(instance)
+    review_tags.review_deleted(instance)
+
+
+@receiver(post_save, sender=SpecificationType)
+def tag_keywords_changed(sender, instance, created, **kwargs):
+    # Ключевые слова — из названия; у нового типа ещё нет товаров, удаление
+    # снимает характеристики товаров со своими сигналами
+    if not created and getattr(instance, '_loaded_name', None) != instance.name:
+        tagging.bump_version()
+
+
+@receiver(post_save, sender=ProductSpecification)
+def product_tag_keywords_changed(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded', None)
+    current = (instance.product_id, instance.spec_type_id)
+    if created or loaded is None:
+        product_ids = [instance.product_id]
+    elif loaded != current:
+        product_ids = [loaded[0], instance.product_id]
+    else:
+        return  # правка value набор типов товара не меняет
+    tagging.bump_products(product_ids)
+
+
+@receiver(post_delete, sender=ProductSpecification)
+def product_tag_keywords_removed(sender, instance, **kwargs):
+    tagging.bump_products([instance.product_id])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+@receiver(post_save, sender=ProductSpecification)
+@receiver(post_delete, sender=ProductSpecification)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_version_changed(sender, instance, **kwargs):
+    product_id = instance.pk if sender is Product else instance.product_id
+    transaction.on_commit(lambda: versions.bump_products([product_id]))
+
+
+@receiver(post_save, sender=SpecificationType)
+@receiver(post_delete, sender=SpecificationType)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def spec_types_version_changed(sender, instance, **kwargs):
+    # Категория тоже: её название входит в закэшированное сравнение
+    transaction.on_commit(versions.bump_spec_types)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductSpecification)
+@receiver(post_delete, sender=ProductSpecification)
+def similar_vectors_changed(sender, instance, **kwargs):
+    product_id = instance.pk if sender is Product else instance.product_id
+    transaction.on_commit(lambda: similar.refresh_products([product_id]))
+
+
+@receiver(post_save, sender=ProductSpecification)
+@receiver(post_delete, sender=ProductSpecification)
+def spec_scores_changed(sender, instance, **kwargs):
+    spec_scores.schedule(product_ids=[instance.product_id])
+
+
+@receiver(post_save, sender=SpecificationType)
+def spec_type_scores_changed(sender, instance, **kwargs):
+    # Приоритет, направление или category_map меняют оценки всех категорий с этим типом
+    spec_scores.schedule(spec_type_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def product_scores_changed(sender, instance, created, **kwargs):
+    # Новый или перенесённый товар сдвигает границы min-max категории; цена
+    # в оценку не входит (with_price=False), поэтому прочие правки её не меняют
+    loaded = getattr(instance, '_loaded_category_id', None)
+    if created or loaded != instance.category_id:
+        spec_scores.mark_stale([loaded, instance.category_id])
+
+
+@receiver(post_delete, sender=Product)
+def product_scores_removed(sender, instance, **kwargs):
+    spec_scores.mark_stale([instance.category_id])
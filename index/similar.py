@@ -0,0 +1,374 @@
+"""
+Похожие товары: k ближайших соседей по векторам характеристик.
+
+Для каждой категории офлайн (команда rebuild_similar_index) строится матрица
+признаков float32 — строка на товар, столбец на сравнимую характеристику
+категории и на цену. Значения приводятся к [0, 1] по comparison_type:
+
+- higher_better / lower_better — min-max по категории (lower_better
+  переворачивается, 1 — лучше)
+- categorical — оценка из category_map, делённая на максимальную
+- boolean — 0 / 1
+- цена — min-max по log(1 + final_price)
+
+Нет значения — 0.5. Столбец умножается на вес: priority / 100 типа
+характеристики, у цены — PRICE_WEIGHT.
+
+На диске категория — три файла в SIMILAR_INDEX_DIR:
+`category-<id>.json` (столбцы и границы нормализации, имя сборки),
+`category-<id>-<сборка>.vectors.npy` и `…ids.npy`. Матрица открывается
+через np.load(mmap_mode='r'): страницы общие для всех воркеров в page cache
+ОС, процесс не держит копию. Новая сборка пишется под новым именем, затем
+атомарно подменяется json — читатели старой сборки её дочитывают.
+
+Изменения товара (характеристики, цена) переписывают его строку на месте
+по границам последней сборки — другие воркеры видят её через общее
+отображение. Если у товара нет строки (новый товар, смена категории) или
+появилась характеристика, которой нет среди столбцов, категория только
+помечается файлом `category-<id>.stale` — пересборку делает команда
+`rebuild_similar_index --stale` по расписанию, не запрос админки.
+Категории без файла не строятся на лету — блок пуст до запуска команды.
+
+Сборка, очистка старых файлов и правка строк одной категории идут под
+flock на `category-<id>.lock`: параллельная сборка не удалит файлы, на
+которые указывает json.
+"""
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .spec_values import normalize_token
+
+logger = logging.getLogger(__name__)
+
+SIMILAR_LIMIT = 6
+PRICE_WEIGHT = 1.0
+MISSING = 0.5
+BLOCK_ROWS = 8192  # строк матрицы на один шаг расчёта расстояний — память на запрос ограничена
+
+
+def index_dir():
+    return Path(getattr(settings, 'SIMILAR_INDEX_DIR', settings.BASE_DIR / 'var' / 'similar'))
+
+
+def _meta_path(category_id):
+    return index_dir() / f'category-{category_id}.json'
+
+
+def _array_path(category_id, build, name):
+    return index_dir() / f'category-{category_id}-{build}.{name}.npy'
+
+
+def _stale_path(category_id):
+    return index_dir() / f'category-{category_id}.stale'
+
+
+@contextmanager
+def category_lock(category_id):
+    """Эксклюзивная блокировка файлов категории для всех процессов на машине."""
+    directory = index_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / f'category-{category_id}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def stale_categories():
+    """id категорий, помеченных к пересборке."""
+    if not index_dir().is_dir():
+        return []
+    return sorted(
+        int(path.name[len('category-'):-len('.stale')])
+        for path in index_dir().glob('category-*.stale')
+    )
+
+
+# === Признаки ===
+
+def category_columns(category_id, with_price=True):
+    """Сравнимые типы характеристик, встречающиеся в категории, — столбцы матрицы."""
+    from .models import SpecificationType
+
+    spec_types = SpecificationType.objects.filter(
+        is_comparable=True, productspecification__product__category_id=category_id,
+    ).distinct().order_by('id')
+    columns = []
+    for spec_type in spec_types:
+        column = {
+            'spec_type': spec_type.id,
+            'kind': spec_type.comparison_type,
+            'weight': spec_type.priority / 100,
+        }
+        if spec_type.comparison_type == 'categorical':
+            scores = {normalize_token(k): v for k, v in (spec_type.category_map or {}).items()}
+            top = max(scores.values(), default=0) or 1
+            column['scores'] = {token: score / top for token, score in scores.items()}
+        columns.append(column)
+    if with_price:
+        columns.append({'spec_type': None, 'kind': 'price', 'weight': PRICE_WEIGHT})
+    return columns
+
+
+def _raw_value(column, spec):
+    """Значение столбца до нормализации: float или nan. spec — (numeric, bool, token) или None."""
+    if spec is None:
+        return math.nan
+    numeric_value, bool_value, token = spec
+    kind = column['kind']
+    if kind == 'categorical':
+        return column['scores'].get(token, 0.0) if token else math.nan
+    if kind == 'boolean':
+        return math.nan if bool_value is None else float(bool_value)
+    return math.nan if numeric_value is None else float(numeric_value)
+
+
+def load_features(category_id, columns, product_ids=None):
+    """
+    Сырые признаки товаров категории — 2 запроса.
+
+    Returns:
+        tuple: (np.ndarray id товаров, np.ndarray float64 признаков, set id типов вне столбцов)
+    """
+    from .models import Product, ProductSpecification
+
+    products = Product.objects.filter(category_id=category_id).order_by('id')
+    specs = ProductSpecification.objects.filter(
+        product__category_id=category_id, spec_type__is_comparable=True,
+    )
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+        specs = specs.filter(product_id__in=product_ids)
+
+    prices = dict(products.values_list('id', 'final_price'))
+    ids = np.fromiter(prices, dtype=np.int64, count=len(prices))
+    row_of = {pid: row for row, pid in enumerate(prices)}
+    column_of = {column['spec_type']: i for i, column in enumerate(columns)}
+    raw = np.full((len(ids), len(columns)), np.nan)
+    unknown = set()
+    for product_id, type_id, numeric_value, bool_value, token in specs.values_list(
+        'product_id', 'spec_type_id', 'numeric_value', 'bool_value', 'token',
+    ):
+        col = column_of.get(type_id)
+        if col is None:
+            unknown.add(type_id)
+        elif product_id in row_of:
+            raw[row_of[product_id], col] = _raw_value(columns[col], (numeric_value, bool_value, token))
+    price_col = column_of.get(None)
+    if price_col is not None:
+        for product_id, price in prices.items():
+            raw[row_of[product_id], price_col] = math.log1p(float(price))
+    return ids, raw, unknown
+
+
+def fit_bounds(columns, raw):
+    """Границы min-max числовых столбцов и цены по всей категории."""
+    for i, column in enumerate(columns):
+        if column['kind'] in ('higher_better', 'lower_better', 'price'):
+            values = raw[:, i][~np.isnan(raw[:, i])]
+            column['low'] = float(values.min()) if len(values) else 0.0
+            column['high'] = float(values.max()) if len(values) else 0.0
+
+
+def _encode(columns, raw):
+    """Нормализованная и взвешенная матрица float32 (векторно, по столбцам)."""
+    vectors = np.empty(raw.shape, dtype=np.float32)
+    for i, column in enumerate(columns):
+        values = raw[:, i]
+        if 'low' in column:
+            span = column['high'] - column['low']
+            if not span:
+                # Все товары равны — столбец ничего не различает
+                vectors[:, i] = MISSING * column['weight']
+                continue
+            values = np.clip((values - column['low']) / span, 0, 1)
+            if column['kind'] == 'lower_better':
+                values = 1 - values
+        vectors[:, i] = np.where(np.isnan(values), MISSING, values) * column['weight']
+    return vectors
+
+
+# === Файлы ===
+
+def build_category(category_id):
+    """
+    Пересобирает матрицу категории и подменяет файлы.
+
+    Returns:
+        int: число товаров
+    """
+    with category_lock(category_id):
+        return _build_locked(category_id)
+
+
+def _build_locked(category_id):
+    started = time.monotonic()
+    # Метка снимается до чтения: изменение во время сборки пометит категорию снова
+    _stale_path(category_id).unlink(missing_ok=True)
+    columns = category_columns(category_id)
+    ids, raw, _ = load_features(category_id, columns)
+    if not len(ids):
+        _remove_files(category_id)
+        return 0
+    fit_bounds(columns, raw)
+    vectors = _encode(columns, raw)
+
+    directory = index_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    build = uuid.uuid4().hex[:12]
+    np.save(_array_path(category_id, build, 'vectors'), vectors)
+    np.save(_array_path(category_id, build, 'ids'), ids)
+    meta_path = _meta_path(category_id)
+    tmp_path = meta_path.with_suffix(f'.{build}.tmp')
+    tmp_path.write_text(json.dumps({'build': build, 'columns': columns}))
+    os.replace(tmp_path, meta_path)
+
+    # Прошлые сборки (под блокировкой json указывает на эту): открытые
+    # отображения у воркеров живут до закрытия
+    for path in directory.glob(f'category-{category_id}-*.npy'):
+        if not path.name.startswith(f'category-{category_id}-{build}.'):
+            path.unlink(missing_ok=True)
+    logger.info(
+        'Similar index built: category %s, %d products x %d features, %.1f ms',
+        category_id, len(ids), len(columns), (time.monotonic() - started) * 1000,
+    )
+    return len(ids)
+
+
+def remove_category(category_id):
+    with category_lock(category_id):
+        _remove_files(category_id)
+
+
+def _remove_files(category_id):
+    for path in index_dir().glob(f'category-{category_id}[.-]*'):
+        if path.suffix != '.lock':
+            path.unlink(missing_ok=True)
+
+
+class CategoryMatrix:
+    """Открытая сборка категории: id, отображённая матрица и её столбцы."""
+
+    def __init__(self, category_id, meta, mtime, mode='r'):
+        self.category_id = category_id
+        self.build = meta['build']
+        self.columns = meta['columns']
+        self.mtime = mtime
+        self.ids = np.load(_array_path(category_id, self.build, 'ids'))
+        self.vectors = np.load(_array_path(category_id, self.build, 'vectors'), mmap_mode=mode)
+        self.rows = {int(pid): row for row, pid in enumerate(self.ids)}
+
+    @classmethod
+    def open(cls, category_id, mode='r'):
+        """None — категория не собрана."""
+        meta_path = _meta_path(category_id)
+        try:
+            mtime = meta_path.stat().st_mtime_ns
+            return cls(category_id, json.loads(meta_path.read_text()), mtime, mode)
+        except FileNotFoundError:
+            return None
+
+    def nearest(self, product_id, k=SIMILAR_LIMIT):
+        """id k ближайших товаров по евклидову расстоянию, от ближайшего."""
+        row = self.rows.get(product_id)
+        k = min(k, len(self.ids) - 1)
+        if row is None or k <= 0:
+            return []
+        query = np.array(self.vectors[row])
+        distances = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), BLOCK_ROWS):
+            block = self.vectors[start:start + BLOCK_ROWS] - query
+            distances[start:start + len(block)] = np.einsum('ij,ij->i', block, block)
+        distances[row] = np.inf
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind='stable')]
+        return self.ids[top].tolist()
+
+
+class SimilarIndex:
+    """Открытые матрицы категорий одного процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matrices = {}
+
+    def matrix(self, category_id):
+        """Актуальная сборка категории: json подменён — открываем заново (один stat на вызов)."""
+        try:
+            mtime = _meta_path(category_id).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        matrix = self._matrices.get(category_id)
+        if matrix is None or matrix.mtime != mtime:
+            with self._lock:
+                matrix = self._matrices.get(category_id)
+                if matrix is None or matrix.mtime != mtime:
+                    matrix = CategoryMatrix.open(category_id)
+                    self._matrices[category_id] = matrix
+        return matrix
+
+    def similar(self, product_id, category_id, k=SIMILAR_LIMIT):
+        """
+        Returns:
+            list: id похожих товаров той же категории, от самого похожего
+        """
+        matrix = self.matrix(category_id)
+        return matrix.nearest(product_id, k) if matrix is not None else []
+
+
+similar_index = SimilarIndex()
+
+
+def get_similar_index():
+    return similar_index
+
+
+def refresh_products(product_ids):
+    """
+    Переписывает строки изменившихся товаров на месте.
+
+    Вызывать после коммита. Категории без сборки пропускаются; категории,
+    которым нужна пересборка, только помечаются (stale_categories).
+    """
+    from .models import Product
+
+    if not index_dir().is_dir():
+        return  # индекс ещё не собирали
+    by_category = defaultdict(list)
+    for product_id, category_id in Product.objects.filter(id__in=product_ids).values_list('id', 'category_id'):
+        by_category[category_id].append(product_id)
+
+    for category_id, ids in by_category.items():
+        with category_lock(category_id):
+            matrix = CategoryMatrix.open(category_id, mode='r+')
+            if matrix is None:
+                continue
+            if any(pid not in matrix.rows for pid in ids):
+                _mark_stale(category_id)
+                continue
+            loaded_ids, raw, unknown = load_features(category_id, matrix.columns, ids)
+            if unknown:
+                # Новая характеристика в категории — меняется набор столбцов
+                _mark_stale(category_id)
+                continue
+            rows = [matrix.rows[int(pid)] for pid in loaded_ids]
+            matrix.vectors[rows] = _encode(matrix.columns, raw)
+            matrix.vectors.flush()
+
+
+def _mark_stale(category_id):
+    _stale_path(category_id).touch()
+    logger.info('Similar index: category %s marked for rebuild', category_id)
@@ -0,0 +1,177 @@
+"""
+Оценка характеристик товара в его категории (Product.spec_score, 0–100).
+
+Те же правила, что в сравнении, но сразу по всей категории:
+
+- higher_better / lower_better — min-max по категории (lower_better
+  переворачивается); все товары равны — у всех 1
+- categorical — оценка из category_map, делённая на максимальную
+- boolean — 0 / 1
+- нет значения — 0
+
+Оценка — взвешенное среднее по сравнимым характеристикам категории с весом
+priority / 100, умноженное на 100. Признаки берутся из similar — столбцы
+те же, без цены.
+
+Хранится в индексированной колонке (category, -spec_score): сортировка
+каталога «по характеристикам» и «топ-10 категории» читают готовое значение.
+Пересчёт — целиком по категории, потому что границы min-max общие:
+
+- изменения характеристик и типов характеристик копятся в schedule() и
+  пересчитываются одним проходом после коммита
+- новый, удалённый или перенесённый товар только помечает категорию
+  (mark_stale) — пересчёт делает `recompute_spec_scores --stale` по
+  расписанию, не запрос админки; правка цены или названия оценок не трогает
+- bulk_update и правки в обход ORM — команда recompute_spec_scores
+"""
+import threading
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+
+from . import facets
+from .models import Category, Product, ProductSpecification, StaleSpecScores
+from .similar import category_columns, fit_bounds, load_features
+
+TOP_LIMIT = 10
+BULK_BATCH_SIZE = 500
+MAX_JOURNAL_IDS = 500
+
+_pending = threading.local()
+
+
+def score_rows(columns, raw):
+    """
+    Оценки строк матрицы признаков (load_features) — векторно, по столбцам.
+
+    Returns:
+        np.ndarray: float64 от 0 до 100
+    """
+    fit_bounds(columns, raw)
+    total_weight = sum(column['weight'] for column in columns)
+    scores = np.zeros(len(raw))
+    if not total_weight:
+        return scores
+    for i, column in enumerate(columns):
+        values = raw[:, i]
+        if 'low' in column:
+            span = column['high'] - column['low']
+            if not span:
+                values = np.where(np.isnan(values), np.nan, 1.0)
+            else:
+                values = np.clip((values - column['low']) / span, 0, 1)
+                if column['kind'] == 'lower_better':
+                    values = 1 - values
+        scores += np.nan_to_num(values, nan=0.0) * column['weight']
+    return scores * 100 / total_weight
+
+
+def category_scores(category_id):
+    """
+    Returns:
+        dict: id товара -> Decimal оценки с точностью до сотых
+    """
+    columns = category_columns(category_id, with_price=False)
+    ids, raw, _ = load_features(category_id, columns)
+    return {
+        int(pid): Decimal(f'{score:.2f}')
+        for pid, score in zip(ids, score_rows(columns, raw))
+    }
+
+
+def recompute_scores(category_ids=None):
+    """
+    Пересчитывает оценки товаров категорий и пишет только изменившиеся.
+
+    Returns:
+        list: id товаров с новой оценкой
+    """
+    if category_ids is None:
+        category_ids = Category.objects.values_list('id', flat=True)
+    changed = []
+    for category_id in category_ids:
+        scores = category_scores(category_id)
+        stored = Product.objects.filter(id__in=scores).values_list('id', 'spec_score')
+        changed.extend(
+            Product(id=pid, spec_score=scores[pid])
+            for pid, spec_score in stored if spec_score != scores[pid]
+        )
+
+    if not changed:
+        return []
+    # bulk_update не шлёт post_save — сортировка по оценке живёт в индексе фасетов
+    Product.objects.bulk_update(changed, ['spec_score'], batch_size=BULK_BATCH_SIZE)
+    ids = [product.id for product in changed]
+    journal = ids if len(ids) <= MAX_JOURNAL_IDS else facets.FULL_REBUILD
+    transaction.on_commit(lambda: facets.log_change(journal))
+    return ids
+
+
+def top_in_category(category_slug, limit=TOP_LIMIT):
+    """Лучшие по характеристикам товары категории — по индексу (category, -spec_score)."""
+    return (
+        Product.objects.select_related('category', 'brand', 'discount')
+        .filter(category__slug=category_slug, spec_score__gt=0)
+        .order_by('-spec_score', '-id')[:limit]
+    )
+
+
+def mark_stale(category_ids):
+    """Помечает категории к пересчёту командой — одним запросом, в транзакции изменения."""
+    StaleSpecScores.objects.bulk_create(
+        [StaleSpecScores(category_id=category_id) for category_id in set(category_ids) if category_id],
+        ignore_conflicts=True,
+    )
+
+
+def recompute_stale():
+    """
+    Пересчитывает помеченные категории и снимает пометки.
+
+    Returns:
+        tuple: (id категорий, id товаров с новой оценкой)
+    """
+    with transaction.atomic():
+        category_ids = sorted(StaleSpecScores.objects.values_list('category_id', flat=True))
+        # Пометки снимаются до чтения данных: товар, добавленный во время
+        # пересчёта, пометит категорию снова
+        StaleSpecScores.objects.filter(category_id__in=category_ids).delete()
+        return category_ids, recompute_scores(category_ids)
+
+
+def schedule(product_ids=(), spec_type_ids=()):
+    """
+    Откладывает пересчёт категорий до коммита.
+
+    Сохранение товара с характеристиками в админке — десятки сигналов;
+    категории копятся в наборе потока, а пересчитывает их первый сработавший
+    после коммита flush(). Категории товаров и типов определяются уже после
+    коммита — по закоммиченным данным.
+    """
+    pending = getattr(_pending, 'changes', None)
+    if pending is None:
+        pending = _pending.changes = {'products': set(), 'spec_types': set()}
+    pending['products'].update(product_ids)
+    pending['spec_types'].update(spec_type_ids)
+    # Остальные flush() той же транзакции найдут набор пустым; после отката
+    # набор доживёт до следующего коммита — лишний пересчёт безвреден
+    transaction.on_commit(flush)
+
+
+def flush():
+    pending = getattr(_pending, 'changes', None)
+    _pending.changes = None
+    if not pending:
+        return
+    category_ids = set(
+        Product.objects.filter(id__in=pending['products']).values_list('category_id', flat=True)
+    )
+    if pending['spec_types']:
+        category_ids.update(
+            ProductSpecification.objects.filter(spec_type_id__in=pending['spec_types'])
+            .values_list('product__category_id', flat=True).distinct()
+        )
+    if category_ids:
+        with transaction.atomic():
+            recompute_scores(sorted(category_ids))
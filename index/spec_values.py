@@ -0,0 +1,142 @@
+"""
+Разбор значений характеристик при записи.
+
+ProductSpecification.value — свободный текст («8 ГБ», «6,7 дюймов», «Есть»,
+«AMOLED»). При сохранении рядом кладутся разобранные значения:
+
+- numeric_value — первое число строки; по индексу (spec_type, numeric_value)
+  каталог фильтрует диапазоны «ОЗУ от 16 ГБ», «диагональ 6.1–6.7»
+- bool_value — «да/есть/yes/+» для булевых характеристик
+- token — значение в нижнем регистре без лишних пробелов для категориальных
+
+Разбираются все три независимо от comparison_type типа характеристики —
+смена типа в админке не требует перезаписи значений. Существующие строки
+заполнила миграция 0020, правки в обход ORM — команда backfill_spec_values.
+"""
+import re
+from decimal import ROUND_HALF_UP, Decimal
+
+NUMERIC_TYPES = ('higher_better', 'lower_better')
+NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+TRUE_MARKERS = ('да', 'yes', 'есть', '1', 'true', '+')
+
+# Границы колонки numeric_value (max_digits=14, decimal_places=4)
+NUMERIC_LIMIT = Decimal('1e10')
+NUMERIC_STEP = Decimal('0.0001')
+
+PARSED_FIELDS = ('numeric_value', 'bool_value', 'token')
+
+
+def parse_number(raw_value):
+    """'8 ГБ' → 8, '6,7 дюймов' → 6.7, 'AMOLED' → None."""
+    if not raw_value:
+        return None
+    match = NUMBER_RE.search(raw_value.replace(',', '.'))
+    if not match:
+        return None
+    return clamp_number(Decimal(match.group()))
+
+
+def clamp_number(number):
+    """Число в границах колонки numeric_value или None."""
+    # copy_abs() не зависит от контекста: abs() на 1e999999999 бросает Overflow
+    if not number.is_finite() or number.copy_abs() >= NUMERIC_LIMIT:
+        return None
+    return number.quantize(NUMERIC_STEP, rounding=ROUND_HALF_UP)
+
+
+def parse_bool(raw_value):
+    if not raw_value:
+        return None
+    raw_lower = raw_value.lower()
+    return any(marker in raw_lower for marker in TRUE_MARKERS)
+
+
+def normalize_token(raw_value):
+    """' Super  AMOLED ' → 'super amoled'."""
+    return ' '.join(raw_value.lower().split()) if raw_value else ''
+
+
+def parse_user_number(value):
+    """Граница диапазона из GET-параметра или None."""
+    if not value:
+        return None
+    try:
+        return clamp_number(Decimal(value.replace(',', '.').strip()))
+    except ArithmeticError:  # InvalidOperation, Overflow
+        return None
+
+
+def parsed_fields(raw_value):
+    """
+    Returns:
+        dict: numeric_value, bool_value, token
+    """
+    return {
+        'numeric_value': parse_number(raw_value),
+        'bool_value': parse_bool(raw_value),
+        'token': normalize_token(raw_value),
+    }
+
+
+def products_in_range(spec_slug, value_from=None, value_to=None):
+    """
+    id товаров, у которых числовое значение характеристики в [value_from, value_to].
+
+    Один запрос по индексу (spec_type, numeric_value).
+    """
+    from .models import ProductSpecification
+
+    specs = ProductSpecification.objects.filter(
+        spec_type__slug=spec_slug, numeric_value__isnull=False
+    )
+    if value_from is not None:
+        specs = specs.filter(numeric_value__gte=value_from)
+    if value_to is not None:
+        specs = specs.filter(numeric_value__lte=value_to)
+    return specs.values_list('product_id', flat=True)
+
+
+def backfill(queryset=None, batch_size=500):
+    """
+    Разбирает value у строк queryset и пишет только изменившиеся.
+
+    Returns:
+        tuple: (число обновлённых строк, set id затронутых товаров)
+    """
+    from django.db import transaction
+
+    from . import facets, sidebar, versions
+    from .models import ProductSpecification
+
+    if queryset is None:
+        queryset = ProductSpecification.objects.all()
+    updated = 0
+    product_ids = set()
+    queryset = queryset.only('id', 'product_id', 'value', *PARSED_FIELDS).order_by('id')
+    last_id = 0
+    while True:
+        # Keyset по id: запись пачки не мешает чтению следующей
+        chunk = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not chunk:
+            break
+        last_id = chunk[-1].id
+        changed = []
+        for spec in chunk:
+            parsed = parsed_fields(spec.value)
+            if all(getattr(spec, field) == value for field, value in parsed.items()):
+                continue
+            for field, value in parsed.items():
+                setattr(spec, field, value)
+            changed.append(spec)
+            product_ids.add(spec.product_id)
+        ProductSpecification.objects.bulk_update(changed, PARSED_FIELDS)
+        updated += len(changed)
+
+    if product_ids:
+        # bulk_update не шлёт сигналов: диапазоны в каталоге и сайдбаре, сравнение
+        ids = list(product_ids)
+        transaction.on_commit(lambda: facets.log_change(facets.FULL_REBUILD))
+        transaction.on_commit(sidebar.bump_version)
+        transaction.on_commit(lambda: versions.bump_products(ids))
+    return updated, product_ids
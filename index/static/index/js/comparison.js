@@ -8,6 +8,8 @@
 
     // Хранение выбранных товаров в sessionStorage
     const STORAGE_KEY = 'comparison_selected_products';
+    const MIN_PRODUCTS = 2;
+    const MAX_PRODUCTS = 6;
 
     // Получение выбранных товаров
     function getSelectedProducts() {
@@ -42,8 +44,8 @@
                 btn.classList.remove('is-active');
             }
             
-            // Блокируем кнопку, если уже выбрано 2 товара и этот не в выборе
-            if (selectedProducts.length >= 2 && !selectedProducts.includes(productId)) {
+            // Блокируем кнопку, если выбрано максимум товаров и этот не в выборе
+            if (selectedProducts.length >= MAX_PRODUCTS && !selectedProducts.includes(productId)) {
                 btn.disabled = true;
             } else {
                 btn.disabled = false;
@@ -66,10 +68,14 @@
         }
 
         if (selectedProducts.length === 1) {
-            hint.textContent = 'Выберите ещё 1 товар для сравнения';
+            hint.textContent = 'Выберите ещё хотя бы 1 товар для сравнения';
             hint.classList.add('is-visible');
-        } else if (selectedProducts.length >= 2) {
-            hint.textContent = 'Выбрано 2 товара. Нажмите на кнопку сравнения для просмотра.';
+        } else if (selectedProducts.length >= MIN_PRODUCTS) {
+            hint.innerHTML = '';
+            const link = document.createElement('a');
+            link.href = `/comparison/?product_ids=${selectedProducts.join(',')}`;
+            link.textContent = `Сравнить (${selectedProducts.length} из ${MAX_PRODUCTS})`;
+            hint.appendChild(link);
             hint.classList.add('is-visible');
         } else {
             hint.classList.remove('is-visible');
@@ -80,21 +86,21 @@
     function addToComparison(productId) {
         const selectedProducts = getSelectedProducts();
         
-        if (selectedProducts.length >= 2) {
-            alert('Можно сравнивать только 2 товара одновременно');
-            return false;
-        }
-
         if (selectedProducts.includes(productId)) {
             return removeFromComparison(productId);
         }
 
+        if (selectedProducts.length >= MAX_PRODUCTS) {
+            alert(`Можно сравнивать не больше ${MAX_PRODUCTS} товаров одновременно`);
+            return false;
+        }
+
         selectedProducts.push(productId);
         saveSelectedProducts(selectedProducts);
         updateCompareButtons();
 
-        // Если выбрано 2 товара — открываем модальное окно
-        if (selectedProducts.length === 2) {
+        // Набрано максимум — сразу открываем модальное окно
+        if (selectedProducts.length === MAX_PRODUCTS) {
             openComparisonModal(selectedProducts);
         }
 
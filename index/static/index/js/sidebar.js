@@ -69,3 +69,16 @@ function formatPrice(value) {
   var formatted = intPart.replace(/\B(?=(\d{3})+(?!\d))/g, ' ');
   return decPart !== undefined ? formatted + '.' + decPart : formatted;
 }
+
+/* ─── Счётчики фасетов: обновляются out-of-band после HTMX-запроса ─── */
+
+document.addEventListener('htmx:afterSettle', function () {
+  var data = document.getElementById('facet-counts');
+  if (!data) return;
+  var counts = JSON.parse(data.textContent);
+  document.querySelectorAll('[data-facet-count]').forEach(function (el) {
+    var count = counts[el.getAttribute('data-facet-count')] || 0;
+    el.textContent = count;
+    el.closest('label').classList.toggle('facet-empty', count === 0);
+  });
+});
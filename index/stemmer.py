@@ -0,0 +1,153 @@
+"""
+Стемминг для полнотекстового поиска.
+
+Русские слова обрезаются стеммером Портера (Snowball, алгоритм для русского
+языка) — у FTS5 своего русского стеммера нет. Английские слова стеммит
+токенизатор FTS5 `porter`, поэтому здесь они только приводятся к нижнему
+регистру; light_stem_en() нужен лишь для подсветки совпадений в сниппетах.
+"""
+import re
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+_VOWELS = frozenset('аеиоуыэюя')
+
+_PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')  # после «а»/«я»
+_PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+_ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому',
+    'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+)
+_PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')  # после «а»/«я»
+_PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+_REFLEXIVE = ('ся', 'сь')
+_VERB_1 = (  # после «а»/«я»
+    'ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют',
+    'ны', 'ть', 'ешь', 'нно',
+)
+_VERB_2 = (
+    'ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил',
+    'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт',
+    'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю',
+)
+_NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и',
+    'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о',
+    'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+_SUPERLATIVE = ('ейше', 'ейш')
+_DERIVATIONAL = ('ость', 'ост')
+
+_EN_SUFFIXES = ('ies', 'ing', 'es', 'ed', 'ly', 's')
+
+
+def _regions(word):
+    """Границы областей RV и R2 алгоритма Snowball."""
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+    r1 = r2 = len(word)
+    for i in range(1, len(word)):
+        if word[i - 1] in _VOWELS and word[i] not in _VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i - 1] in _VOWELS and word[i] not in _VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _strip(word, rv, endings, after_a=()):
+    """
+    Отрезает самое длинное окончание из endings/after_a, целиком лежащее в RV.
+
+    Окончания after_a отрезаются, только если перед ними стоит «а» или «я»
+    (сама буква остаётся). Returns: слово без окончания или None.
+    """
+    best = None
+    for ending in endings + after_a:
+        if word.endswith(ending) and len(word) - len(ending) >= rv:
+            if best is None or len(ending) > len(best):
+                best = ending
+    if best is None:
+        return None
+    cut = len(word) - len(best)
+    if best in after_a and (cut - 1 < rv or word[cut - 1] not in 'ая'):
+        return None
+    return word[:cut]
+
+
+def _strip_adjectival(word, rv):
+    stripped = _strip(word, rv, _ADJECTIVE)
+    if stripped is None:
+        return None
+    return _strip(stripped, rv, _PARTICIPLE_2, _PARTICIPLE_1) or stripped
+
+
+def stem_ru(word):
+    """Основа русского слова (word — в нижнем регистре)."""
+    word = word.replace('ё', 'е')
+    rv, r2 = _regions(word)
+
+    # Шаг 1: деепричастие, иначе возвратность + прилагательное/глагол/существительное
+    stripped = _strip(word, rv, _PERFECTIVE_GERUND_2, _PERFECTIVE_GERUND_1)
+    if stripped is not None:
+        word = stripped
+    else:
+        word = _strip(word, rv, _REFLEXIVE) or word
+        for strip in (
+            _strip_adjectival,
+            lambda w, r: _strip(w, r, _VERB_2, _VERB_1),
+            lambda w, r: _strip(w, r, _NOUN),
+        ):
+            stripped = strip(word, rv)
+            if stripped is not None:
+                word = stripped
+                break
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3: словообразовательные суффиксы в R2
+    for ending in _DERIVATIONAL:
+        if word.endswith(ending) and len(word) - len(ending) >= r2:
+            word = word[:-len(ending)]
+            break
+
+    # Шаг 4
+    stripped = _strip(word, rv, _SUPERLATIVE)
+    if stripped is not None:
+        word = stripped
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif stripped is None and word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def light_stem_en(word):
+    """Грубое отсечение английских окончаний — только для подсветки."""
+    for suffix in _EN_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def normalize_word(word):
+    """Нормализованное слово для индекса: русские — в основу, прочие — как есть."""
+    word = word.lower().replace('ё', 'е')
+    if CYRILLIC_RE.search(word):
+        return stem_ru(word)
+    return word
+
+
+def tokenize(text):
+    """Слова текста в нижнем регистре."""
+    return WORD_RE.findall((text or '').lower())
+
+
+def stem_text(text):
+    """Текст для индекса FTS5: русские слова заменены основами."""
+    return ' '.join(normalize_word(word) for word in tokenize(text))
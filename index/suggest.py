@@ -0,0 +1,201 @@
+"""
+Индекс подсказок поисковой строки (typeahead).
+
+Названия товаров, брендов и категорий лежат в памяти процесса отсортированным
+массивом ключей: для каждого слова названия — хвост строки с этого слова
+(«galaxy s24» для «Samsung Galaxy S24»), поэтому подсказка находится по началу
+любого слова. Записи пронумерованы по убыванию популярности, так что лучшие
+k совпадений — это k наименьших номеров в диапазоне bisect. Для коротких
+префиксов (самые широкие диапазоны) топ считается заранее.
+
+Память ограничена MAX_ENTRIES самых популярных записей и длиной ключа.
+Индекс перестраивается, когда сигналы поднимают версию в кэше, и не реже
+раза в REFRESH_SECONDS — популярность меняется с заказами. Пересборка идёт
+в фоновом потоке: запросы тем временем отвечают из прежнего снимка, и только
+первая сборка процесса выполняется в запросе.
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+
+from django.db import connection
+from django.db.models import Count
+from django.urls import reverse
+
+from .stemmer import WORD_RE
+from .versions import bump_counter, get_counter
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'suggest:version'
+MAX_ENTRIES = 50_000
+MAX_KEY_LENGTH = 40
+MAX_PREFIX_LENGTH = 64
+PRECOMPUTED_PREFIX_LENGTH = 2  # топ для префиксов из 1–2 символов считается при сборке
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+REFRESH_SECONDS = 60 * 15
+
+Suggestion = namedtuple('Suggestion', 'kind label url popularity')
+
+_KIND_ORDER = {'category': 0, 'brand': 1, 'product': 2}  # при равной популярности
+
+
+def normalize(text):
+    return ' '.join(WORD_RE.findall(text.lower().replace('ё', 'е')))
+
+
+def _keys(label):
+    """Ключи записи: нормализованная строка с начала каждого слова."""
+    text = normalize(label)
+    starts = [0] + [i + 1 for i, ch in enumerate(text) if ch == ' ']
+    return {text[start:start + MAX_KEY_LENGTH] for start in starts}
+
+
+def load_suggestions():
+    """
+    Записи для индекса из БД — 3 запроса.
+
+    Популярность товара — число заказов с ним, бренда и категории — число
+    их товаров плюс заказы этих товаров.
+    """
+    from .models import Brand, Category, Product
+
+    brand_popularity = defaultdict(int)
+    category_popularity = defaultdict(int)
+    suggestions = []
+    products = (
+        Product.objects
+        .annotate(orders=Count('order_items'))
+        .values_list('name', 'slug', 'brand_id', 'category_id', 'orders')
+    )
+    # reverse() на каждый товар заметно дороже подстановки в готовый шаблон
+    product_url = reverse('index:product_detail', args=['__slug__'])
+    for name, slug, brand_id, category_id, orders in products:
+        suggestions.append(Suggestion(
+            'product', name, product_url.replace('__slug__', slug), orders,
+        ))
+        brand_popularity[brand_id] += orders + 1
+        category_popularity[category_id] += orders + 1
+
+    catalog_url = reverse('index:index')
+    for pk, name, slug in Brand.objects.values_list('id', 'name', 'slug'):
+        suggestions.append(Suggestion(
+            'brand', name, f'{catalog_url}?brand={slug}', brand_popularity[pk],
+        ))
+    for pk, name, slug in Category.objects.values_list('id', 'name', 'slug'):
+        suggestions.append(Suggestion(
+            'category', name, f'{catalog_url}?category={slug}', category_popularity[pk],
+        ))
+    return suggestions
+
+
+class SuggestIndex:
+    """Префиксный индекс подсказок одного процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.built_at = 0.0
+        # (записи по убыванию популярности, отсортированные ключи,
+        #  номер записи каждого ключа, короткий префикс -> номера лучших записей)
+        self._state = ((), [], [], {})
+
+    def build(self, suggestions, version=None):
+        started = time.monotonic()
+        entries = sorted(
+            suggestions, key=lambda s: (-s.popularity, _KIND_ORDER[s.kind], s.label.lower()),
+        )[:MAX_ENTRIES]
+        pairs = sorted(
+            (key, rank) for rank, entry in enumerate(entries) for key in _keys(entry.label) if key
+        )
+        top = defaultdict(list)
+        for key, rank in pairs:
+            for length in range(1, min(PRECOMPUTED_PREFIX_LENGTH, len(key)) + 1):
+                top[key[:length]].append(rank)
+        top = {prefix: tuple(sorted(set(ranks))[:MAX_LIMIT]) for prefix, ranks in top.items()}
+
+        # Подмена одним присваиванием — читатели не видят полусобранный индекс
+        self._state = (
+            tuple(entries), [key for key, _ in pairs], [rank for _, rank in pairs], top,
+        )
+        self.version = version
+        self.built_at = time.monotonic()
+        logger.info(
+            'Suggest index built: %d entries, %d keys, %.1f ms',
+            len(entries), len(pairs), (self.built_at - started) * 1000,
+        )
+
+    def sync(self):
+        """Перестраивает индекс при смене версии в кэше или по возрасту."""
+        shared = get_counter(VERSION_CACHE_KEY)
+        if shared == self.version and time.monotonic() - self.built_at < REFRESH_SECONDS:
+            return
+        if self.version is None:
+            # Первая сборка — в запросе: отвечать пока не из чего
+            with self._lock:
+                if self.version is None:
+                    self.build(load_suggestions(), shared)
+            return
+        # Одна фоновая пересборка на процесс; блокировку снимает её поток
+        if self._lock.acquire(blocking=False):
+            run_in_background(self._rebuild, shared)
+
+    def _rebuild(self, version):
+        try:
+            self.build(load_suggestions(), version)
+        except Exception:
+            logger.exception('Suggest index rebuild failed')
+        finally:
+            self._lock.release()
+
+    def suggest(self, prefix, limit=DEFAULT_LIMIT):
+        """
+        Лучшие по популярности записи, у которых какое-то слово начинается с prefix.
+
+        Returns:
+            list[Suggestion]
+        """
+        prefix = normalize(prefix[:MAX_PREFIX_LENGTH])
+        limit = max(1, min(limit, MAX_LIMIT))
+        if not prefix:
+            return []
+        entries, keys, all_ranks, top = self._state
+        if len(prefix) <= PRECOMPUTED_PREFIX_LENGTH:
+            ranks = top.get(prefix, ())[:limit]
+        else:
+            prefix = prefix[:MAX_KEY_LENGTH]
+            lo = bisect_left(keys, prefix)
+            hi = bisect_left(keys, prefix + '\uffff', lo)
+            ranks = heapq.nsmallest(limit, set(all_ranks[lo:hi]))
+        return [entries[rank] for rank in ranks]
+
+    def stats(self):
+        entries, keys, _, top = self._state
+        return {'entries': len(entries), 'keys': len(keys), 'prefixes': len(top), 'version': self.version}
+
+
+def bump_version():
+    bump_counter(VERSION_CACHE_KEY)
+
+
+def _run_and_close(target, *args):
+    try:
+        target(*args)
+    finally:
+        connection.close()  # соединение с БД у потока своё
+
+
+def run_in_background(target, *args):
+    threading.Thread(target=_run_and_close, args=(target, *args), daemon=True, name='suggest-rebuild').start()
+
+
+suggest_index = SuggestIndex()
+
+
+def get_suggest_index():
+    suggest_index.sync()
+    return suggest_index
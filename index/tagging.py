@@ -0,0 +1,207 @@
+"""
+Выделение тегов из текста отзывов.
+
+Ключевые слова — слова (длиннее 2 букв) из названий типов характеристик
+товара: «экран», «батарея», «память». Тег — ключевое слово с соседними
+словами фразы: «радует_экран», «не_понравился_экран», «батарея_слабая».
+
+Ключевые слова товара живут в памяти процесса под версией товара в кэше:
+её поднимают только добавление, удаление и перенос характеристики, а
+переименование типа — общую версию словаря. Правка value и сохранение
+отзыва словарь не перечитывают. Товары с одинаковым набором типов
+характеристик делят один frozenset.
+
+Сопоставление идёт по целым словам, поэтому вместо автомата Ахо–Корасик
+достаточно проверки слова по множеству — O(1) на слово текста.
+extract_tags() не обращается к БД и годится для пула процессов.
+"""
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+from .stemmer import WORD_RE
+from .versions import bump_around_commit, get_counter, product_versions
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'review_tags:version'
+PRODUCT_VERSION_KEY = 'review_tags:product:{}'
+MAX_TAGS = 5
+MIN_KEYWORD_LENGTH = 3
+LOOK_BACK = 2
+
+PHRASE_SPLIT_RE = re.compile(r'[,;:.!?\n]+')
+STOP_WORDS = frozenset({
+    'и', 'а', 'но', 'же', 'бы', 'ли', 'в', 'на', 'с', 'к', 'по', 'о', 'об', 'из',
+    'за', 'под', 'над', 'через', 'для', 'от', 'до', 'у', 'при', 'очень', 'особенно',
+})
+NEGATION = 'не'
+NO_KEYWORDS = frozenset()
+
+
+def keywords_of(spec_name):
+    """Ключевые слова названия характеристики: «Оперативная память» → {оперативная, память}."""
+    return {word for word in WORD_RE.findall(spec_name.lower()) if len(word) >= MIN_KEYWORD_LENGTH}
+
+
+def extract_tags(text, keywords):
+    """
+    Теги текста отзыва по ключевым словам товара.
+
+    - Учитывает частицу «не» в двух словах до ключевого (не понравился экран)
+    - Стоп-слова и другие ключевые слова в тег не попадают
+    - Не больше MAX_TAGS тегов без повторов, в порядке появления
+
+    Returns:
+        list[str]
+    """
+    if not text or not keywords:
+        return []
+    tags = {}  # dict как упорядоченное множество
+    for phrase in PHRASE_SPLIT_RE.split(text.lower()):
+        words = WORD_RE.findall(phrase)
+        if keywords.isdisjoint(words):
+            continue
+        for i, word in enumerate(words):
+            if word not in keywords:
+                continue
+            before = words[max(0, i - LOOK_BACK):i]
+            parts = [w for w in before if w == NEGATION or (w not in STOP_WORDS and w not in keywords)]
+            parts.append(word)
+            if i + 1 < len(words):
+                following = words[i + 1]
+                if following not in STOP_WORDS and following != NEGATION and following not in keywords:
+                    parts.append(following)
+            # Одно ключевое слово без описания — не тег
+            if len(parts) > 1:
+                if NEGATION in parts:
+                    # «не» — в начало тега для ясности
+                    parts.remove(NEGATION)
+                    parts.insert(0, NEGATION)
+                tags['_'.join(parts)] = None
+                if len(tags) >= MAX_TAGS:
+                    return list(tags)
+    return list(tags)
+
+
+def tag_rows(rows):
+    """
+    Задача для пула процессов: [(id отзыва, текст, ключевые слова)] → [(id, теги)].
+    """
+    return [(review_id, extract_tags(text, keywords)) for review_id, text, keywords in rows]
+
+
+class TagVocabulary:
+    """
+    Ключевые слова товаров одного процесса.
+
+    Слова типов характеристик — по общей версии (меняется только с названием
+    типа). Набор типов товара — по версии товара: правка value его не
+    трогает, а добавление или удаление характеристики перечитывает один товар.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self._type_keywords = {}
+        self._shared = {}      # набор типов -> общий frozenset ключевых слов
+        self._by_product = {}  # товар -> (версия товара, ключевые слова)
+
+    def sync(self):
+        shared = get_counter(VERSION_CACHE_KEY)
+        if shared == self.version:
+            return
+        with self._lock:
+            if shared != self.version:
+                self._load_types(shared)
+
+    def _load_types(self, version):
+        from .models import SpecificationType
+
+        self._type_keywords = {
+            pk: keywords_of(name) for pk, name in SpecificationType.objects.values_list('id', 'name')
+        }
+        self._shared = {}
+        self._by_product = {}
+        self.version = version
+
+    def _keywords_of_types(self, type_ids):
+        from .models import SpecificationType
+
+        type_ids = frozenset(type_ids)
+        # Новый тип общую версию не поднимает — его слова дочитываются здесь
+        unknown = type_ids.difference(self._type_keywords)
+        if unknown:
+            self._type_keywords.update(
+                (pk, keywords_of(name))
+                for pk, name in SpecificationType.objects.filter(id__in=unknown).values_list('id', 'name')
+            )
+        keywords = self._shared.get(type_ids)
+        if keywords is None:
+            keywords = self._shared[type_ids] = frozenset().union(
+                *(self._type_keywords.get(type_id, ()) for type_id in type_ids)
+            )
+        return keywords
+
+    def keywords_for(self, product_id):
+        """Ключевые слова товара; запрос к БД — только если его набор типов сменился."""
+        from .models import ProductSpecification
+
+        # Версия — до чтения БД: правка после чтения поднимет её и перечитает товар
+        version = product_versions([product_id], PRODUCT_VERSION_KEY)[product_id]
+        entry = self._by_product.get(product_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        type_ids = list(
+            ProductSpecification.objects.filter(product_id=product_id).values_list('spec_type_id', flat=True)
+        )
+        keywords = self._keywords_of_types(type_ids) if type_ids else NO_KEYWORDS
+        self._by_product[product_id] = (version, keywords)
+        return keywords
+
+    def load_all(self):
+        """
+        Ключевые слова всех товаров одним проходом по характеристикам — для retag_reviews.
+
+        Returns:
+            dict: id товара -> ключевые слова (товаров без характеристик в нём нет)
+        """
+        from .models import ProductSpecification
+
+        started = time.monotonic()
+        product_types = defaultdict(set)
+        for product_id, type_id in ProductSpecification.objects.values_list('product_id', 'spec_type_id'):
+            product_types[product_id].add(type_id)
+        versions = product_versions(product_types, PRODUCT_VERSION_KEY)
+        keywords = {
+            product_id: self._keywords_of_types(type_ids) for product_id, type_ids in product_types.items()
+        }
+        self._by_product = {product_id: (versions[product_id], words) for product_id, words in keywords.items()}
+        logger.info(
+            'Tag vocabulary built: %d products, %d distinct keyword sets, %.1f ms',
+            len(self._by_product), len(self._shared), (time.monotonic() - started) * 1000,
+        )
+        return keywords
+
+
+def bump_version():
+    """
+    Названия типов характеристик изменились — словарь всех товаров устарел.
+    Сразу и после коммита: отзыв в этой же транзакции уже видит новое название.
+    """
+    bump_around_commit([VERSION_CACHE_KEY])
+
+
+def bump_products(product_ids):
+    """Набор типов характеристик товаров изменился; сразу и после коммита, как bump_version."""
+    bump_around_commit(PRODUCT_VERSION_KEY.format(pid) for pid in product_ids)
+
+
+tag_vocabulary = TagVocabulary()
+
+
+def get_tag_vocabulary():
+    tag_vocabulary.sync()
+    return tag_vocabulary
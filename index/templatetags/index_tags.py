@@ -12,3 +12,14 @@ def replace(value, arg):
         return value
     old, new = arg.split(',', 1)
     return value.replace(old, new)
+
+
+@register.filter
+def get_item(mapping, key):
+    """
+    Значение словаря по ключу из переменной.
+    Использование: {{ facet_counts|get_item:facet }}
+    """
+    if not mapping:
+        return None
+    return mapping.get(key)
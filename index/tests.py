@@ -1,9 +1,19 @@
 from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-from index.models import Product, Category, Brand, SpecificationType, ProductSpecification, Review
+from datetime import timedelta
+from django.utils import timezone
+
+from index.models import Product, Category, Brand, Tag, SpecificationType, ProductSpecification, Review, Discount
+from index.facets import FacetIndex, get_facet_index, category_key, spec_key
 
 User = get_user_model()
 
@@ -29,6 +39,8 @@ def make_product(name='Товар', slug='tovar', price='1000.00', category=None
 
 class CatalogViewTest(TestCase):
     def setUp(self):
+        # Индекс фасетов синхронизируется через кэш — начинаем с чистого
+        cache.clear()
         self.product = make_product('Ноутбук', 'noutbuk', '5000.00')
 
     def test_catalog_returns_200(self):
@@ -76,6 +88,560 @@ class CatalogViewTest(TestCase):
         self.assertEqual(len(response.context['products']), 12)
 
 
+class FacetIndexTest(TestCase):
+    """Тесты битмап-индекса фасетов."""
+
+    def setUp(self):
+        cache.clear()
+        self.phones = make_category('Смартфоны', 'phones')
+        self.laptops = make_category('Ноутбуки', 'laptops')
+        self.ram = SpecificationType.objects.create(name='ОЗУ', slug='ram')
+        self.phone8 = make_product('Phone 8', 'phone-8', '300.00', category=self.phones)
+        self.phone12 = make_product('Phone 12', 'phone-12', '500.00', category=self.phones)
+        self.laptop = make_product('Laptop', 'laptop', '900.00', category=self.laptops)
+        for product, value in ((self.phone8, '8 ГБ'), (self.phone12, '12 ГБ'), (self.laptop, '8 ГБ')):
+            ProductSpecification.objects.create(product=product, spec_type=self.ram, value=value)
+        self.tag = Tag.objects.create(name='Хит', slug='hit')
+        self.phone12.tags.add(self.tag)
+
+    def test_select_and_or_semantics(self):
+        index = FacetIndex()
+        index.rebuild()
+        mask = index.select({
+            'category': [category_key('phones'), category_key('laptops')],
+            'spec:ram': [spec_key('ram', '8 ГБ')],
+        })
+        self.assertEqual(set(index.ordered_ids(mask)), {self.phone8.id, self.laptop.id})
+
+    def test_ordered_ids_default_is_newest_first(self):
+        index = FacetIndex()
+        index.rebuild()
+        self.assertEqual(
+            index.ordered_ids(index.universe),
+            [self.laptop.id, self.phone12.id, self.phone8.id],
+        )
+
+    def test_ordered_ids_price_range_and_sort(self):
+        index = FacetIndex()
+        index.rebuild()
+        mask = index.universe & index.price_mask(price_from=Decimal('400'))
+        self.assertEqual(index.ordered_ids(mask, '-final_price'), [self.laptop.id, self.phone12.id])
+
+    def test_incremental_update_from_signals(self):
+        index = get_facet_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.phone8.category = self.laptops
+            self.phone8.save()
+            self.phone12.tags.remove(self.tag)
+        index = get_facet_index()
+        self.assertEqual(
+            set(index.ordered_ids(index.select({'category': [category_key('laptops')]}))),
+            {self.phone8.id, self.laptop.id},
+        )
+        self.assertNotIn(('tag', 'hit'), index.bitmaps)
+
+    def test_catalog_filters_by_spec_and_tag(self):
+        url = reverse('index:index')
+        response = self.client.get(url + '?spec_ram=8 ГБ&category=phones')
+        self.assertEqual([p.id for p in response.context['products']], [self.phone8.id])
+        response = self.client.get(url + '?tag=hit')
+        self.assertEqual([p.id for p in response.context['products']], [self.phone12.id])
+
+    def test_catalog_filters_by_numeric_range(self):
+        url = reverse('index:index')
+        response = self.client.get(url + '?spec_ram_from=10')
+        self.assertEqual([p.id for p in response.context['products']], [self.phone12.id])
+        response = self.client.get(url + '?spec_ram_to=8,5&category=phones')
+        self.assertEqual([p.id for p in response.context['products']], [self.phone8.id])
+        # Диапазон сужает и счётчики фасетов
+        self.assertEqual(response.context['facet_counts']['category:laptops'], 1)
+        self.assertEqual(response.context['facet_counts']['spec:ram:12 ГБ'], 0)
+        # Мусор в границе игнорируется
+        response = self.client.get(url + '?spec_ram_from=abc')
+        self.assertEqual(len(response.context['products']), 3)
+        # Огромный показатель степени — тоже мусор, а не 500
+        for bound in ('1e999999999', '-1E999999999', '1e-999999999'):
+            response = self.client.get(url + f'?spec_ram_from={bound}')
+            self.assertEqual(response.status_code, 200, bound)
+
+    def test_sidebar_offers_numeric_range(self):
+        self.ram.comparison_type = 'higher_better'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ram.save()
+        response = self.client.get(reverse('index:index') + '?spec_ram_from=10')
+        ram = next(sf for sf in response.context['spec_filters'] if sf['slug'] == 'ram')
+        self.assertEqual(ram['numeric_range'], ('8', '12'))
+        self.assertEqual(ram['range_from'], '10')
+        self.assertContains(response, 'name="spec_ram_from"')
+
+    def test_facet_counts_are_disjunctive(self):
+        index = FacetIndex()
+        index.rebuild()
+        counts = index.facet_counts({'category': [category_key('phones')]})
+        # Своя группа не сужается выбором в ней самой
+        self.assertEqual(counts['category:phones'], 2)
+        self.assertEqual(counts['category:laptops'], 1)
+        # Остальные группы считаются внутри выбранной категории
+        self.assertEqual(counts['spec:ram:8 ГБ'], 1)
+        self.assertEqual(counts['tag:hit'], 1)
+
+    def test_facet_counts_respect_price_base(self):
+        index = FacetIndex()
+        index.rebuild()
+        counts = index.facet_counts({}, index.price_mask(price_to=Decimal('400')))
+        self.assertEqual(counts['category:phones'], 1)
+        self.assertEqual(counts['category:laptops'], 0)
+
+    def test_catalog_sidebar_renders_counts(self):
+        response = self.client.get(reverse('index:index') + '?brand=brandx&category=phones')
+        counts = response.context['facet_counts']
+        self.assertEqual(counts['category:laptops'], 1)
+        self.assertEqual(counts['spec:ram:12 ГБ'], 1)
+        self.assertContains(response, 'data-facet-count="category:laptops"')
+
+    def test_facet_counts_cached_by_normalized_signature(self):
+        url = reverse('index:index')
+        self.client.get(url + '?category=phones&brand=brandx')
+        with self.assertNumQueries(1):  # только страница товаров
+            self.client.get(url + '?brand=brandx&category=phones&category=phones')
+
+    def test_rebuild_command(self):
+        out = StringIO()
+        call_command('rebuild_facet_index', stdout=out)
+        self.assertIn('товаров 3', out.getvalue())
+
+
+class KeysetPaginationTest(TestCase):
+    """Тесты keyset-пагинации каталога и поиска."""
+
+    def setUp(self):
+        cache.clear()
+        # 30 товаров, цены с повторами — проверяем стабильность порядка при равных ключах
+        self.products = [
+            make_product(f'Ноутбук {i}', f'noutbuk-{i}', f'{1000 + (i % 5) * 100}.00')
+            for i in range(30)
+        ]
+
+    def _walk(self, url):
+        seen = []
+        response = self.client.get(url + 'cursor=')
+        while True:
+            seen.extend(response.context['products'])
+            page = response.context['page_obj']
+            if not page.has_next:
+                return seen, page
+            response = self.client.get(url + f'cursor={page.next_cursor}')
+
+    def test_cursor_roundtrip_and_garbage(self):
+        from index.pagination import encode_cursor, decode_cursor
+        self.assertEqual(decode_cursor(encode_cursor(Decimal('10.50'), 7)), (Decimal('10.50'), 7))
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        self.assertIsNone(decode_cursor(''))
+
+    def test_catalog_walk_all_orderings(self):
+        base = reverse('index:index')
+        expected = {
+            '': sorted(self.products, key=lambda p: -p.id),
+            'price_asc': sorted(self.products, key=lambda p: (p.price, -p.id)),
+            'price_desc': sorted(self.products, key=lambda p: (-p.price, -p.id)),
+        }
+        for sort, products in expected.items():
+            seen, page = self._walk(base + f'?sort={sort}&')
+            self.assertEqual([p.id for p in seen], [p.id for p in products], sort)
+            self.assertEqual(page.count, 30)
+
+    def test_search_walk_all_orderings(self):
+        # Поиск идёт через индекс фасетов — счётчик точный, как в каталоге
+        base = reverse('index:search') + '?q=Ноутбук&'
+        for sort in ('', 'price_desc'):
+            seen, page = self._walk(base + f'sort={sort}&')
+            self.assertEqual(len(seen), 30, sort)
+            self.assertEqual(len({p.id for p in seen}), 30, sort)
+            self.assertEqual(page.count, 30)
+        expected = sorted(self.products, key=lambda p: (-p.price, -p.id))
+        self.assertEqual([p.id for p in seen], [p.id for p in expected])
+
+    def test_search_count_not_recomputed_on_next_page(self):
+        base = reverse('index:search') + '?q=Ноутбук&'
+        first = self.client.get(base + 'cursor=')
+        next_url = base + f'cursor={first.context["page_obj"].next_cursor}'
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(next_url)
+        self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+
+
+class FinalPriceTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.discount = Discount.objects.create(name='Распродажа', percent=10)
+        self.cheap = make_product('Дешёвый', 'cheap', '950.00')
+        self.sale = make_product('Со скидкой', 'sale', '1000.00')
+        self.sale.discount = self.discount
+        self.sale.save()
+
+    def test_final_price_saved_with_product(self):
+        self.assertEqual(self.sale.final_price, Decimal('900.00'))
+        self.assertEqual(self.cheap.final_price, Decimal('950.00'))
+        self.assertTrue(self.sale.has_discount())
+        self.assertFalse(self.cheap.has_discount())
+
+    def test_discount_change_refreshes_products(self):
+        self.discount.percent = 50
+        self.discount.save()
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.final_price, Decimal('500.00'))
+
+        self.discount.delete()
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.final_price, Decimal('1000.00'))
+
+    def test_refresh_command_flips_discount_window(self):
+        now = timezone.now()
+        # Окно задаём через update(), чтобы не сработал сигнал — как при его истечении
+        Discount.objects.filter(pk=self.discount.pk).update(end_date=now - timedelta(days=1))
+        out = StringIO()
+        call_command('refresh_final_prices', stdout=out)
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.final_price, Decimal('1000.00'))
+        self.assertIn('1', out.getvalue())
+
+        Discount.objects.filter(pk=self.discount.pk).update(end_date=now + timedelta(days=1))
+        call_command('refresh_final_prices', stdout=StringIO())
+        self.sale.refresh_from_db()
+        self.assertEqual(self.sale.final_price, Decimal('900.00'))
+
+    def test_catalog_filters_and_sorts_by_final_price(self):
+        response = self.client.get(reverse('index:index') + '?price_to=920&sort=price_asc')
+        self.assertEqual([p.id for p in response.context['products']], [self.sale.id])
+
+        response = self.client.get(reverse('index:index') + '?sort=price_asc')
+        self.assertEqual([p.id for p in response.context['products']], [self.sale.id, self.cheap.id])
+
+        response = self.client.get(reverse('index:search') + '?q=Со&price_to=920')
+        self.assertEqual([p.id for p in response.context['products']], [self.sale.id])
+
+
+class SidebarCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.category = make_category('Телефоны', 'phones')
+        make_product('Телефон', 'phone', '500.00', category=self.category)
+
+    def test_payload_holds_tuples_not_model_instances(self):
+        from index.sidebar import get_sidebar_data
+        data = get_sidebar_data()
+        self.assertEqual(tuple(data['categories'][0]), ('Телефоны', 'phones'))
+        for items in data.values():
+            for item in items:
+                self.assertIsInstance(item, tuple)
+
+    def test_category_change_visible_immediately(self):
+        self.client.get(reverse('index:index'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Ноутбуки', slug='laptops')
+        response = self.client.get(reverse('index:index'))
+        self.assertIn('laptops', [c.slug for c in response.context['categories']])
+
+    def test_warm_cache_costs_no_queries(self):
+        from index.sidebar import get_sidebar_data
+        get_sidebar_data()
+        with self.assertNumQueries(0):
+            get_sidebar_data()
+
+    def test_stale_value_served_while_other_worker_rebuilds(self):
+        from index import sidebar
+        old = sidebar.get_sidebar_data()
+        sidebar.bump_version()
+        cache.add(sidebar.LOCK_CACHE_KEY, 1, sidebar.LOCK_TTL)  # пересборку держит другой воркер
+        with self.assertNumQueries(0):
+            self.assertEqual(sidebar.get_sidebar_data(), old)
+        cache.delete(sidebar.LOCK_CACHE_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Ноутбуки', slug='laptops')
+        self.assertEqual(len(sidebar.get_sidebar_data()['categories']), 2)
+
+
+    def test_search_reuses_cached_sidebar(self):
+        from index import sidebar
+        self.client.get(reverse('index:index'))
+        before = sidebar.stats().get('hit', 0)
+        url = reverse('index:search') + '?q=Телефон'
+        # Остаются только запросы самих товаров — без списков категорий/брендов/характеристик
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        sql = ' '.join(q['sql'] for q in ctx.captured_queries)
+        for table in ('index_category', 'index_brand', 'index_specificationtype', 'index_productspecification'):
+            self.assertNotIn(f'FROM "{table}"', sql)
+        self.assertEqual(sidebar.stats()['hit'], before + 1)
+        self.assertEqual([c.slug for c in response.context['categories']], ['phones'])
+
+    def test_htmx_partial_skips_sidebar(self):
+        from index import sidebar
+        self.client.get(reverse('index:index'))
+        misses = sidebar.stats().get('miss', 0)
+        response = self.client.get(reverse('index:search') + '?q=Телефон', HTTP_HX_REQUEST='true')
+        self.assertNotIn('categories', response.context)
+        self.assertEqual(sidebar.stats().get('miss', 0), misses)
+
+    def test_warm_command_fills_cache(self):
+        from index import sidebar
+        out = StringIO()
+        call_command('warm_sidebar_cache', stdout=out)
+        self.assertIn('категорий 1', out.getvalue())
+        with self.assertNumQueries(0):
+            sidebar.get_sidebar_data()
+
+class FullTextSearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.laptops = make_category('Ноутбуки', 'laptops')
+        self.phones = make_category('Телефоны', 'phones')
+        self.laptop = Product.objects.create(
+            name='Игровой ноутбук Lenovo Legion', slug='legion', price=Decimal('150000'),
+            category=self.laptops, description='Мощный процессор и быстрая память для игр',
+        )
+        self.phone = Product.objects.create(
+            name='Смартфон Samsung Galaxy', slug='galaxy', price=Decimal('60000'),
+            category=self.phones, description='Отлично подходит к ноутбукам и планшетам',
+        )
+
+    def _search(self, query, **params):
+        params['q'] = query
+        response = self.client.get(reverse('index:search'), params)
+        return [p.id for p in response.context['products']], response
+
+    def test_russian_morphology_and_prefix(self):
+        self.assertEqual(self._search('ноутбуки')[0], [self.laptop.id, self.phone.id])
+        self.assertEqual(self._search('игровые ноут')[0], [self.laptop.id])
+        self.assertEqual(self._search('смартф')[0], [self.phone.id])
+
+    def test_english_stemming_and_case(self):
+        self.assertEqual(self._search('GALAXIES')[0], [self.phone.id])  # porter: galaxi
+        self.assertEqual(self._search('galaxy')[0], [self.phone.id])
+        self.assertEqual(self._search('legions')[0], [self.laptop.id])
+
+    def test_name_match_ranks_above_description(self):
+        ids, _ = self._search('ноутбук')
+        self.assertEqual(ids, [self.laptop.id, self.phone.id])
+
+    def test_sidebar_filters_apply_to_matches(self):
+        ids, response = self._search('ноутбук', category='phones')
+        self.assertEqual(ids, [self.phone.id])
+        self.assertEqual(response.context['facet_counts']['category:laptops'], 1)
+
+    def test_snippet_highlights_word_forms(self):
+        _, response = self._search('процессоры')
+        snippet = response.context['products'][0].search_snippet
+        self.assertIn('<mark>процессор</mark>', snippet)
+        self.assertContains(response, '<mark>процессор</mark>', html=False)
+
+    def test_index_follows_product_changes(self):
+        self.phone.name = 'Планшет Samsung Tab'
+        self.phone.save()
+        self.assertEqual(self._search('планшет')[0], [self.phone.id])
+        self.assertEqual(self._search('смартфон')[0], [])
+        self.laptop.delete()
+        self.assertEqual(self._search('legion')[0], [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self._search('"ноутбук" (* -')[0], [self.laptop.id, self.phone.id])
+
+    def test_rebuild_command(self):
+        from django.db import connection as conn
+        from index.search import get_search_backend
+        with conn.cursor() as cursor:
+            cursor.execute('DELETE FROM index_product_fts')
+        self.assertEqual(get_search_backend().search('galaxy'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('товаров 2', out.getvalue())
+        self.assertEqual(self._search('galaxy')[0], [self.phone.id])
+
+
+class SearchSuggestTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.phones = make_category('Смартфоны', 'phones')
+        self.samsung = make_brand('Samsung', 'samsung')
+        self.s24 = make_product('Samsung Galaxy S24', 's24', category=self.phones, brand=self.samsung)
+        self.a15 = make_product('Samsung Galaxy A15', 'a15', category=self.phones, brand=self.samsung)
+        self.url = reverse('index:api_search_suggest')
+        # Поток не видит незакоммиченных данных теста — фоновая пересборка
+        # выполняется на месте или откладывается в self.jobs
+        self.jobs = None
+        patcher = mock.patch('index.suggest.run_in_background', side_effect=self._run)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run(self, target, *args):
+        if self.jobs is None:
+            target(*args)
+        else:
+            self.jobs.append((target, args))
+
+    def _labels(self, query, **params):
+        response = self.client.get(self.url, {'q': query, **params})
+        return [s['label'] for s in response.json()['suggestions']]
+
+    def test_prefix_of_any_word(self):
+        self.assertEqual(self._labels('galaxy a'), ['Samsung Galaxy A15'])
+        self.assertIn('Samsung Galaxy S24', self._labels('GAL'))
+        self.assertEqual(self._labels('смарт'), ['Смартфоны'])
+        self.assertEqual(self._labels(''), [])
+
+    def test_ranked_by_popularity(self):
+        from index.suggest import SuggestIndex, Suggestion
+        index = SuggestIndex()
+        index.build([
+            Suggestion('product', 'Galaxy A15', '/a15/', 1),
+            Suggestion('product', 'Galaxy S24', '/s24/', 10),
+            Suggestion('brand', 'Garmin', '/garmin/', 5),
+        ])
+        self.assertEqual([s.label for s in index.suggest('g')], ['Galaxy S24', 'Garmin', 'Galaxy A15'])
+        self.assertEqual([s.label for s in index.suggest('gal', limit=1)], ['Galaxy S24'])
+
+    def test_served_from_memory(self):
+        self._labels('sam')
+        with self.assertNumQueries(0):
+            self.assertEqual(self._labels('sam', limit=1), ['Samsung'])
+
+    def test_refreshed_by_signals(self):
+        self._labels('sam')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_product('Samsung Galaxy Tab', 'tab', category=self.phones, brand=self.samsung)
+        self.assertIn('Samsung Galaxy Tab', self._labels('galaxy t'))
+
+    def test_stale_snapshot_served_during_rebuild(self):
+        self._labels('sam')
+        self.jobs = []
+        with self.captureOnCommitCallbacks(execute=True):
+            make_product('Samsung Galaxy Tab', 'tab', category=self.phones, brand=self.samsung)
+        with self.assertNumQueries(0):
+            self.assertEqual(self._labels('galaxy t'), [])
+            self.assertEqual(self._labels('galaxy t'), [])
+        self.assertEqual(len(self.jobs), 1)  # вторая пересборка не запускается, пока идёт первая
+        target, args = self.jobs.pop()
+        target(*args)
+        self.assertEqual(self._labels('galaxy t'), ['Samsung Galaxy Tab'])
+
+    def test_htmx_dropdown(self):
+        response = self.client.get(self.url, {'q': 'galaxy s'}, HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'search-suggest-list')
+        self.assertContains(response, reverse('index:product_detail', args=['s24']))
+
+
+class FuzzySearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.samsung = make_brand('Samsung', 'samsung')
+        self.apple = make_brand('Apple', 'apple')
+        self.xiaomi = make_brand('Xiaomi', 'xiaomi')
+        self.galaxy = make_product('Galaxy S24', 's24', brand=self.samsung)
+        self.iphone = make_product('iPhone 15', 'iphone', brand=self.apple)
+        self.redmi = make_product('Redmi Note 13', 'redmi', brand=self.xiaomi)
+        self.laptop = make_product('Ноутбук Legion', 'legion')
+
+    def _search(self, query):
+        response = self.client.get(reverse('index:search'), {'q': query})
+        return [p.id for p in response.context['products']], response
+
+    def test_typos_transliteration_and_layout(self):
+        self.assertEqual(self._search('samsng')[0], [self.galaxy.id])
+        self.assertEqual(self._search('ифон')[0], [self.iphone.id])
+        self.assertEqual(self._search('ышфщьш')[0], [self.redmi.id])
+        self.assertEqual(self._search('yjen,er')[0], [self.laptop.id])
+
+    def test_only_when_primary_search_is_empty(self):
+        ids, response = self._search('galaxy')
+        self.assertEqual(ids, [self.galaxy.id])
+        self.assertFalse(response.context['fuzzy_results'])
+
+        ids, response = self._search('glaxy')
+        self.assertEqual(ids, [self.galaxy.id])
+        self.assertTrue(response.context['fuzzy_results'])
+        self.assertContains(response, 'показаны похожие товары')
+
+    def test_unrelated_query_finds_nothing(self):
+        self.assertEqual(self._search('холодильник')[0], [])
+
+    def test_incremental_update_from_journal(self):
+        from index.fuzzy import get_fuzzy_index
+        self._search('samsng')
+        index = get_fuzzy_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            phone = make_product('Pixel 9', 'pixel')
+        words = len(index.words)
+        self.assertEqual(get_fuzzy_index().search('pixle'), [phone.id])
+        self.assertEqual(len(index.words), words + 1)
+
+    def test_cold_cache_rebuilds_once(self):
+        from index.fuzzy import fuzzy_index, get_fuzzy_index
+        cache.clear()
+        with mock.patch.object(fuzzy_index, 'rebuild', wraps=fuzzy_index.rebuild) as rebuild:
+            self.assertEqual(get_fuzzy_index().search('samsng'), [self.galaxy.id])
+            self.assertEqual(get_fuzzy_index().search('samsng'), [self.galaxy.id])
+        self.assertEqual(rebuild.call_count, 1)
+
+
+class SearchResultCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.phones = make_category('Телефоны', 'phones')
+        self.iphone = make_product('iPhone 15', 'iphone-15', '90000.00', category=self.phones)
+        self.iphone_pro = make_product('iPhone 15 Pro', 'iphone-15-pro', '120000.00', category=self.phones)
+
+    def _search(self, params):
+        response = self.client.get(reverse('index:search'), params)
+        return [p.id for p in response.context['products']]
+
+    def test_equivalent_requests_share_an_entry(self):
+        from index import search_cache
+        first = self._search({'q': 'iPhone', 'category': 'phones', 'sort': 'price_desc'})
+        with CaptureQueriesContext(connection) as ctx:
+            again = self._search({'q': '  IPHONE ', 'sort': 'price_desc', 'category': ['phones', 'phones']})
+        self.assertEqual(again, first)
+        self.assertEqual(again, [self.iphone_pro.id, self.iphone.id])
+        # Гидрация страницы — один запрос id__in, поиска в FTS нет
+        sql = [q['sql'] for q in ctx.captured_queries]
+        self.assertFalse(any('index_product_fts' in q for q in sql))
+        self.assertEqual(sum('FROM "index_product"' in q for q in sql), 1)
+        self.assertEqual(search_cache.stats()['hits'], 1)
+        self.assertEqual(search_cache.stats()['misses'], 1)
+
+    def test_different_sort_or_filters_miss(self):
+        from index import search_cache
+        self._search({'q': 'iphone'})
+        self._search({'q': 'iphone', 'sort': 'price_asc'})
+        self._search({'q': 'iphone', 'price_to': '100000'})
+        self.assertEqual(search_cache.stats()['misses'], 3)
+
+    def test_catalog_write_invalidates(self):
+        self.assertEqual(self._search({'q': 'iphone'}), [self.iphone.id, self.iphone_pro.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            newer = make_product('iPhone 16', 'iphone-16', category=self.phones)
+        self.assertIn(newer.id, self._search({'q': 'iphone'}))
+
+    def test_keyset_pages_from_cached_list(self):
+        url = reverse('index:search') + '?q=iphone&cursor='
+        first = self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(len(first.context['products']), 2)
+        self.assertIsNone(first.context['page_obj'].next_cursor)
+
+    def test_stats_command(self):
+        self._search({'q': 'iphone'})
+        self._search({'q': 'iphone'})
+        out = StringIO()
+        call_command('search_cache_stats', '--reset', stdout=out)
+        self.assertIn('Попаданий: 1, промахов: 1, доля попаданий: 50.0%', out.getvalue())
+
+
 class ProductDetailViewTest(TestCase):
     def setUp(self):
         self.product = make_product('Ноутбук Lenovo', 'noutbuk-lenovo')
@@ -154,8 +720,339 @@ class ReviewTest(TestCase):
         self.assertEqual(Review.objects.count(), 1)
         self.assertEqual(Review.objects.first().user, self.user)
 
+class ProductRatingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.phone = make_product('Телефон', 'phone', '20000.00')
+        self.laptop = make_product('Ноутбук', 'laptop', '50000.00')
+
+    def _review(self, product, rating):
+        return Review.objects.create(
+            product=product, name='Покупатель', rating=rating, comment='Нормальный отзыв о товаре',
+        )
+
+    def test_create_update_delete_keep_aggregates(self):
+        first = self._review(self.phone, 5)
+        self._review(self.phone, 4)
+        self._review(self.phone, 4)
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.rating_count, 3)
+        self.assertEqual(self.phone.rating_avg, Decimal('4.33'))
+        self.assertEqual((self.phone.rating_4, self.phone.rating_5), (2, 1))
+
+        review = Review.objects.get(pk=first.pk)
+        review.rating = 1
+        review.save()
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.rating_avg, Decimal('3.00'))
+        self.assertEqual((self.phone.rating_1, self.phone.rating_5), (1, 0))
+
+        review.delete()
+        Review.objects.filter(product=self.phone).delete()
+        self.phone.refresh_from_db()
+        self.assertEqual((self.phone.rating_count, self.phone.rating_avg), (0, Decimal('0.00')))
+
+    def test_product_save_does_not_overwrite_rating(self):
+        stale = Product.objects.get(pk=self.phone.pk)
+        self._review(self.phone, 5)
+        stale.price = Decimal('19000.00')
+        stale.save()
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.rating_count, 1)
+        self.assertEqual(self.phone.price, Decimal('19000.00'))
+
+    def test_detail_page_needs_no_aggregate_query(self):
+        self._review(self.phone, 5)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('index:product_detail', kwargs={'slug': 'phone'}))
+        self.assertContains(response, '(1 отзывов)')
+        self.assertFalse(any('AVG(' in q['sql'] or 'COUNT(' in q['sql'] for q in ctx.captured_queries))
+
+    def test_recompute_command_repairs_drift(self):
+        self._review(self.phone, 2)
+        self._review(self.phone, 3)
+        Product.objects.filter(pk=self.phone.pk).update(rating_count=7, rating_avg=Decimal('5.00'))
+        out = StringIO()
+        call_command('recompute_ratings', stdout=out)
+        self.assertIn('Исправлен рейтинг товаров: 1', out.getvalue())
+        self.phone.refresh_from_db()
+        self.assertEqual((self.phone.rating_count, self.phone.rating_avg), (2, Decimal('2.50')))
+
+    def test_sort_by_rating(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._review(self.phone, 3)
+            self._review(self.laptop, 5)
+        response = self.client.get(reverse('index:index') + '?sort=rating')
+        self.assertEqual([p.id for p in response.context['products']], [self.laptop.id, self.phone.id])
+
+        response = self.client.get(reverse('index:index') + '?sort=rating&cursor=')
+        self.assertEqual([p.id for p in response.context['products']], [self.laptop.id, self.phone.id])
+        self.assertContains(response, '★ 5.0')
+
+
+class ProductReviewListTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_product('Телефон', 'phone')
+        now = timezone.now()
+        for i in range(25):
+            review = Review.objects.create(
+                product=self.product, name=f'Покупатель {i}', rating=i % 5 + 1,
+                comment='Отзыв о телефоне номер %d' % i,
+            )
+            # Половина отзывов — с одинаковым временем: порядок решает id
+            Review.objects.filter(pk=review.pk).update(
+                created_at=now - timedelta(minutes=i // 2), tags=['хороший_экран'] if i % 3 == 0 else [],
+            )
+        self.expected = list(
+            Review.objects.filter(product=self.product).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+
+    def _walk(self, params=''):
+        url = reverse('index:product_reviews', kwargs={'slug': 'phone'})
+        response = self.client.get(f'{url}?{params}')
+        seen = [r.id for r in response.context['reviews']]
+        while response.context['reviews_next_cursor']:
+            cursor = response.context['reviews_next_cursor']
+            response = self.client.get(f'{url}?{params}&cursor={cursor}')
+            seen += [r.id for r in response.context['reviews']]
+        return seen
+
+    def test_detail_renders_only_first_page(self):
+        response = self.client.get(reverse('index:product_detail', kwargs={'slug': 'phone'}))
+        self.assertEqual([r.id for r in response.context['reviews']], self.expected[:10])
+        self.assertContains(response, 'Показать ещё')
+
+    def test_load_more_walks_all_reviews_once(self):
+        self.assertEqual(self._walk(), self.expected)
+
+    def test_rating_filter(self):
+        expected = [r.id for r in Review.objects.filter(rating=5).order_by('-created_at', '-id')]
+        self.assertEqual(self._walk('rating=5'), expected)
+
+    def test_tag_filter(self):
+        from index.review_tags import rebuild_tag_counts
+        rebuild_tag_counts()  # теги проставлены update() в обход сигналов
+        expected = [
+            r.id for r in Review.objects.order_by('-created_at', '-id') if 'хороший_экран' in r.tags
+        ]
+        self.assertEqual(self._walk('tag=хороший_экран'), expected)
+
+    def test_bad_cursor_starts_over(self):
+        response = self.client.get(
+            reverse('index:product_reviews', kwargs={'slug': 'phone'}) + '?cursor=garbage&rating=9'
+        )
+        self.assertEqual([r.id for r in response.context['reviews']], self.expected[:10])
+
+
+class ReviewTaggingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_product('Телефон', 'phone')
+        self.screen = SpecificationType.objects.create(name='Экран')
+        ProductSpecification.objects.create(product=self.product, spec_type=self.screen, value='OLED')
+
+    def _review(self, comment):
+        return Review.objects.create(product=self.product, name='Покупатель', rating=4, comment=comment)
+
+    def test_extract_tags_keeps_order_dedup_and_limit(self):
+        from index.tagging import extract_tags
+        keywords = frozenset({'экран', 'батарея'})
+        text = 'Яркий экран. Яркий экран! Не держит батарея, экран тусклый'
+        self.assertEqual(extract_tags(text, keywords), ['яркий_экран', 'не_держит_батарея', 'экран_тусклый'])
+        self.assertEqual(extract_tags(text, frozenset()), [])
+
+    def test_vocabulary_is_not_queried_per_review(self):
+        self._review('Отличный экран, всё видно')
+        with CaptureQueriesContext(connection) as ctx:
+            review = self._review('Тусклый экран на солнце')
+        self.assertEqual(review.tags, ['тусклый_экран'])
+        self.assertFalse(any('index_productspecification' in q['sql'] for q in ctx.captured_queries))
+
+    def test_spec_edits_reload_only_affected_product(self):
+        self._review('Отличный экран, всё видно')
+        spec = ProductSpecification.objects.get(product=self.product)
+        spec.value = 'IPS'
+        spec.save()
+        other = make_product('Планшет', 'tablet', category=self.product.category)
+        ProductSpecification.objects.create(product=other, spec_type=self.screen, value='LCD')
+        with CaptureQueriesContext(connection) as ctx:
+            self._review('Тусклый экран на солнце')
+        self.assertFalse(any('index_productspecification' in q['sql'] for q in ctx.captured_queries))
+        self.assertFalse(any('index_specificationtype' in q['sql'] for q in ctx.captured_queries))
+
+        battery = SpecificationType.objects.create(name='Батарея')
+        ProductSpecification.objects.create(product=self.product, spec_type=battery, value='5000mAh')
+        self.assertEqual(self._review('Батарея слабая').tags, ['батарея_слабая'])
+
+    def test_retag_command_after_spec_rename(self):
+        review = self._review('Батарея держит долго, экран яркий')
+        self.assertEqual(review.tags, ['экран_яркий'])
+        self.screen.name = 'Батарея'
+        self.screen.save()
+
+        out = StringIO()
+        call_command('retag_reviews', '--workers=1', '--chunk-size=1', stdout=out)
+        review.refresh_from_db()
+        self.assertEqual(review.tags, ['батарея_держит'])
+        self.assertIn('Готово: 1 отзывов, теги изменены у 1', out.getvalue())
+
+    def test_retag_command_reads_versions_once(self):
+        from index import tagging
+
+        for i in range(5):
+            self._review(f'Экран номер {i} хороший')
+        with mock.patch.object(tagging, 'product_versions', wraps=tagging.product_versions) as versions:
+            call_command('retag_reviews', '--workers=1', '--chunk-size=2', stdout=StringIO())
+        self.assertEqual(versions.call_count, 1)
+
+    def test_retag_command_with_process_pool(self):
+        reviews = [self._review(f'Экран номер {i} хороший') for i in range(6)]
+        Review.objects.update(tags=[])
+        call_command('retag_reviews', '--workers=2', '--chunk-size=4', stdout=StringIO())
+        for review in reviews:
+            review.refresh_from_db()
+            self.assertEqual(review.tags, ['экран_номер'])
+
+
+class ReviewTagCountTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_product('Телефон', 'phone')
+        screen = SpecificationType.objects.create(name='Экран')
+        ProductSpecification.objects.create(product=self.product, spec_type=screen, value='OLED')
+
+    def _review(self, comment):
+        return Review.objects.create(product=self.product, name='Покупатель', rating=4, comment=comment)
+
+    def _cloud(self):
+        from index.review_tags import tag_cloud
+        return tag_cloud(self.product)
+
+    def test_counts_follow_review_changes(self):
+        first = self._review('Яркий экран, всё видно')
+        self._review('Яркий экран и быстрый')
+        self._review('Не понравился экран.')
+        self.assertEqual(self._cloud(), [('яркий_экран', 2), ('не_понравился_экран', 1)])
+
+        review = Review.objects.get(pk=first.pk)
+        review.comment = 'Тусклый экран, увы'
+        review.save()
+        self.assertEqual(
+            self._cloud(), [('не_понравился_экран', 1), ('тусклый_экран', 1), ('яркий_экран', 1)]
+        )
+
+        Review.objects.filter(comment__startswith='Яркий').delete()
+        self.assertEqual(self._cloud(), [('не_понравился_экран', 1), ('тусклый_экран', 1)])
+
+    def test_detail_page_renders_cloud_and_filters_by_tag(self):
+        self._review('Яркий экран, всё видно')
+        self._review('Тусклый экран, увы')
+        response = self.client.get(reverse('index:product_detail', kwargs={'slug': 'phone'}))
+        self.assertContains(response, 'Что говорят покупатели')
+        self.assertContains(response, '×1')
+
+        url = reverse('index:product_reviews', kwargs={'slug': 'phone'})
+        response = self.client.get(url, {'tag': 'яркий_экран'})
+        self.assertEqual([r.comment for r in response.context['reviews']], ['Яркий экран, всё видно'])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {'tag': 'нет_такого'})
+        self.assertEqual(response.context['reviews'], [])
+        self.assertFalse(any('FROM "index_review"' in q['sql'] for q in ctx.captured_queries))
+
+    def test_retag_rebuilds_counts(self):
+        self._review('Яркий экран, всё видно')
+        Review.objects.update(tags=[])
+        call_command('retag_reviews', '--workers=1', stdout=StringIO())
+        self.assertEqual(self._cloud(), [('яркий_экран', 1)])
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_product('Телефон', 'phone')
+        self.other = make_product('Планшет', 'tablet')
+        self.detail_url = reverse('index:product_detail', kwargs={'slug': 'phone'})
+        # Первый ответ ставит CSRF-cookie — она входит в ETag
+        self.client.get(reverse('index:index'))
+
+    def _revalidate(self, url, response, **headers):
+        etag = response.headers['ETag']
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag, **headers)
+
+    def test_product_page_304_without_rendering(self):
+        first = self.client.get(self.detail_url)
+        self.assertTrue(first.headers['ETag'].startswith('W/"'))
+        self.assertIn('private', first.headers['Cache-Control'])
+        with CaptureQueriesContext(connection) as ctx:
+            second = self._revalidate(self.detail_url, first)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b'')
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        # Только валидатор: id и updated_at товара, без отзывов и характеристик
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_review_and_stock_changes_invalidate_product_page(self):
+        first = self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, name='Покупатель', rating=5, comment='Отличный телефон')
+        second = self._revalidate(self.detail_url, first)
+        self.assertEqual(second.status_code, 200)
+        self.assertContains(second, 'Отличный телефон')
+
+        from index.models import Stock
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.create(product=self.product, quantity=3)
+        self.assertEqual(self._revalidate(self.detail_url, second).status_code, 200)
+
+    def test_listing_varies_on_htmx_and_cookie(self):
+        url = reverse('index:index')
+        full = self.client.get(url)
+        partial = self.client.get(url, HTTP_HX_REQUEST='true')
+        self.assertNotEqual(full.headers['ETag'], partial.headers['ETag'])
+        for response in (full, partial):
+            vary = response.headers['Vary']
+            self.assertIn('HX-Request', vary)
+            self.assertIn('Cookie', vary)
+        # Ответ на полный запрос не подходит как валидатор для HTMX
+        self.assertEqual(self._revalidate(url, full, HTTP_HX_REQUEST='true').status_code, 200)
+        revalidated = self._revalidate(url, partial, HTTP_HX_REQUEST='true')
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertIn('HX-Request', revalidated.headers['Vary'])
+
+    def test_listing_follows_catalog_version_and_cart(self):
+        url = reverse('index:index')
+        first = self.client.get(url)
+        self.assertEqual(self._revalidate(url, first).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.name = 'Планшет Pro'
+            self.other.save()
+        second = self._revalidate(url, first)
+        self.assertEqual(second.status_code, 200)
+
+        self.client.post(reverse('cart:cart_add', args=[self.product.id]), {'quantity': 1})
+        self.assertEqual(self._revalidate(url, second).status_code, 200)
+
+    def test_comparison_api_is_public_and_revalidates(self):
+        url = reverse('index:api_comparison') + f'?product_ids={self.product.id},{self.other.id}'
+        first = self.client.get(url)
+        self.assertIn('public', first.headers['Cache-Control'])
+        self.assertEqual(self._revalidate(url, first).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductSpecification.objects.create(
+                product=self.product, spec_type=SpecificationType.objects.create(name='Вес'), value='200 г',
+            )
+        self.assertNotEqual(self._revalidate(url, first).status_code, 304)
+
+
 class SearchViewTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.product = make_product('Ноутбук Lenovo X1', 'lenovo-x1')
 
     def test_search_finds_product(self):
@@ -170,6 +1067,289 @@ class SearchViewTest(TestCase):
 
 # === Тесты для системы сравнения товаров ===
 
+class SpecParsedValuesTest(TestCase):
+    """Разбор значений характеристик при записи."""
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_product()
+        self.screen = SpecificationType.objects.create(name='Диагональ', slug='screen')
+
+    def test_save_parses_value(self):
+        spec = ProductSpecification.objects.create(
+            product=self.product, spec_type=self.screen, value=' 6,7  Дюймов'
+        )
+        spec.refresh_from_db()
+        self.assertEqual(spec.numeric_value, Decimal('6.7'))
+        self.assertFalse(spec.bool_value)
+        self.assertEqual(spec.token, '6,7 дюймов')
+
+        spec.value = 'Есть'
+        spec.save(update_fields=['value'])
+        spec.refresh_from_db()
+        self.assertIsNone(spec.numeric_value)
+        self.assertTrue(spec.bool_value)
+
+    def test_range_query_uses_index(self):
+        from index.spec_values import products_in_range
+
+        ProductSpecification.objects.create(product=self.product, spec_type=self.screen, value='6.1')
+        ids = products_in_range('screen', Decimal('6'), Decimal('6.5'))
+        self.assertEqual(list(ids), [self.product.id])
+        range_index = ProductSpecification._meta.indexes[0].name
+        self.assertIn(range_index, ids.explain())
+
+    def test_backfill_command(self):
+        ProductSpecification.objects.create(product=self.product, spec_type=self.screen, value='6.1')
+        # Запись в обход save() — разобранные колонки пусты
+        ProductSpecification.objects.update(numeric_value=None, token='')
+        out = StringIO()
+        call_command('backfill_spec_values', stdout=out)
+        self.assertIn('Обновлено характеристик: 1 у 1 товаров', out.getvalue())
+        spec = ProductSpecification.objects.get()
+        self.assertEqual(spec.numeric_value, Decimal('6.1'))
+        self.assertEqual(spec.token, '6.1')
+
+        out = StringIO()
+        call_command('backfill_spec_values', stdout=out)
+        self.assertIn('Обновлено характеристик: 0', out.getvalue())
+
+    def test_migration_backfills_existing_rows(self):
+        import importlib
+        from django.apps import apps
+
+        migration = importlib.import_module('index.migrations.0020_backfill_spec_parsed_values')
+        ProductSpecification.objects.create(product=self.product, spec_type=self.screen, value='6.1')
+        ProductSpecification.objects.update(numeric_value=None, bool_value=None, token='')
+        migration.backfill_parsed_values(apps, None)
+        spec = ProductSpecification.objects.get()
+        self.assertEqual(spec.numeric_value, Decimal('6.1'))
+        self.assertIsNotNone(spec.bool_value)
+        self.assertEqual(spec.token, '6.1')
+
+
+class SimilarProductsTest(TestCase):
+    """Похожие товары: матрицы признаков на диске и kNN."""
+
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from index.similar import similar_index
+
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(SIMILAR_INDEX_DIR=tmp.name + '/similar')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        similar_index._matrices.clear()
+
+        self.phones = make_category('Смартфоны', 'phones')
+        self.ram = SpecificationType.objects.create(name='ОЗУ', comparison_type='higher_better', priority=80)
+        self.panel = SpecificationType.objects.create(
+            name='Экран', comparison_type='categorical', category_map={'AMOLED': 100, 'IPS': 50},
+        )
+        self.products = {}
+        for slug, price, ram, panel in (
+            ('base', '30000.00', '8 ГБ', 'AMOLED'),
+            ('twin', '31000.00', '8 ГБ', 'AMOLED'),
+            ('close', '33000.00', '12 ГБ', 'AMOLED'),
+            ('budget', '9000.00', '4 ГБ', 'IPS'),
+        ):
+            product = make_product(slug, slug, price, category=self.phones)
+            ProductSpecification.objects.create(product=product, spec_type=self.ram, value=ram)
+            ProductSpecification.objects.create(product=product, spec_type=self.panel, value=panel)
+            self.products[slug] = product
+        # Другая категория в выдачу не попадает
+        make_product('Laptop', 'laptop', '30000.00', category=make_category('Ноутбуки', 'laptops'))
+
+    def similar(self, slug):
+        from index.similar import get_similar_index
+
+        return get_similar_index().similar(self.products[slug].id, self.phones.id)
+
+    def ids(self, *slugs):
+        return [self.products[slug].id for slug in slugs]
+
+    def test_rebuild_command_and_nearest(self):
+        self.assertEqual(self.similar('base'), [])  # не собрано — блок пуст
+        out = StringIO()
+        call_command('rebuild_similar_index', stdout=out)
+        self.assertIn('товаров 5', out.getvalue())
+        self.assertEqual(self.similar('base'), self.ids('twin', 'close', 'budget'))
+        self.assertEqual(self.similar('budget')[-1], self.products['close'].id)
+
+    def test_matrix_is_memory_mapped(self):
+        import numpy as np
+        from index.similar import get_similar_index
+
+        call_command('rebuild_similar_index', stdout=StringIO())
+        matrix = get_similar_index().matrix(self.phones.id)
+        self.assertIsInstance(matrix.vectors, np.memmap)
+        self.assertEqual(matrix.vectors.dtype, np.float32)
+        self.assertEqual(matrix.vectors.shape, (4, 3))  # ОЗУ, экран, цена
+
+    def test_spec_change_rewrites_row_in_place(self):
+        from index.similar import get_similar_index
+
+        call_command('rebuild_similar_index', stdout=StringIO())
+        build = get_similar_index().matrix(self.phones.id).build
+        spec = ProductSpecification.objects.get(product=self.products['twin'], spec_type=self.panel)
+        spec.value = 'IPS'
+        spec_ram = ProductSpecification.objects.get(product=self.products['twin'], spec_type=self.ram)
+        spec_ram.value = '4 ГБ'
+        self.products['twin'].price = Decimal('9500.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            spec.save()
+            spec_ram.save()
+            self.products['twin'].save()
+        self.assertEqual(get_similar_index().matrix(self.phones.id).build, build)
+        self.assertEqual(self.similar('base')[0], self.products['close'].id)
+        self.assertEqual(self.similar('budget')[0], self.products['twin'].id)
+
+    def test_new_product_marks_category_for_rebuild(self):
+        from index.similar import get_similar_index, stale_categories
+
+        call_command('rebuild_similar_index', stdout=StringIO())
+        build = get_similar_index().matrix(self.phones.id).build
+        with self.captureOnCommitCallbacks(execute=True):
+            clone = make_product('clone', 'clone', '30000.00', category=self.phones)
+            ProductSpecification.objects.create(product=clone, spec_type=self.ram, value='8 ГБ')
+            ProductSpecification.objects.create(product=clone, spec_type=self.panel, value='AMOLED')
+        # В запросе категория не пересобирается — только помечается
+        self.assertEqual(get_similar_index().matrix(self.phones.id).build, build)
+        self.assertEqual(stale_categories(), [self.phones.id])
+
+        out = StringIO()
+        call_command('rebuild_similar_index', '--stale', stdout=out)
+        self.assertIn('категорий 1', out.getvalue())
+        self.assertEqual(stale_categories(), [])
+        self.assertNotEqual(get_similar_index().matrix(self.phones.id).build, build)
+        self.assertIn(clone.id, self.similar('base')[:2])
+
+    def test_rebuild_keeps_files_of_current_build(self):
+        from index.similar import build_category, get_similar_index, index_dir
+
+        build_category(self.phones.id)
+        build_category(self.phones.id)
+        build = get_similar_index().matrix(self.phones.id).build
+        names = sorted(path.name for path in index_dir().glob(f'category-{self.phones.id}-*.npy'))
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(build in name for name in names))
+
+    def test_product_page_shows_similar(self):
+        call_command('rebuild_similar_index', stdout=StringIO())
+        response = self.client.get(reverse('index:product_detail', args=['base']))
+        self.assertEqual(
+            [p.id for p in response.context['similar_products']], self.ids('twin', 'close', 'budget')
+        )
+        self.assertContains(response, 'Похожие товары')
+
+
+class SpecScoreTest(TestCase):
+    """Оценка характеристик в категории: пересчёт после коммита, сортировка и топ."""
+
+    def setUp(self):
+        cache.clear()
+        self.phones = make_category('Смартфоны', 'phones')
+        self.ram = SpecificationType.objects.create(name='ОЗУ', comparison_type='higher_better')
+        self.panel = SpecificationType.objects.create(
+            name='Экран', comparison_type='categorical', category_map={'AMOLED': 100, 'IPS': 50},
+        )
+        self.products = {}
+        with self.captureOnCommitCallbacks(execute=True):
+            for slug, ram, panel in (('top', '12 ГБ', 'AMOLED'), ('mid', '8 ГБ', 'IPS'), ('low', '4 ГБ', None)):
+                product = make_product(slug, slug, '1000.00', category=self.phones)
+                ProductSpecification.objects.create(product=product, spec_type=self.ram, value=ram)
+                if panel:
+                    ProductSpecification.objects.create(product=product, spec_type=self.panel, value=panel)
+                self.products[slug] = product
+            self.plain = make_product('Без характеристик', 'plain', '1000.00', category=self.phones)
+
+    def scores(self):
+        return dict(Product.objects.filter(category=self.phones).values_list('slug', 'spec_score'))
+
+    def test_scores_recomputed_after_commit(self):
+        # ОЗУ min-max, экран по category_map, нет значения — 0; веса равны
+        self.assertEqual(self.scores(), {
+            'top': Decimal('100.00'), 'mid': Decimal('50.00'), 'low': Decimal('0.00'), 'plain': Decimal('0.00'),
+        })
+
+    def test_spec_type_change_rescores_category(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ram.comparison_type = 'lower_better'
+            self.ram.save()
+        self.assertEqual(self.scores()['top'], Decimal('50.00'))
+        self.assertEqual(self.scores()['low'], Decimal('50.00'))
+
+    def test_admin_save_keeps_score(self):
+        product = Product.objects.get(slug='top')
+        Product.objects.filter(pk=product.pk).update(spec_score=Decimal('42.00'))
+        product.name = 'Флагман'
+        product.save()  # копия в памяти со старой оценкой
+        product.refresh_from_db()
+        self.assertEqual(product.spec_score, Decimal('42.00'))
+
+    def test_price_edit_does_not_rescore(self):
+        from index.models import StaleSpecScores
+
+        StaleSpecScores.objects.all().delete()  # пометки от товаров из setUp
+        product = Product.objects.get(slug='top')
+        product.price = Decimal('500.00')
+        product.name = 'Флагман'
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks(execute=True):
+                product.save()
+        self.assertFalse(any('index_productspecification' in q['sql'] for q in ctx.captured_queries))
+        self.assertFalse(StaleSpecScores.objects.exists())
+
+    def test_new_and_moved_products_rescored_by_stale_command(self):
+        from index.models import StaleSpecScores
+
+        with self.captureOnCommitCallbacks(execute=True):
+            best = make_product('Новинка', 'new', '1000.00', category=self.phones)
+            ProductSpecification.objects.create(product=best, spec_type=self.ram, value='16 ГБ')
+        laptops = make_category('Ноутбуки', 'laptops')
+        top = Product.objects.get(slug='top')
+        top.category = laptops
+        with self.captureOnCommitCallbacks(execute=True):
+            top.save()
+        self.assertEqual(
+            set(StaleSpecScores.objects.values_list('category_id', flat=True)), {self.phones.id, laptops.id}
+        )
+
+        out = StringIO()
+        call_command('recompute_spec_scores', '--stale', stdout=out)
+        self.assertIn('категорий 2', out.getvalue())
+        self.assertFalse(StaleSpecScores.objects.exists())
+        # ОЗУ 4..16 ГБ без переехавшего top, экран есть только у mid
+        self.assertEqual(self.scores()['new'], Decimal('50.00'))
+        self.assertEqual(self.scores()['mid'], Decimal('41.67'))
+
+    def test_command_repairs_scores(self):
+        Product.objects.update(spec_score=0)
+        out = StringIO()
+        call_command('recompute_spec_scores', stdout=out)
+        self.assertIn('Обновлена оценка товаров: 2', out.getvalue())
+        self.assertEqual(self.scores()['top'], Decimal('100.00'))
+
+    def test_catalog_sort_and_category_top(self):
+        response = self.client.get(reverse('index:index') + '?category=phones&sort=score')
+        self.assertEqual([p.slug for p in response.context['products']][:2], ['top', 'mid'])
+        # В топе только товары с оценкой
+        self.assertEqual([p.slug for p in response.context['category_top']], ['top', 'mid'])
+        self.assertContains(response, 'Лучшие по характеристикам')
+
+        response = self.client.get(reverse('index:index'))
+        self.assertEqual(response.context['category_top'], [])
+
+    def test_category_top_uses_score_index(self):
+        from index.spec_scores import top_in_category
+
+        plan = top_in_category('phones').explain()
+        self.assertIn(Product._meta.indexes[0].name, plan)
+
+
 class ComparisonServiceTest(TestCase):
     """Тесты для сервиса сравнения товаров."""
 
@@ -256,20 +1436,34 @@ class ComparisonServiceTest(TestCase):
         )
 
     def test_validate_products_correct_count(self):
-        """Проверка валидации: ровно 2 товара."""
+        """Проверка валидации: от 2 до 6 товаров."""
         from index.services import ComparisonService
         
         # Слишком мало товаров
         success, error, products = ComparisonService.validate_products([self.product1.id])
         self.assertFalse(success)
-        self.assertIn('ровно 2', error)
+        self.assertIn('от 2 до 6', error)
         
-        # Слишком много товаров
-        product3 = make_product('Third', 'third')
+        # Повтор одного товара — всё ещё один товар
+        success, error, products = ComparisonService.validate_products([self.product1.id] * 2)
+        self.assertFalse(success)
+        
+        # Три товара одной категории — можно
+        product3 = make_product('Third', 'third', category=self.category, brand=self.brand)
         success, error, products = ComparisonService.validate_products([
-            self.product1.id, self.product2.id, product3.id
+            product3.id, self.product1.id, self.product2.id
         ])
+        self.assertTrue(success)
+        self.assertEqual([p.id for p in products], [product3.id, self.product1.id, self.product2.id])
+        
+        # Слишком много товаров
+        ids = [self.product1.id, self.product2.id, product3.id] + [
+            make_product(f'Extra {i}', f'extra-{i}', category=self.category, brand=self.brand).id
+            for i in range(4)
+        ]
+        success, error, products = ComparisonService.validate_products(ids)
         self.assertFalse(success)
+        self.assertIn('от 2 до 6', error)
 
     def test_validate_products_same_category(self):
         """Проверка валидации: одна категория."""
@@ -323,6 +1517,145 @@ class ComparisonServiceTest(TestCase):
             self.assertTrue(product1_storage['is_best'])  # 256 ГБ > 128 ГБ
             self.assertFalse(product2_storage['is_best'])
 
+    def test_n_way_ranking(self):
+        """Лучшие и худшие значения — среди всех товаров, пропуск — худший."""
+        from index.services import ComparisonService
+        
+        product3 = make_product('Pixel 8', 'pixel-8', category=self.category, brand=self.brand)
+        product4 = make_product('Nokia', 'nokia', category=self.category, brand=self.brand)
+        ProductSpecification.objects.create(product=product3, spec_type=self.ram_spec_type, value='12 ГБ')
+        ProductSpecification.objects.create(product=product4, spec_type=self.ram_spec_type, value='4 ГБ')
+        ProductSpecification.objects.create(product=product3, spec_type=self.panel_spec_type, value='AMOLED')
+        ProductSpecification.objects.create(product=product4, spec_type=self.panel_spec_type, value='TN')
+        ids = [self.product1.id, self.product2.id, product3.id, product4.id]
+        
+        data = ComparisonService.get_comparison_data(ids)
+        self.assertEqual([p['id'] for p in data['products']], ids)
+        metrics = {m['id']: {p['product_id']: p for p in m['products']} for m in data['metrics']}
+        
+        ram = metrics[self.ram_spec_type.id]
+        self.assertEqual([pid for pid in ids if ram[pid]['is_best']], [self.product2.id, product3.id])
+        self.assertEqual([pid for pid in ids if ram[pid]['is_worst']], [product4.id])
+        self.assertFalse(any(v['is_tie'] for v in ram.values()))
+        
+        panel = metrics[self.panel_spec_type.id]
+        self.assertEqual([pid for pid in ids if panel[pid]['is_best']], [product3.id])
+        self.assertEqual([pid for pid in ids if panel[pid]['is_worst']], [product4.id])
+        
+        # У двух новых товаров нет накопителя — они худшие
+        storage = metrics[self.storage_spec_type.id]
+        self.assertEqual([pid for pid in ids if storage[pid]['is_best']], [self.product1.id])
+        self.assertEqual([pid for pid in ids if storage[pid]['is_worst']], [product3.id, product4.id])
+        self.assertEqual(storage[product3.id]['raw_value'], '—')
+        
+        # Тот же набор в другом порядке — из кэша, но в порядке запроса
+        reordered = list(reversed(ids))
+        data = ComparisonService.get_comparison_data(reordered)
+        self.assertEqual([p['id'] for p in data['products']], reordered)
+        self.assertEqual([p['product_id'] for p in data['metrics'][0]['products']], reordered)
+
+    def test_spec_types_scoped_to_category(self):
+        """Типы характеристик других категорий в сравнение не попадают."""
+        from index.services import ComparisonService
+        
+        laptops = make_category('Ноутбуки', 'noutbuki')
+        laptop = make_product('Laptop', 'laptop', category=laptops, brand=self.brand)
+        cpu = SpecificationType.objects.create(
+            name='Процессор', comparison_type='higher_better', is_comparable=True
+        )
+        ProductSpecification.objects.create(product=laptop, spec_type=cpu, value='8 ядер')
+        
+        data = ComparisonService.get_comparison_data([self.product1.id, self.product2.id])
+        metric_ids = {m['id'] for m in data['metrics']}
+        self.assertNotIn(cpu.id, metric_ids)
+        self.assertEqual(
+            metric_ids,
+            {self.ram_spec_type.id, self.storage_spec_type.id, self.panel_spec_type.id},
+        )
+
+    def test_cache_invalidated_by_product_and_spec_type_writes(self):
+        from index.services import ComparisonService
+        
+        product3 = make_product('Pixel 8', 'pixel-8', category=self.category, brand=self.brand)
+        pair = [self.product1.id, self.product2.id]
+        trio = pair + [product3.id]
+        ComparisonService.get_comparison_data(pair)
+        ComparisonService.get_comparison_data(trio)
+        with self.assertNumQueries(0):
+            ComparisonService.get_comparison_data(pair)
+            ComparisonService.get_comparison_data(trio)
+        
+        # Характеристика одного товара сбрасывает все сравнения с ним
+        spec = ProductSpecification.objects.get(product=self.product1, spec_type=self.ram_spec_type)
+        spec.value = '16 ГБ'
+        with self.captureOnCommitCallbacks(execute=True):
+            spec.save()
+        for ids in (pair, trio):
+            data = ComparisonService.get_comparison_data(ids)
+            ram = next(m for m in data['metrics'] if m['id'] == self.ram_spec_type.id)
+            self.assertTrue(ram['products'][0]['is_best'])
+        
+        # Цена товара
+        self.product2.price = Decimal('70000.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product2.save()
+        self.assertEqual(ComparisonService.get_comparison_data(pair)['products'][1]['price'], '70000.00')
+        
+        # Настройки типа характеристики действуют на все сравнения
+        self.panel_spec_type.category_map = {'IPS': 100, 'OLED': 10}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.panel_spec_type.save()
+        data = ComparisonService.get_comparison_data(trio)
+        panel = next(m for m in data['metrics'] if m['id'] == self.panel_spec_type.id)
+        self.assertTrue(panel['products'][1]['is_best'])
+        
+        # Тип есть в категории, но не у сравниваемых товаров — строки нет,
+        # поэтому чужая характеристика не делает кэш пары устаревшим
+        with self.captureOnCommitCallbacks(execute=True):
+            weight = SpecificationType.objects.create(name='Вес', comparison_type='lower_better')
+            ProductSpecification.objects.create(product=product3, spec_type=weight, value='190 г')
+        self.assertNotIn(weight.id, {m['id'] for m in ComparisonService.get_comparison_data(pair)['metrics']})
+        self.assertIn(weight.id, {m['id'] for m in ComparisonService.get_comparison_data(trio)['metrics']})
+
+    def test_batch_comparison_constant_queries(self):
+        from index.services import ComparisonService
+        
+        alternatives = [
+            make_product(f'Alt {i}', f'alt-{i}', category=self.category, brand=self.brand)
+            for i in range(10)
+        ]
+        for i, product in enumerate(alternatives):
+            ProductSpecification.objects.create(
+                product=product, spec_type=self.ram_spec_type, value=f'{i + 4} ГБ'
+            )
+        groups = [[self.product1.id, alt.id] for alt in alternatives] + [[self.product1.id]]
+        
+        with self.assertNumQueries(3):
+            results = ComparisonService.get_batch_comparison_data(groups)
+        self.assertEqual(len(results), 11)
+        self.assertIn('error', results[-1])
+        for alt, result in zip(alternatives, results):
+            self.assertEqual([p['id'] for p in result['products']], [self.product1.id, alt.id])
+        # 8 ГБ у product1 против 4..13 ГБ
+        ram = next(m for m in results[0]['metrics'] if m['id'] == self.ram_spec_type.id)
+        self.assertTrue(ram['products'][0]['is_best'])
+        ram = next(m for m in results[9]['metrics'] if m['id'] == self.ram_spec_type.id)
+        self.assertTrue(ram['products'][1]['is_best'])
+        # Одиночное сравнение совпадает с пакетным и берётся из его кэша
+        with self.assertNumQueries(0):
+            single = ComparisonService.get_comparison_data([self.product1.id, alternatives[0].id])
+        self.assertEqual(single, results[0])
+
+    def test_all_equal_values_tie(self):
+        from index.services import ComparisonService
+        
+        for spec in ProductSpecification.objects.filter(spec_type=self.ram_spec_type):
+            spec.value = '8 ГБ'
+            spec.save()
+        data = ComparisonService.get_comparison_data([self.product1.id, self.product2.id])
+        ram = next(m for m in data['metrics'] if m['id'] == self.ram_spec_type.id)
+        self.assertTrue(all(p['is_tie'] and not p['is_best'] and not p['is_worst'] for p in ram['products']))
+
     def test_parse_value_numeric(self):
         """Проверка парсинга числовых значений."""
         from index.services import ComparisonService
@@ -387,10 +1720,10 @@ class ComparisonViewTest(TestCase):
         self.assertContains(response, 'Некорректный формат')
 
     def test_comparison_view_wrong_count(self):
-        """Тест: не 2 товара."""
+        """Тест: меньше 2 товаров."""
         response = self.client.get(reverse('index:comparison') + '?product_ids=1')
         self.assertEqual(response.status_code, 200)
-        self.assertContains(response, 'ровно 2')
+        self.assertContains(response, 'от 2 до 6')
 
     def test_comparison_view_success(self):
         """Тест: успешное сравнение."""
@@ -428,3 +1761,39 @@ class ComparisonAPITest(TestCase):
         self.assertIn('category', data)
         self.assertIn('products', data)
         self.assertIn('metrics', data)
+
+    def test_api_three_products(self):
+        product3 = make_product('Pixel', 'pixel', category=self.category, brand=self.product1.brand)
+        ids = [product3.id, self.product1.id, self.product2.id]
+        url = reverse('index:api_comparison') + '?product_ids=' + ','.join(map(str, ids))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['id'] for p in response.json()['products']], ids)
+
+    def test_batch_api(self):
+        product3 = make_product('Pixel', 'pixel', category=self.category, brand=self.product1.brand)
+        other = make_product('Laptop', 'laptop', category=make_category('Ноутбуки', 'noutbuki'),
+                             brand=self.product1.brand)
+        url = reverse('index:api_comparison_batch') + (
+            f'?sets={self.product1.id},{self.product2.id};{self.product1.id},{product3.id};'
+            f'{self.product1.id},{other.id}'
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        comparisons = response.json()['comparisons']
+        self.assertEqual(
+            [[p['id'] for p in c['products']] for c in comparisons[:2]],
+            [[self.product1.id, self.product2.id], [self.product1.id, product3.id]],
+        )
+        self.assertEqual(comparisons[2], {'error': 'Товары должны быть из одной категории'})
+        self.assertIn('public', response.headers['Cache-Control'])
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=response.headers['ETag']).status_code, 304
+        )
+
+    def test_batch_api_invalid(self):
+        url = reverse('index:api_comparison_batch')
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url + '?sets=1,a').status_code, 400)
+        self.assertEqual(self.client.get(url + '?sets=' + ';'.join(['1,2'] * 51)).status_code, 400)
+
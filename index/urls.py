@@ -1,5 +1,8 @@
 from django.urls import path
-from .views import ProductListView, ProductDetailView, ProductSearchView, ComparisonView, ComparisonAPIView
+from .views import (
+    ProductListView, ProductDetailView, ProductSearchView, ComparisonView, ComparisonAPIView,
+    ComparisonBatchAPIView, SearchSuggestView, ProductReviewsView,
+)
 
 app_name = 'index'
 
@@ -9,6 +12,7 @@ urlpatterns = [
 
     # Страница конкретного товара
     path('product/<slug:slug>/', ProductDetailView.as_view(), name='product_detail'),
+    path('product/<slug:slug>/reviews/', ProductReviewsView.as_view(), name='product_reviews'),
 
     # Поиск
     path('search/', ProductSearchView.as_view(), name='search'),
@@ -20,4 +24,6 @@ urlpatterns = [
 # API URLs
 urlpatterns += [
     path('api/comparison/', ComparisonAPIView.as_view(), name='api_comparison'),
+    path('api/comparison/batch/', ComparisonBatchAPIView.as_view(), name='api_comparison_batch'),
+    path('api/search/suggest/', SearchSuggestView.as_view(), name='api_search_suggest'),
 ]
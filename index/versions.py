@@ -0,0 +1,128 @@
+"""
+Счётчики версий товаров в кэше.
+
+Версия товара растёт при любом изменении, видимом на его странице или в
+сравнении: сам товар, отзывы, остаток, характеристики, изображения, итоговая
+цена после смены скидки. Из версий собираются валидаторы HTTP-кэша (ETag)
+и ключи кэшей, которые иначе пришлось бы сбрасывать перебором.
+
+Отдельный общий счётчик — версия типов характеристик: приоритет, единицы,
+category_map и названия влияют на сравнение любых товаров сразу. Ещё один —
+версия цен: растёт, только когда меняется итоговая цена какого-то товара или
+товар удаляется; по ней кэшируются суммы корзин.
+
+Пропавший из кэша счётчик заводится заново с текущего времени в мс — новое
+значение не совпадёт со старыми, и устаревшие ETag/ключи не оживут.
+
+get_counter/get_counters/bump_counter — общая реализация таких счётчиков
+для всего проекта: версии индексов, словаря тегов, сайдбара, корзины.
+Счётчики статистики (increment_counter) — наоборот, начинаются с нуля.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+PRODUCT_VERSION_KEY = 'product_version:{}'
+SPEC_TYPES_VERSION_KEY = 'spec_types:version'
+PRICES_VERSION_KEY = 'prices:version'
+
+
+def get_counters(keys, backend=cache):
+    """
+    Значения счётчиков; пропавшие заводятся с текущего времени в мс.
+
+    Returns:
+        dict: ключ -> значение
+    """
+    keys = list(keys)
+    found = backend.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        start = int(time.time() * 1000)
+        for key in missing:
+            backend.add(key, start, None)
+        found.update(backend.get_many(missing))
+    return found
+
+
+def get_counter(key, backend=cache):
+    value = backend.get(key)
+    if value is None:
+        backend.add(key, int(time.time() * 1000), None)
+        value = backend.get(key)
+    return value
+
+
+def bump_counter(key, backend=cache):
+    """
+    Returns:
+        int|None: новое значение или None, если счётчика нет — он заведётся
+        заново при чтении, и старые значения с ним не совпадут
+    """
+    try:
+        return backend.incr(key)
+    except ValueError:
+        return None
+
+
+def increment_counter(key, backend=cache):
+    """Счётчик событий для статистики: пропавший начинается с нуля, а не со времени."""
+    try:
+        return backend.incr(key)
+    except ValueError:
+        backend.add(key, 0, None)
+        return backend.incr(key)
+
+
+def bump_counters(keys, backend=cache):
+    for key in set(keys):
+        bump_counter(key, backend)
+
+
+def bump_around_commit(keys, backend=cache):
+    """
+    Поднимает счётчики сразу — чтобы этот же запрос не прочитал старое, —
+    и после коммита — чтобы другой процесс не закэшировал данные, прочитанные
+    до коммита, под новой версией.
+    """
+    keys = set(keys)
+    bump_counters(keys, backend)
+    transaction.on_commit(lambda: bump_counters(keys, backend))
+
+
+def product_versions(product_ids, key_template=PRODUCT_VERSION_KEY):
+    """
+    Args:
+        key_template: шаблон ключа счётчика товара — свой у каждого кэша
+            (версия товара, словарь тегов отзывов)
+
+    Returns:
+        dict: product_id -> версия
+    """
+    keys = {pid: key_template.format(pid) for pid in product_ids}
+    found = get_counters(keys.values())
+    return {pid: found.get(key) for pid, key in keys.items()}
+
+
+def product_version(product_id):
+    return product_versions([product_id])[product_id]
+
+
+def bump_products(product_ids):
+    """Вызывать после коммита — иначе другой процесс закэширует старые данные под новой версией."""
+    bump_counters(PRODUCT_VERSION_KEY.format(pid) for pid in product_ids)
+
+
+def spec_types_version():
+    return get_counter(SPEC_TYPES_VERSION_KEY)
+
+
+def bump_spec_types():
+    """Вызывать после коммита, как bump_products."""
+    bump_counter(SPEC_TYPES_VERSION_KEY)
+
+
+def bump_prices():
+    """Вызывать после коммита, как bump_products."""
+    bump_counter(PRICES_VERSION_KEY)
@@ -1,104 +1,194 @@
 # index/views.py
-from collections import defaultdict
+from decimal import Decimal, InvalidOperation
 from django.views.generic import ListView, DetailView, FormView
 from django.views.generic.detail import SingleObjectMixin
 from django.urls import reverse
-from django.shortcuts import redirect
-from django.db.models import Q, Avg
+from django.shortcuts import get_object_or_404, redirect, render
+from django.views import View
 from django.core.cache import cache
 from django.utils.decorators import method_decorator
 from django_ratelimit.decorators import ratelimit
 import logging
-from .models import Product, Category, Brand, Tag, Banner, ProductSpecification, SpecificationType, Review
+from .models import Product
+from .facets import (
+    DISCOUNT_KEY, RELEVANCE, IdList, ProductIdList, brand_key, category_key, filter_signature, get_facet_index,
+    spec_key, tag_key,
+)
+from .pagination import KeysetPaginationMixin, decode_review_cursor
+from .review_tags import tag_cloud
+from .reviews import review_page
+from .fuzzy import get_fuzzy_index
+from . import search_cache
+from .search import get_search_backend
+from .similar import get_similar_index
+from .spec_scores import top_in_category
+from .spec_values import parse_user_number, products_in_range
+from .sidebar import SidebarMixin, get_version as sidebar_version
+from .conditional import ConditionalGetMixin, listing_etag_parts, viewer_state
+from .versions import product_version, product_versions, spec_types_version
 from cart.forms import CartAddProductForm
 from .forms import ReviewForm
 
 logger = logging.getLogger(__name__)
-SIDEBAR_CACHE_TTL = 60 * 15  # 15 минут
+FACET_COUNTS_CACHE_TTL = 60 * 5  # версия индекса в ключе, TTL только вытесняет холодные подписи
 MAX_PRICE_VALUE = 10_000_000  # Максимальная цена для защиты от DoS
+RANGE_SUFFIXES = ('_from', '_to')  # spec_<slug>_from / spec_<slug>_to — диапазон числовой характеристики
 
 
-class ProductListView(ListView):
+class ProductListView(ConditionalGetMixin, SidebarMixin, KeysetPaginationMixin, ListView):
     model = Product
     template_name = 'index/index.html'
     context_object_name = 'products'
     paginate_by = 12
 
+    sort_map = {
+        'price_asc':  'final_price',
+        'price_desc': '-final_price',
+        'new':        '-id',
+        'rating':     '-rating_avg',
+        'score':      '-spec_score',
+    }
+    default_order = '-id'
+    show_category_top = True
+
+    def get_etag_parts(self, request, *args, **kwargs):
+        return listing_etag_parts(request)
+
     def get_queryset(self):
-        queryset = Product.objects.select_related(
-            'category', 'brand', 'discount')
+        """
+        Фильтрация через битмап-индекс фасетов: в БД уходит только
+        запрос за товарами текущей страницы.
+        """
+        self.facet_index = index = get_facet_index()
+        self.facet_groups = self.get_facet_groups(index)
+        self.spec_ranges = self.get_spec_ranges(index)
+        self.price_from = self._parse_price(self.request.GET.get('price_from'), 'price_from')
+        self.price_to = self._parse_price(self.request.GET.get('price_to'), 'price_to')
+        sort = self.request.GET.get('sort', '')
+        self.keyset_order = self.sort_map.get(sort, self.default_order)
+        return self.get_product_ids(index)
+
+    def get_product_ids(self, index):
+        self.price_base = (
+            index.price_mask(self.price_from, self.price_to)
+            & self.get_range_mask(index)
+            & self.get_base_mask(index)
+        )
+        mask = index.select(self.facet_groups) & self.price_base
+        return ProductIdList(
+            self.get_product_queryset(), index, mask, self.keyset_order, self.get_ranking()
+        )
 
+    def get_product_queryset(self):
+        return Product.objects.select_related('category', 'brand', 'discount')
+
+    def get_base_mask(self, index):
+        """Товары, к которым применяются фильтры сайдбара (в каталоге — все)."""
+        return index.universe
+
+    def get_ranking(self):
+        """id товаров в порядке релевантности для сортировки RELEVANCE."""
+        return None
+
+    def get_facet_groups(self, index):
+        """Группы ключей фасетов из GET-параметров: OR внутри группы, AND между группами."""
+        groups = {}
         category_slugs = self.request.GET.getlist('category')
         brand_slugs = self.request.GET.getlist('brand')
         tag_slugs = self.request.GET.getlist('tag')
-        discount = self.request.GET.get('discount')
-        price_from = self.request.GET.get('price_from')
-        price_to = self.request.GET.get('price_to')
-
-        # Фильтр по цене с валидацией (защита от DoS)
-        if price_from:
-            try:
-                price_val = float(self._clean_price(price_from))
-                if price_val > MAX_PRICE_VALUE:
-                    logger.warning(f"Попытка фильтрации с чрезмерной ценой: {price_from}")
-                    price_val = MAX_PRICE_VALUE
-                queryset = queryset.filter(price__gte=price_val)
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Некорректное значение price_from: {price_from}, ошибка: {e}")
-                pass
-        if price_to:
-            try:
-                price_val = float(self._clean_price(price_to))
-                if price_val > MAX_PRICE_VALUE:
-                    logger.warning(f"Попытка фильтрации с чрезмерной ценой: {price_to}")
-                    price_val = MAX_PRICE_VALUE
-                queryset = queryset.filter(price__lte=price_val)
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Некорректное значение price_to: {price_to}, ошибка: {e}")
-                pass
 
         if category_slugs:
-            queryset = queryset.filter(category__slug__in=category_slugs)
+            groups['category'] = [category_key(slug) for slug in category_slugs]
         if brand_slugs:
-            queryset = queryset.filter(brand__slug__in=brand_slugs)
+            groups['brand'] = [brand_key(slug) for slug in brand_slugs]
         if tag_slugs:
-            queryset = queryset.filter(tags__slug__in=tag_slugs)
-        if discount == '1':
-            queryset = queryset.filter(discount__isnull=False)
-
-        # Фильтр по характеристикам с валидацией spec_slug (защита от SQL-инъекции)
-        spec_filters = {}
-        valid_spec_slugs = set(
-            SpecificationType.objects.values_list('slug', flat=True)
-        )
+            groups['tag'] = [tag_key(slug) for slug in tag_slugs]
+        if self.request.GET.get('discount') == '1':
+            groups['discount'] = [DISCOUNT_KEY]
+
+        # Фильтр по характеристикам: учитываем только известные индексу slug-и
+        valid_spec_slugs = index.spec_slugs
         for key, values in self.request.GET.lists():
             if key.startswith('spec_'):
                 spec_slug = key.replace('spec_', '', 1)  # Удаляем только первый 'spec_'
-                # Валидация: slug должен существовать в БД и быть безопасным
+                if spec_slug not in valid_spec_slugs and self._split_range_param(key, valid_spec_slugs):
+                    continue  # диапазон — get_spec_ranges()
                 if spec_slug in valid_spec_slugs and spec_slug.replace('-', '').replace('_', '').isalnum():
-                    spec_filters[spec_slug] = values
+                    groups[f'spec:{spec_slug}'] = [spec_key(spec_slug, v) for v in values]
                 else:
                     logger.warning(f"Попытка инъекции через spec_slug: {spec_slug}")
 
-        if spec_filters:
-            for spec_slug, values in spec_filters.items():
-                queryset = queryset.filter(
-                    specifications__spec_type__slug=spec_slug,
-                    specifications__value__in=values
-                )
+        return groups
 
-        queryset = queryset.distinct()
+    def get_spec_ranges(self, index):
+        """
+        Диапазоны числовых характеристик из GET: spec_ram_from=16, spec_screen_to=6.7.
 
-        sort = self.request.GET.get('sort', '')
-        sort_map = {
-            'price_asc':  'price',
-            'price_desc': '-price',
-            'new':        '-id',
-        }
-        if sort in sort_map:
-            queryset = queryset.order_by(sort_map[sort])
+        Returns:
+            dict: slug характеристики -> (от, до), любая граница может быть None
+        """
+        ranges = {}
+        for key, value in self.request.GET.items():
+            param = self._split_range_param(key, index.spec_slugs)
+            if param is None:
+                continue
+            number = parse_user_number(value)
+            if number is None:
+                continue
+            spec_slug, suffix = param
+            low, high = ranges.get(spec_slug, (None, None))
+            ranges[spec_slug] = (number, high) if suffix == '_from' else (low, number)
+        return ranges
 
-        return queryset
+    @staticmethod
+    def _split_range_param(key, valid_spec_slugs):
+        """'spec_ram_from' → ('ram', '_from') или None, если это не диапазон известной характеристики."""
+        if not key.startswith('spec_'):
+            return None
+        for suffix in RANGE_SUFFIXES:
+            if key.endswith(suffix):
+                spec_slug = key[len('spec_'):-len(suffix)]
+                if spec_slug in valid_spec_slugs:
+                    return spec_slug, suffix
+        return None
+
+    def get_range_mask(self, index):
+        """Товары в диапазонах числовых характеристик — по запросу на диапазон по индексу."""
+        mask = index.universe
+        for spec_slug, (low, high) in self.spec_ranges.items():
+            mask &= index.mask_of(products_in_range(spec_slug, low, high))
+        return mask
+
+    def _parse_price(self, value, name):
+        """Цена из GET с валидацией (защита от DoS) или None."""
+        if not value:
+            return None
+        try:
+            price_val = Decimal(self._clean_price(value))
+        except (InvalidOperation, ValueError, TypeError) as e:
+            logger.warning(f"Некорректное значение {name}: {value}, ошибка: {e}")
+            return None
+        if not price_val.is_finite():
+            logger.warning(f"Некорректное значение {name}: {value}")
+            return None
+        if price_val > MAX_PRICE_VALUE:
+            logger.warning(f"Попытка фильтрации с чрезмерной ценой: {value}")
+            price_val = Decimal(MAX_PRICE_VALUE)
+        return price_val
+
+    def get_facet_counts(self):
+        """
+        Счётчики фасетов сайдбара для текущих фильтров.
+        Кэшируются по версии индекса и нормализованной подписи фильтров.
+        """
+        index = self.facet_index
+        signature = filter_signature(self.facet_groups, self.price_from, self.price_to, self.spec_ranges)
+        cache_key = f'facet_counts:{index.version}:{signature}'
+        counts = cache.get(cache_key)
+        if counts is None:
+            counts = index.facet_counts(self.facet_groups, self.price_base)
+            cache.set(cache_key, counts, FACET_COUNTS_CACHE_TTL)
+        return counts
 
     def get(self, request, *args, **kwargs):
         # Сначала получаем контекст
@@ -108,6 +198,8 @@ class ProductListView(ListView):
         # Проверяем HTMX-запрос
         if request.headers.get('HX-Request'):
             from django.template.response import TemplateResponse
+            # Сайдбар вне #search-results — счётчики обновляем out-of-band
+            context['facet_counts_oob'] = True
             partial = getattr(self, 'htmx_partial_template', 'index/partials/product_list.html')
             return TemplateResponse(request, partial, context)
         
@@ -118,38 +210,19 @@ class ProductListView(ListView):
         context = super().get_context_data(**kwargs)
         params = self.request.GET.copy()
         params.pop('page', None)
+        params.pop('cursor', None)
         context['query_string'] = params.urlencode()
-
-        # Кэшируем данные сайдбара — они меняются редко
-        sidebar = cache.get('sidebar_data')
-        if sidebar is None:
-            sidebar = {
-                'categories': list(Category.objects.all()),
-                'brands': list(Brand.objects.all()),
-                'tags': list(Tag.objects.all()),
-                'banners': list(Banner.objects.filter(is_active=True)),
-                'spec_filters': self.get_spec_filters(),
-            }
-            cache.set('sidebar_data', sidebar, SIDEBAR_CACHE_TTL)
-
-        context.update(sidebar)
-
-        # selected_values зависят от GET — копируем список чтобы не мутировать кэш
-        context['spec_filters'] = [
-            {**sf, 'selected_values': self.request.GET.getlist(f'spec_{sf["slug"]}')}
-            for sf in context.get('spec_filters', [])
-        ]
-
-        context['selected_categories'] = self.request.GET.getlist('category')
-        context['selected_brands'] = self.request.GET.getlist('brand')
-        context['selected_tags'] = self.request.GET.getlist('tag')
-        context['discount_only'] = self.request.GET.get('discount') == '1'
-        context['price_from'] = self.request.GET.get('price_from')
-        context['price_to'] = self.request.GET.get('price_to')
-        context['current_sort'] = self.request.GET.get('sort', '')
-
+        context['facet_counts'] = self.get_facet_counts()
+        context['category_top'] = self.get_category_top()
         return context
 
+    def get_category_top(self):
+        """Топ по характеристикам, когда выбрана ровно одна категория — один запрос по индексу."""
+        category_slugs = self.request.GET.getlist('category')
+        if not self.show_category_top or len(category_slugs) != 1:
+            return []
+        return list(top_in_category(category_slugs[0]))
+
     @staticmethod
     def _clean_price(value):
         """
@@ -163,26 +236,29 @@ class ProductListView(ListView):
         # Оставшаяся запятая — десятичный разделитель
         return value.replace(',', '.')
 
-    def get_spec_filters(self):
-        """Получает уникальные значения для каждого типа характеристик — 1 запрос"""
-        rows = (
-            ProductSpecification.objects
-            .select_related('spec_type')
-            .values_list('spec_type__slug', 'spec_type__name', 'value')
-            .distinct()
-            .order_by('spec_type__name', 'value')
-        )
 
-        grouped = defaultdict(lambda: {'values': []})
-        for slug, name, value in rows:
-            grouped[slug]['name'] = name
-            grouped[slug]['slug'] = slug
-            grouped[slug]['values'].append(value)
-
-        return list(grouped.values())
+class ReviewFilterMixin:
+    """Фильтры списка отзывов из GET: оценка 1–5 и тег."""
+
+    def get_review_filters(self):
+        rating = self.request.GET.get('rating', '')
+        rating = int(rating) if rating in ('1', '2', '3', '4', '5') else None
+        tag = self.request.GET.get('tag', '').strip()[:255] or None
+        return rating, tag
+
+    def get_review_context(self, product, cursor=None):
+        rating, tag = self.get_review_filters()
+        reviews, next_cursor = review_page(product, cursor, rating=rating, tag=tag)
+        return {
+            'product': product,
+            'reviews': reviews,
+            'reviews_next_cursor': next_cursor,
+            'review_rating': rating,
+            'review_tag': tag,
+        }
 
 
-class ProductDisplay(DetailView):
+class ProductDisplay(ConditionalGetMixin, ReviewFilterMixin, DetailView):
     model = Product
     template_name = 'index/product_detail.html'
     context_object_name = 'product'
@@ -193,18 +269,60 @@ class ProductDisplay(DetailView):
         ).prefetch_related(
             'images', 
             'specifications__spec_type',
-            'reviews__user'
-        ).annotate(
-            avg_rating=Avg('reviews__rating')
+        )
+
+    def get_etag_parts(self, request, *args, **kwargs):
+        # Один индексный запрос вместо загрузки товара со связями и отзывами
+        row = Product.objects.filter(slug=kwargs['slug']).values_list('id', 'updated_at', 'category_id').first()
+        if row is None:
+            return None
+        product_id, updated_at, category_id = row
+        # Блок похожих товаров: их набор и их собственные версии (цена, рейтинг)
+        self.similar_ids = get_similar_index().similar(product_id, category_id)
+        return (
+            product_id, updated_at, sorted(product_versions([product_id, *self.similar_ids]).items()),
+            sidebar_version(), viewer_state(request),
         )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['cart_product_form'] = CartAddProductForm()
         context['review_form'] = ReviewForm()
-        context['reviews'] = self.object.reviews.all()
+        # Только первая страница отзывов, остальные — по «Показать ещё»
+        context.update(self.get_review_context(self.object))
+        context['review_tag_cloud'] = tag_cloud(self.object)
+        context['similar_products'] = self.get_similar_products(self.object)
         return context
 
+    def get_similar_products(self, product):
+        similar_ids = getattr(self, 'similar_ids', None)
+        if similar_ids is None:
+            # ETag не считался (есть flash-сообщения) — ищем здесь
+            similar_ids = get_similar_index().similar(product.id, product.category_id)
+        found = Product.objects.select_related('category', 'brand', 'discount').filter(
+            category_id=product.category_id,
+        ).in_bulk(similar_ids)
+        return [found[pid] for pid in similar_ids if pid in found]
+
+
+class ProductReviewsView(ConditionalGetMixin, ReviewFilterMixin, View):
+    """
+    Следующая страница отзывов товара (HTMX «Показать ещё» и фильтры).
+    URL: /product/<slug>/reviews/?cursor=<курсор>&rating=<1-5>&tag=<тег>
+    """
+    template_name = 'index/partials/review_list.html'
+    conditional_vary = ()  # фрагмент без CSRF и корзины, одинаков для всех
+    conditional_private = False
+
+    def get_etag_parts(self, request, slug):
+        product_id = Product.objects.filter(slug=slug).values_list('id', flat=True).first()
+        return None if product_id is None else (product_id, product_version(product_id))
+
+    def get(self, request, slug):
+        product = get_object_or_404(Product.objects.only('id', 'slug'), slug=slug)
+        cursor = decode_review_cursor(request.GET.get('cursor'))
+        return render(request, self.template_name, self.get_review_context(product, cursor))
+
 
 class ReviewFormView(SingleObjectMixin, FormView):
     template_name = 'index/product_detail.html'
@@ -240,162 +358,61 @@ class ProductDetailView(DetailView):
         return view(request, *args, **kwargs)
 
 
-class ProductSearchView(ListView):
-    model = Product
+class ProductSearchView(ProductListView):
+    """
+    Поиск: бэкенд (SEARCH_BACKEND) находит id товаров по релевантности,
+    фильтры сайдбара накладываются на них через индекс фасетов.
+    """
     template_name = 'index/search.html'
     htmx_partial_template = 'index/partials/search_results_only.html'
-    context_object_name = 'products'
-    paginate_by = 12
-
-    def get(self, request, *args, **kwargs):
-        # Сначала получаем контекст
-        self.object_list = self.get_queryset()
-        context = self.get_context_data()
-
-        # Проверяем HTMX-запрос
-        if request.headers.get('HX-Request'):
-            from django.template.response import TemplateResponse
-            return TemplateResponse(request, self.htmx_partial_template, context)
-
-        # Обычный запрос
-        return self.render_to_response(context)
-
-    def get_queryset(self):
-        # Начинаем с базового queryset (с select_related/prefetch_related)
-        queryset = Product.objects.select_related(
-            'category', 'brand', 'discount', 'stock').prefetch_related('images', 'tags')
-
-        query = self.request.GET.get('q')
-
-        if query:
-            # Фильтруем по названию или описанию (регистронезависимо)
-            queryset = queryset.filter(
-                Q(name__icontains=query) |
-                Q(description__icontains=query)
-            ).distinct()
-        else:
-            # Если запрос пустой — возвращаем пустой queryset
-            queryset = Product.objects.none()
-
-        # Применяем фильтры из сайдбара (если есть)
-        category_slugs = self.request.GET.getlist('category')
-        brand_slugs = self.request.GET.getlist('brand')
-        tag_slugs = self.request.GET.getlist('tag')
-        discount = self.request.GET.get('discount')
-        price_from = self.request.GET.get('price_from')
-        price_to = self.request.GET.get('price_to')
-
-        # Фильтр по цене
-        if price_from:
-            try:
-                price_val = float(self._clean_price(price_from))
-                queryset = queryset.filter(price__gte=price_val)
-            except (ValueError, TypeError):
-                pass
-        if price_to:
-            try:
-                price_val = float(self._clean_price(price_to))
-                queryset = queryset.filter(price__lte=price_val)
-            except (ValueError, TypeError):
-                pass
-
-        if category_slugs:
-            queryset = queryset.filter(category__slug__in=category_slugs)
-        if brand_slugs:
-            queryset = queryset.filter(brand__slug__in=brand_slugs)
-        if tag_slugs:
-            queryset = queryset.filter(tags__slug__in=tag_slugs)
-        if discount == '1':
-            queryset = queryset.filter(discount__isnull=False)
-
-        # Фильтр по характеристикам
-        from collections import defaultdict
-        spec_filters = {}
-        valid_spec_slugs = set(
-            SpecificationType.objects.values_list('slug', flat=True)
+    default_order = RELEVANCE
+    show_category_top = False
+
+    def get_product_ids(self, index):
+        """Упорядоченные id результата — из кэша или поиском с фильтрами по индексу."""
+        self.query = self.request.GET.get('q', '').strip()
+        self.search_backend = get_search_backend()
+        key = search_cache.cache_key(
+            index.version, self.query,
+            filter_signature(self.facet_groups, self.price_from, self.price_to, self.spec_ranges),
+            self.keyset_order,
         )
-        for key, values in self.request.GET.lists():
-            if key.startswith('spec_'):
-                spec_slug = key.replace('spec_', '', 1)
-                if spec_slug in valid_spec_slugs and spec_slug.replace('-', '').replace('_', '').isalnum():
-                    spec_filters[spec_slug] = values
-
-        if spec_filters:
-            for spec_slug, values in spec_filters.items():
-                queryset = queryset.filter(
-                    specifications__spec_type__slug=spec_slug,
-                    specifications__value__in=values
-                )
+        cached = search_cache.get_results(key)
+        if cached is not None:
+            ids, self.fuzzy, self.facet_counts = cached
+            return IdList(self.get_product_queryset(), ids, self.keyset_order)
+
+        product_ids = super().get_product_ids(index)
+        # Счётчики зависят от запроса — кэшируются вместе с результатом
+        self.facet_counts = (
+            index.facet_counts(self.facet_groups, self.price_base) if self.query else {}
+        )
+        search_cache.store_results(key, product_ids.ids, self.fuzzy, self.facet_counts)
+        return product_ids
 
-        queryset = queryset.distinct()
+    def get_base_mask(self, index):
+        self.ranking = self.search_backend.search(self.query) if self.query else []
+        self.fuzzy = False
+        if self.query and not self.ranking:
+            # Опечатка или не та раскладка — похожие по триграммам товары
+            self.ranking = get_fuzzy_index().search(self.query)
+            self.fuzzy = bool(self.ranking)
+        return index.mask_of(self.ranking)
 
-        # Сортировка
-        sort = self.request.GET.get('sort', '')
-        sort_map = {
-            'price_asc':  'price',
-            'price_desc': '-price',
-            'new':        '-id',
-        }
-        if sort in sort_map:
-            queryset = queryset.order_by(sort_map[sort])
+    def get_ranking(self):
+        return self.ranking
 
-        return queryset
+    def get_facet_counts(self):
+        return self.facet_counts
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Добавляем поисковый запрос в контекст
         context['query'] = self.request.GET.get('q', '')
-
-        # Для пагинации сохраняем query в контекст
-        params = self.request.GET.copy()
-        params.pop('page', None)
-        context['query_string'] = params.urlencode()
-
-        # Добавляем данные для фильтров (как в ProductListView)
-        context['categories'] = Category.objects.all()
-        context['brands'] = Brand.objects.all()
-        context['tags'] = Tag.objects.all()
-        context['spec_filters'] = [
-            {**sf, 'selected_values': self.request.GET.getlist(f'spec_{sf["slug"]}')}
-            for sf in self.get_spec_filters()
-        ]
-        context['selected_categories'] = self.request.GET.getlist('category')
-        context['selected_brands'] = self.request.GET.getlist('brand')
-        context['selected_tags'] = self.request.GET.getlist('tag')
-        context['discount_only'] = self.request.GET.get('discount') == '1'
-        context['price_from'] = self.request.GET.get('price_from')
-        context['price_to'] = self.request.GET.get('price_to')
-        context['current_sort'] = self.request.GET.get('sort', '')
-
+        context['fuzzy_results'] = self.fuzzy
+        for product in context['object_list']:
+            product.search_snippet = self.search_backend.highlight(product.description, self.query)
         return context
 
-    @staticmethod
-    def _clean_price(value):
-        """Очищает ввод цены: '35 000,50' → '35000.50', '40.000' → '40000'."""
-        import re
-        value = value.replace(' ', '')
-        value = re.sub(r'[.,](\d{3})(?!\d)', r'\1', value)
-        return value.replace(',', '.')
-
-    def get_spec_filters(self):
-        """Получает уникальные значения для каждого типа характеристик."""
-        from collections import defaultdict
-        rows = (
-            ProductSpecification.objects
-            .select_related('spec_type')
-            .values_list('spec_type__slug', 'spec_type__name', 'value')
-            .distinct()
-            .order_by('spec_type__name', 'value')
-        )
-
-        grouped = defaultdict(lambda: {'values': []})
-        for slug, name, value in rows:
-            grouped[slug]['name'] = name
-            grouped[slug]['slug'] = slug
-            grouped[slug]['values'].append(value)
-
-        return list(grouped.values())
-
     @method_decorator(ratelimit(key='ip', rate='10/m', block=True))
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
@@ -405,6 +422,7 @@ class ProductSearchView(ListView):
 from django.http import JsonResponse
 from django.views import View
 from .services import ComparisonService
+from .suggest import DEFAULT_LIMIT as DEFAULT_SUGGEST_LIMIT, get_suggest_index
 
 
 class ComparisonView(View):
@@ -426,9 +444,6 @@ class ComparisonView(View):
         except ValueError:
             return render(request, self.template_name, {'error': 'Некорректный формат ID товаров'})
         
-        if len(product_ids) != 2:
-            return render(request, self.template_name, {'error': 'Для сравнения нужно выбрать ровно 2 товара'})
-        
         comparison_data = ComparisonService.get_comparison_data(product_ids)
         
         if 'error' in comparison_data:
@@ -437,11 +452,52 @@ class ComparisonView(View):
         return render(request, self.template_name, {'comparison_data': comparison_data})
 
 
-class ComparisonAPIView(View):
+class SearchSuggestView(View):
+    """
+    Подсказки поисковой строки из индекса в памяти — без запросов к БД.
+    URL: /api/search/suggest/?q=<префикс>&limit=<k>
+
+    Для HTMX отдаёт выпадающий список, иначе JSON.
+    """
+    template_name = 'index/partials/search_suggest.html'
+
+    def get(self, request):
+        from django.shortcuts import render
+        query = request.GET.get('q', '')
+        try:
+            limit = int(request.GET.get('limit', DEFAULT_SUGGEST_LIMIT))
+        except ValueError:
+            limit = DEFAULT_SUGGEST_LIMIT
+        suggestions = get_suggest_index().suggest(query, limit)
+
+        if request.headers.get('HX-Request'):
+            return render(request, self.template_name, {'suggestions': suggestions, 'query': query})
+        return JsonResponse({
+            'query': query,
+            'suggestions': [
+                {'kind': s.kind, 'label': s.label, 'url': s.url} for s in suggestions
+            ],
+        })
+
+
+class ComparisonAPIView(ConditionalGetMixin, View):
     """
     API для получения данных сравнения.
     URL: /api/comparison/
     """
+    conditional_vary = ()
+    conditional_private = False
+
+    def get_etag_parts(self, request):
+        try:
+            product_ids = [int(x) for x in request.GET.get('product_ids', '').split(',')]
+        except ValueError:
+            return None
+        if len(set(product_ids)) > ComparisonService.MAX_PRODUCTS:
+            return None
+        # Те же версии, что в ключе кэша сравнения
+        return (sorted(product_versions(product_ids).items()), spec_types_version())
+
     def get(self, request):
         product_ids_param = request.GET.get('product_ids', '')
         
@@ -459,3 +515,44 @@ class ComparisonAPIView(View):
             return JsonResponse({'error': comparison_data['error']}, status=400)
         
         return JsonResponse(comparison_data)
+
+
+class ComparisonBatchAPIView(ConditionalGetMixin, View):
+    """
+    Пакетное API сравнения: матрица «товар против альтернатив» одним запросом.
+    URL: /api/comparison/batch/?sets=1,2;1,3;1,4
+
+    Наборы разделяются «;», id внутри набора — «,». Ответ — {"comparisons": [...]}
+    в порядке наборов; ошибка набора ({"error": ...}) не мешает остальным.
+    """
+    conditional_vary = ()
+    conditional_private = False
+
+    def parse_sets(self, request):
+        """
+        Returns:
+            list|None: списки id или None, если параметр некорректен
+        """
+        raw = request.GET.get('sets', '')
+        try:
+            groups = [[int(x) for x in part.split(',')] for part in raw.split(';') if part]
+        except ValueError:
+            return None
+        if not groups or len(groups) > ComparisonService.MAX_BATCH:
+            return None
+        return groups
+
+    def get_etag_parts(self, request):
+        groups = self.parse_sets(request)
+        if groups is None or any(len(set(ids)) > ComparisonService.MAX_PRODUCTS for ids in groups):
+            return None
+        product_ids = {pid for ids in groups for pid in ids}
+        return (sorted(product_versions(product_ids).items()), spec_types_version())
+
+    def get(self, request):
+        groups = self.parse_sets(request)
+        if groups is None:
+            return JsonResponse({
+                'error': f'Укажите от 1 до {ComparisonService.MAX_BATCH} наборов: sets=1,2;1,3'
+            }, status=400)
+        return JsonResponse({'comparisons': ComparisonService.get_batch_comparison_data(groups)})
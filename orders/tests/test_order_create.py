@@ -141,6 +141,20 @@ class OrderCreateViewTest(TestCase):
         self.assertRedirects(response, '/cart/')
 
 
+    def test_out_of_stock_blocks_order(self):
+        self._add_to_cart(qty=7)
+        response = self.client.post('/orders/create/', {
+            'first_name': 'Иван',
+            'last_name': 'Иванов',
+            'email': 'ivan@example.com',
+            'address': 'ул. Ленина, 1',
+            'city': 'Москва',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Телефон: доступно 5, в корзине 7')
+        self.assertFalse(Order.objects.exists())
+
+
 class OrderCancelStockTest(TestCase):
     """Возврат остатков при отмене заказа."""
 
@@ -12,7 +12,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
 from django_ratelimit.decorators import ratelimit
 
-from cart.cart import Cart
+from cart.cart import get_cart
 from index.models import Stock
 from .forms import OrderCreateForm
 from .models import Order, OrderItem, Payment
@@ -26,33 +26,27 @@ def _get_nowpayments_ipn_secret():
 
 
 def order_create(request):
-    cart = Cart(request)
-    if len(cart) == 0:
+    cart = get_cart(request)
+    # Позиции, товары и остатки — одним запросом на весь view
+    snapshot = cart.snapshot
+    if not snapshot.lines:
         return redirect('cart:cart_detail')
+    cart_items = snapshot.lines
     if request.method == 'POST':
         form = OrderCreateForm(request.POST)
         if form.is_valid():
-            cart_items = list(cart)
-
             # Валидация остатков перед созданием заказа
             product_ids = [item['product'].id for item in cart_items]
             quantities = {item['product'].id: item['quantity'] for item in cart_items}
-            stocks = {s.product_id: s.quantity for s in Stock.objects.filter(product_id__in=product_ids)}
-            out_of_stock = []
-            for item in cart_items:
-                pid = item['product'].id
-                available = stocks.get(pid, 0)
-                if available < quantities[pid]:
-                    out_of_stock.append(
-                        f"{item['product'].name}: доступно {available}, в корзине {quantities[pid]}"
+            if snapshot.out_of_stock:
+                for item in snapshot.out_of_stock:
+                    messages.error(
+                        request,
+                        f"{item['product'].name}: доступно {item['available']}, в корзине {item['quantity']}",
                     )
-            if out_of_stock:
-                for msg in out_of_stock:
-                    messages.error(request, msg)
-                cart_total_price = sum(item['total_price'] for item in cart_items)
                 return render(request, 'orders/create.html', {
                     'cart': cart, 'cart_items': cart_items,
-                    'cart_total_price': cart_total_price, 'form': form,
+                    'cart_total_price': snapshot.total, 'form': form,
                 })
 
             # Создаём заказ атомарно: Order + OrderItems + обновление Stock
@@ -96,11 +90,9 @@ def order_create(request):
             }
         form = OrderCreateForm(initial=initial)
 
-    cart_items = [item for item in cart]
-    cart_total_price = sum(item['total_price'] for item in cart_items)
     return render(request, 'orders/create.html', {
         'cart': cart, 'cart_items': cart_items,
-        'cart_total_price': cart_total_price, 'form': form,
+        'cart_total_price': snapshot.total, 'form': form,
     })
 
 
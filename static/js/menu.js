@@ -23,3 +23,21 @@ document.addEventListener("DOMContentLoaded", function () {
         }
     });
 });
+
+/* ─── Подсказки поиска: закрытие по Escape и клику вне строки ─── */
+
+document.addEventListener("DOMContentLoaded", function () {
+    const suggest = document.getElementById("search-suggest");
+    if (!suggest) return;
+    const form = suggest.closest("form");
+
+    document.addEventListener("click", function (e) {
+        if (!form.contains(e.target)) suggest.innerHTML = "";
+    });
+    form.addEventListener("keydown", function (e) {
+        if (e.key === "Escape") suggest.innerHTML = "";
+    });
+    form.addEventListener("submit", function () {
+        suggest.innerHTML = "";
+    });
+});